@@ -0,0 +1,142 @@
+"""""
+This module enables approximate nearest-neighbour search over candidate
+embeddings with an inverted-file (IVF) index in pure NumPy.
+
+Build: spherical k-means splits the normalised candidates into n_lists
+clusters; the vectors are stored grouped by cluster.
+Search: a query is compared with the centroids, and only the vectors of
+the n_probe closest clusters are scored exactly.
+
+The index is saved as .npy files plus meta.json and loaded memory-mapped,
+so it is built once per candidate vocabulary and reused by every round.
+"""""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from knn import normalize_rows
+
+index_version = 1
+
+
+def assign(vectors, centroids, block_size=16384):
+    """
+    Closest centroid (cosine) of every vector, computed block by block.
+    """
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        labels[start:start + block_size] = np.argmax(vectors[start:start + block_size] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_lists, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty clusters with random vectors
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids, assign(vectors, centroids)
+
+
+class IVFIndex:
+    def __init__(self, centroids, vectors, ids, offsets, meta=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, iterations=10, seed=0, key=None):
+        start_time = time.time()
+        vectors = normalize_rows(embeddings)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        centroids, labels = spherical_kmeans(vectors, n_lists, iterations, seed)
+        ids = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        meta = {
+            "version": index_version,
+            "key": key,
+            "count": len(vectors),
+            "dim": int(vectors.shape[1]),
+            "n_lists": n_lists,
+            "build_seconds": round(time.time() - start_time, 3),
+        }
+        print(f"[INFO] Built IVF index with {n_lists} lists over {len(vectors)} vectors "
+              f"in {meta['build_seconds']:.1f}s.")
+        return cls(centroids, vectors[ids], ids, offsets, meta)
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(index_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(index_dir, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != index_version:
+            raise ValueError(f"IVF index in {index_dir} has version {meta.get('version')}, expected {index_version}")
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ("centroids", "vectors", "ids", "offsets")
+        }
+        return cls(meta=meta, **arrays)
+
+    @classmethod
+    def load_or_build(cls, index_dir, embeddings, key, **build_args):
+        """
+        Load the index if it was built for the same candidates (key),
+        otherwise build and save it.
+        """
+        if os.path.exists(os.path.join(index_dir, "meta.json")):
+            index = cls.load(index_dir)
+            if index.meta.get("key") == key:
+                return index
+            print(f"[INFO] IVF index in {index_dir} belongs to other candidates, rebuilding.")
+        index = cls.build(embeddings, key=key, **build_args)
+        index.save(index_dir)
+        return index
+
+    def search(self, query_embeddings, k=20, n_probe=16):
+        """
+        Approximate top-k: indices and cosine scores (queries x k), sorted
+        by decreasing score. Rows with fewer than k candidates are padded
+        with index -1.
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probes):
+            ranges = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            positions = np.concatenate([np.arange(a, b) for a, b in ranges])
+            if not len(positions):
+                continue
+            candidate_scores = self.vectors[positions] @ queries[q]
+            n = min(k, len(positions))
+            keep = np.argpartition(-candidate_scores, n - 1)[:n]
+            keep = keep[np.argsort(-candidate_scores[keep], kind="stable")]
+            indices[q, :n] = self.ids[positions[keep]]
+            scores[q, :n] = candidate_scores[keep]
+        return indices, scores
+
+
+def recall_at_k(approx_indices, exact_indices):
+    hits = [len(set(a) & set(e)) / len(e) for a, e in zip(approx_indices, exact_indices)]
+    return float(np.mean(hits))
@@ -0,0 +1,68 @@
+"""""
+This script benchmarks the IVF index (ann_index.py) against exact top-k
+search (knn.py): recall@k and latency per query for several n_probe values.
+
+Candidates are either stored embeddings (e.g. from the embedding store)
+or a synthetic clustered set of the size of the WordNet vocabulary.
+
+Usage:
+    python benchmark_ann.py --embeddings embedding_store/<key>.npy --queries 200
+    python benchmark_ann.py --synthetic 150000 --n-probe 4 8 16 32
+"""""
+
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, recall_at_k
+from knn import CandidateMatrix, top_k
+
+
+def synthetic_embeddings(n, dim=384, clusters=2000, noise=1.5, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embeddings", default=None, help=".npy file of candidate embeddings")
+    parser.add_argument("--synthetic", type=int, default=150000, help="Number of synthetic candidates (without --embeddings)")
+    parser.add_argument("--noise", type=float, default=1.5, help="Spread of the synthetic clusters (higher is harder)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries (perturbed candidates)")
+    parser.add_argument("--k", type=int, default=20, help="Neighbours per query")
+    parser.add_argument("--n-lists", type=int, default=None, help="IVF lists (default 4 * sqrt(N))")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 16, 32, 64], help="Lists probed per query")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = np.load(args.embeddings, mmap_mode="r")
+    else:
+        embeddings = synthetic_embeddings(args.synthetic, noise=args.noise)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(embeddings), args.queries, replace=False)
+    queries = np.asarray(embeddings[picks], dtype=np.float32)
+    queries = queries + 0.1 * queries.std() * rng.standard_normal(queries.shape).astype(np.float32)
+    print(f"[INFO] {len(embeddings)} candidates, {len(queries)} queries, k={args.k}")
+
+    candidates = CandidateMatrix(embeddings)
+    start_time = time.time()
+    exact_indices, _ = top_k(queries, candidates, args.k)
+    exact_ms = (time.time() - start_time) / len(queries) * 1000
+    print(f"exact (batched):   {exact_ms:.3f} ms/query")
+
+    start_time = time.time()
+    for q in queries:
+        top_k(q, candidates, args.k)
+    single_ms = (time.time() - start_time) / len(queries) * 1000
+    print(f"exact (per query): {single_ms:.3f} ms/query")
+
+    index = IVFIndex.build(embeddings, n_lists=args.n_lists)
+    for n_probe in args.n_probe:
+        start_time = time.time()
+        approx_indices, _ = index.search(queries, args.k, n_probe)
+        ann_ms = (time.time() - start_time) / len(queries) * 1000
+        print(f"IVF n_probe={n_probe:3d}: {ann_ms:.3f} ms/query, "
+              f"recall@{args.k} {recall_at_k(approx_indices, exact_indices):.3f}")
@@ -0,0 +1,100 @@
+"""""
+This script benchmarks the parallel dataset extension on a synthetic
+AdvPromptSet-like JSONL file (default: one million lines).
+
+Every worker count is checked against the single-process output.
+--matchers instead compares the original per-group any() scan with the
+precompiled TermMatcher on the synthetic prompts (results must agree).
+
+Usage:
+    python benchmark_extend.py --lines 1000000 --workers 1 2 4 8
+    python benchmark_extend.py --lines 1000000 --matchers
+"""""
+
+import argparse
+import filecmp
+import json
+import os
+import random
+import tempfile
+import time
+
+from dataset_extend import default_matcher, extend_dataset, match_groups_scan, political_group_order, political_groups
+
+filler_words = [
+    "the", "people", "think", "government", "should", "really", "about",
+    "why", "never", "always", "what", "vote", "tax", "city", "school",
+]
+
+
+def write_synthetic(path, lines, seed=0):
+    rng = random.Random(seed)
+    terms = [t for group in political_group_order for t in political_groups[group]]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(lines):
+            words = rng.choices(filler_words, k=rng.randint(8, 30))
+            if rng.random() < 0.2:
+                words.insert(rng.randrange(len(words)), rng.choice(terms).capitalize())
+            entry = {
+                "id": i,
+                "prompt_text": " ".join(words) + "?",
+                "sensigrp_comb": "".join(rng.choice("01") for _ in range(30)),
+            }
+            f.write(json.dumps(entry) + "\n")
+
+
+def benchmark_matchers(input_path):
+    with open(input_path, "r", encoding="utf-8") as f:
+        prompts = [json.loads(line)["prompt_text"] for line in f]
+
+    start_time = time.time()
+    expected = [match_groups_scan(p) for p in prompts]
+    scan_time = time.time() - start_time
+
+    start_time = time.time()
+    masks = [default_matcher.match(p) for p in prompts]
+    matcher_time = time.time() - start_time
+
+    if masks != expected:
+        mismatches = sum(a != b for a, b in zip(masks, expected))
+        raise SystemExit(f"[ERROR] TermMatcher differs from the any() scan on {mismatches} prompts")
+    per_prompt = 1e6 / len(prompts)
+    print(f"any() scan:  {scan_time:.2f}s ({scan_time * per_prompt:.2f} us/prompt)")
+    print(f"TermMatcher: {matcher_time:.2f}s ({matcher_time * per_prompt:.2f} us/prompt, "
+          f"speedup {scan_time / matcher_time:.2f}x, identical results)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=1000000, help="Lines of the synthetic dataset")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to compare")
+    parser.add_argument("--matchers", action="store_true", help="Compare the term matchers instead of worker counts")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "synthetic.jsonl")
+        write_synthetic(input_path, args.lines)
+        print(f"[INFO] Synthetic dataset: {args.lines} lines, {os.path.getsize(input_path) / 1024 ** 2:.0f} MB")
+
+        if args.matchers:
+            benchmark_matchers(input_path)
+            raise SystemExit(0)
+
+        reference_path = os.path.join(tmp_dir, "reference.jsonl")
+        start_time = time.time()
+        reference_counts = extend_dataset(input_path, reference_path, workers=1)
+        baseline = time.time() - start_time
+        print(f"workers=1: {baseline:.2f}s")
+
+        for workers in args.workers:
+            if workers <= 1:
+                continue
+            output_path = os.path.join(tmp_dir, f"out_{workers}.jsonl")
+            start_time = time.time()
+            counts = extend_dataset(input_path, output_path, workers=workers)
+            elapsed = time.time() - start_time
+            same = counts == reference_counts and filecmp.cmp(reference_path, output_path, shallow=False)
+            print(f"workers={workers}: {elapsed:.2f}s (speedup {baseline / elapsed:.2f}x, "
+                  f"{'identical' if same else 'DIFFERENT'} output)")
+            if not same:
+                raise SystemExit(f"[ERROR] Output with {workers} workers differs from the single-process output")
@@ -0,0 +1,170 @@
+"""""
+This module enables a columnar (Parquet) version of the extended AdvPromptSet.
+
+dataset_extend.py --format parquet writes the extension with typed columns:
+- prompt_text, sensigrp_comb: string
+- sensigrp_mask: uint64 (int(sensigrp_comb, 2), see group_index.py)
+- one bool column per political group
+- extra: all other fields of the entry as a JSON string (also flags
+  that are not plain 0/1 ints)
+- field_order: the keys of the entry in their original order (JSON list),
+  so iter_entries gives back exactly the entry that was written
+
+Rows are buffered and written one row group at a time, so memory stays
+flat. The reader helpers push projections and group filters down to the
+Parquet scan: only the requested columns are decoded, and row groups whose
+statistics exclude the filter are skipped.
+
+Usage:
+    from columnar import read_extended
+    table = read_extended("advpromptset_extended.parquet", columns=["prompt_text"], all_of=["liberal"])
+"""""
+
+import json
+
+from group_index import pack_comb
+
+typed_fields = ("prompt_text", "sensigrp_comb")
+
+
+def extended_schema(political_group_order):
+    import pyarrow as pa
+
+    return pa.schema(
+        [("prompt_text", pa.string()), ("sensigrp_comb", pa.string()), ("sensigrp_mask", pa.uint64())]
+        + [(group, pa.bool_()) for group in political_group_order]
+        + [("extra", pa.string()), ("field_order", pa.string())]
+    )
+
+
+class ParquetSink:
+    """
+    Streams extended entries into a Parquet file, one row group per
+    `row_group_size` entries.
+    """
+
+    def __init__(self, path, political_group_order, row_group_size=100000, compression="zstd"):
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.political_group_order = list(political_group_order)
+        self.schema = extended_schema(self.political_group_order)
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+        self._reset()
+
+    def _reset(self):
+        self.columns = {name: [] for name in self.schema.names}
+
+    def add(self, entry):
+        columns = self.columns
+        comb = entry.get("sensigrp_comb", "")
+        columns["prompt_text"].append(entry.get("prompt_text"))
+        columns["sensigrp_comb"].append(comb)
+        columns["sensigrp_mask"].append(pack_comb(comb))
+        for group in self.political_group_order:
+            columns[group].append(bool(entry.get(group, 0)))
+        extra = {
+            k: v for k, v in entry.items()
+            if not (k in typed_fields and isinstance(v, str))
+            and not (k in self.political_group_order and type(v) is int and v in (0, 1))
+        }
+        columns["extra"].append(json.dumps(extra))
+        columns["field_order"].append(json.dumps(list(entry)))
+        if len(columns["extra"]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+
+        if not self.columns["extra"]:
+            return
+        self.writer.write_table(pa.Table.from_pydict(self.columns, schema=self.schema))
+        self._reset()
+
+    def append_part(self, part_path):
+        """
+        Copy the row groups of another file written by a ParquetSink.
+        """
+        import pyarrow.parquet as pq
+
+        self.flush()
+        part = pq.ParquetFile(part_path)
+        for i in range(part.num_row_groups):
+            self.writer.write_table(part.read_row_group(i))
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def group_filter(all_of=(), any_of=(), none_of=(), mask_all=None):
+    """
+    Dataset filter expression over the political flag columns
+    (and optionally bits of sensigrp_mask that must all be set).
+    """
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    expression = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    for group in all_of:
+        expression = both(expression, ds.field(group) == True)  # noqa: E712
+    if any_of:
+        any_expression = None
+        for group in any_of:
+            condition = ds.field(group) == True  # noqa: E712
+            any_expression = condition if any_expression is None else any_expression | condition
+        expression = both(expression, any_expression)
+    for group in none_of:
+        expression = both(expression, ds.field(group) == False)  # noqa: E712
+    if mask_all:
+        mask = ds.scalar(mask_all).cast("uint64")
+        expression = both(expression, pc.bit_wise_and(ds.field("sensigrp_mask"), mask) == mask)
+    return expression
+
+
+def scan_extended(path, columns=None, all_of=(), any_of=(), none_of=(), mask_all=None, batch_size=65536):
+    """
+    Stream record batches of the selected columns and rows.
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet")
+    return dataset.to_batches(
+        columns=columns,
+        filter=group_filter(all_of, any_of, none_of, mask_all),
+        batch_size=batch_size,
+    )
+
+
+def read_extended(path, columns=None, all_of=(), any_of=(), none_of=(), mask_all=None):
+    """
+    Selected columns and rows as one pyarrow Table.
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet")
+    return dataset.to_table(columns=columns, filter=group_filter(all_of, any_of, none_of, mask_all))
+
+
+def iter_entries(path, all_of=(), any_of=(), none_of=(), mask_all=None):
+    """
+    Rebuild the JSON entries (typed columns + extra) of the selected rows,
+    with the original keys in their original order.
+    """
+    for batch in scan_extended(path, None, all_of, any_of, none_of, mask_all):
+        for row in batch.to_pylist():
+            extra = json.loads(row.pop("extra"))
+            field_order = row.pop("field_order", None)
+            row.pop("sensigrp_mask")
+            typed = {k: int(v) if isinstance(v, bool) else v for k, v in row.items()}
+            if field_order is None:
+                # Files written before field_order existed
+                extra.update(typed)
+                yield extra
+                continue
+            yield {k: extra[k] if k in extra else typed[k] for k in json.loads(field_order)}
@@ -3,16 +3,43 @@ This script enables the creation of expanded word lists related to
 political ideology terms using semantic similarity.
 It uses Sentence-BERT for embedding and cosine similarity for finding
 semantically close terms.
+
+Embeddings are kept in a persistent store (see embedding_store.py), so
+the WordNet candidates are encoded once and later rounds only encode the
+query terms. Neighbours are found for all query terms at once with a
+blocked matrix multiply and argpartition (see knn.py); the original
+per-term search is kept as the reference (--check-topk).
+
+With --ann-index DIR the neighbours come from a persistent IVF index over
+the candidates instead (see ann_index.py), built on first use. Any list of
+query terms (e.g. religion or nationality terms) can be expanded with
+--terms-file.
+
+The filtered WordNet lemmas are built once into a versioned vocabulary
+artifact (see vocabulary.py); later runs load it in milliseconds and only
+call nltk.download when the artifact has to be (re)built. With --offline
+nothing is downloaded and a missing artifact is an error.
+
+Usage:
+    python create_word_lists.py --round 1
+    python create_word_lists.py --round 2 --output expanded_ideology_terms.txt
+    python create_word_lists.py --terms-file religion_terms.txt --ann-index ann_index --output expanded_religion_terms.txt
 """""
 
-from sentence_transformers import SentenceTransformer
+import argparse
+import os
+import time
+
 from sklearn.metrics.pairwise import cosine_similarity
 from nltk.corpus import wordnet as wn
 import numpy as np
 import nltk
 
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore, terms_key
+from knn import CandidateMatrix, get_top_k_batched
+from vocabulary import (VocabularyError, default_vocabulary_path, load_vocabulary,
+                        save_vocabulary)
 
 # Round 1 of word list expansion
 # Define original political terms
@@ -63,20 +90,32 @@ def get_wordnet_lemmas():
                 words.add(word)
     return sorted(words)
 
-# Load WordNet terms
-print("Loading WordNet candidate terms...")
-candidate_terms = get_wordnet_lemmas()
-print(f"Total candidates: {len(candidate_terms)}")
-
-# Load SBERT model
-print("Loading SentenceTransformer...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-
-# Encode original and candidate terms
-# Change to all_ideology_terms for Round 2
-print("Encoding terms...")
-term_embeddings = model.encode(political_terms, show_progress_bar=True)
-candidate_embeddings = model.encode(candidate_terms, show_progress_bar=True)
+def load_candidate_terms(vocabulary_path, offline=False, rebuild=False):
+    """
+    WordNet candidate terms from the vocabulary artifact, building it
+    (download + walk over all synsets) only if it is missing or outdated.
+    """
+    if not rebuild:
+        start_time = time.time()
+        try:
+            terms = load_vocabulary(vocabulary_path)
+            print(f"[INFO] Loaded {len(terms)} candidate terms from {vocabulary_path} "
+                  f"in {(time.time() - start_time) * 1000:.1f} ms.")
+            return terms
+        except VocabularyError as e:
+            if offline:
+                raise SystemExit(f"[ERROR] {e}. Build it once without --offline.")
+            print(f"[INFO] {e}, building it.")
+    elif offline:
+        raise SystemExit("[ERROR] --rebuild-vocabulary needs WordNet and cannot be used with --offline.")
+
+    nltk.download('wordnet')
+    nltk.download('omw-1.4')
+    print("Loading WordNet candidate terms...")
+    terms = get_wordnet_lemmas()
+    save_vocabulary(vocabulary_path, terms, source_version=wn.get_version())
+    print(f"[INFO] Saved {len(terms)} candidate terms to {vocabulary_path}.")
+    return terms
 
 # Perform KNN search
 # Adjust k as needed
@@ -85,18 +124,125 @@ def get_top_k_synonyms(query_embedding, candidate_embeddings, candidate_terms, k
     top_indices = np.argsort(similarities)[::-1][:k]
     return [(candidate_terms[i], similarities[i]) for i in top_indices]
 
-# Expand and save
-# Change to all_ideology_terms for Round 2
-expanded_terms = {}
-for i, term in enumerate(political_terms):
-    neighbors = get_top_k_synonyms(term_embeddings[i], candidate_embeddings, candidate_terms)
-    expanded_terms[term] = neighbors
+def lazy_encoder(model_name):
+    """
+    Encode function that loads the SentenceTransformer on first use only.
+    """
+    model = None
+
+    def encode(terms):
+        nonlocal model
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            print("Loading SentenceTransformer...")
+            model = SentenceTransformer(model_name)
+        return model.encode(terms, show_progress_bar=True)
+
+    return encode
+
+def expand_terms(query_terms, term_embeddings, candidate_embeddings, candidate_terms, k=20):
+    """
+    Reference: one cosine_similarity call and full sort per term.
+    """
+    expanded_terms = {}
+    for i, term in enumerate(query_terms):
+        neighbors = get_top_k_synonyms(term_embeddings[i], candidate_embeddings, candidate_terms, k)
+        expanded_terms[term] = neighbors
+    return expanded_terms
+
+def expand_terms_batched(query_terms, term_embeddings, candidates, candidate_terms, k=20):
+    neighbors = get_top_k_batched(term_embeddings, candidates, candidate_terms, k)
+    return dict(zip(query_terms, neighbors))
+
+def expand_terms_ann(query_terms, term_embeddings, index, candidate_terms, k=20, n_probe=16):
+    indices, scores = index.search(term_embeddings, k, n_probe)
+    return {
+        term: [(candidate_terms[i], s) for i, s in zip(row_indices, row_scores) if i >= 0]
+        for term, row_indices, row_scores in zip(query_terms, indices, scores)
+    }
+
+def read_terms(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def check_top_k(reference, batched, tolerance):
+    """
+    Compare batched neighbours with the reference (same scores, and the
+    same terms up to ties). Returns the number of mismatching query terms.
+    """
+    mismatches = 0
+    for term, expected in reference.items():
+        got = batched[term]
+        scores_ok = all(abs(float(a[1]) - float(b[1])) <= tolerance for a, b in zip(expected, got))
+        # Terms may only differ where the scores tie within the tolerance
+        boundary = float(expected[-1][1]) + tolerance
+        terms_ok = {t for t, s in expected if s > boundary} <= {t for t, _ in got}
+        if not (scores_ok and terms_ok and len(expected) == len(got)):
+            print(f"[WARNING] Neighbours of '{term}' differ from the reference")
+            mismatches += 1
+    return mismatches
 
 # Save as text file
-output_file = "expanded_political_terms.txt"
-with open(output_file, "w") as f:
-    for term, neighbors in expanded_terms.items():
-        f.write(f"\nTop synonyms for '{term}':\n")
-        for synonym, score in neighbors:
-            f.write(f"  {synonym} (cosine sim: {score:.4f})\n")
-print(f"\n Results saved to: {output_file}")
+def save_expanded_terms(expanded_terms, output_file):
+    with open(output_file, "w") as f:
+        for term, neighbors in expanded_terms.items():
+            f.write(f"\nTop synonyms for '{term}':\n")
+            for synonym, score in neighbors:
+                f.write(f"  {synonym} (cosine sim: {score:.4f})\n")
+    print(f"\n Results saved to: {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--round", type=int, choices=[1, 2], default=1, help="1: political_terms, 2: all_ideology_terms")
+    parser.add_argument("--k", type=int, default=20, help="Number of neighbours per term")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="SentenceTransformer model")
+    parser.add_argument("--embedding-store", default="embedding_store", help="Directory of the persistent embedding store")
+    parser.add_argument("--output", default="expanded_political_terms.txt", help="Output text file")
+    parser.add_argument("--candidate-dtype", choices=["float32", "float16", "int8"], default="float32", help="Storage type of the candidate matrix")
+    parser.add_argument("--block-size", type=int, default=16384, help="Candidate rows scored per matrix multiply")
+    parser.add_argument("--check-topk", action="store_true", help="Compare the batched search with the per-term reference")
+    parser.add_argument("--terms-file", default=None, help="Query terms, one per line (instead of --round)")
+    parser.add_argument("--ann-index", default=None, help="Directory of a persistent IVF index (built if missing)")
+    parser.add_argument("--n-probe", type=int, default=16, help="IVF lists searched per query term")
+    parser.add_argument("--vocabulary", default=default_vocabulary_path, help="WordNet vocabulary artifact (built if missing)")
+    parser.add_argument("--rebuild-vocabulary", action="store_true", help="Rebuild the vocabulary artifact from WordNet")
+    parser.add_argument("--offline", action="store_true", help="No downloads; fail if the vocabulary artifact is missing")
+    args = parser.parse_args()
+
+    if args.offline:
+        # SentenceTransformer must come from the local cache
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    # Load WordNet terms
+    candidate_terms = load_candidate_terms(args.vocabulary, args.offline, args.rebuild_vocabulary)
+    print(f"Total candidates: {len(candidate_terms)}")
+
+    # Encode original and candidate terms (candidates come from the store after the first run)
+    if args.terms_file:
+        query_terms = read_terms(args.terms_file)
+    else:
+        query_terms = political_terms if args.round == 1 else all_ideology_terms
+    store = EmbeddingStore(args.embedding_store)
+    encode = lazy_encoder(args.model)
+    term_embeddings = store.get_or_encode(args.model, query_terms, encode)
+    candidate_embeddings = store.get_or_encode(args.model, candidate_terms, encode)
+
+    # Expand and save
+    if args.ann_index:
+        index = IVFIndex.load_or_build(args.ann_index, candidate_embeddings, terms_key(args.model, candidate_terms))
+        expanded_terms = expand_terms_ann(query_terms, term_embeddings, index, candidate_terms, args.k, args.n_probe)
+    else:
+        # Stored embeddings are unit-normalised, float32 candidates stay memory-mapped
+        candidates = CandidateMatrix(candidate_embeddings, args.candidate_dtype, args.block_size, normalized=True)
+        expanded_terms = expand_terms_batched(query_terms, term_embeddings, candidates, candidate_terms, args.k)
+    save_expanded_terms(expanded_terms, args.output)
+
+    if args.check_topk and not args.ann_index:
+        reference = expand_terms(query_terms, term_embeddings, candidate_embeddings, candidate_terms, args.k)
+        # Reduced precision candidates shift scores slightly
+        tolerance = {"float32": 1e-5, "float16": 2e-3, "int8": 2e-2}[args.candidate_dtype]
+        mismatches = check_top_k(reference, expanded_terms, tolerance)
+        if mismatches:
+            raise SystemExit(f"[ERROR] {mismatches} of {len(query_terms)} terms differ from the reference")
+        print(f"[INFO] Batched top-k matches the reference for all {len(query_terms)} terms.")
@@ -2,12 +2,37 @@
 This script enables the AdvPromptSet dataset extension with
 additional political ideology terms using exact matching of predefined
 word lists.
+
+Prompts are matched by a TermMatcher built once from the word lists: every
+token maps straight to a bitmask of the groups it belongs to. Multi-word
+terms are matched through a token trie, and with --lemmatize tokens are
+also looked up by their WordNet lemma (off by default; without it the
+results are the same as the original per-group scan).
+
+With --workers N the input is split into byte ranges that are processed
+in parallel; the output keeps the original line order and the match
+counts of all workers are merged.
+
+With --index the group memberships are also written as packed integer
+bitmasks plus line offsets (see group_index.py), so intersectional
+subsets can be selected without re-parsing the dataset.
+
+Usage:
+    python dataset_extend.py --input advpromptset_final.jsonl --output advpromptset_final_extended_exact.jsonl --workers 8
 """""
 
+import argparse
 import json
+import multiprocessing
+import os
 import re
+import shutil
+import tempfile
+import time
 from collections import Counter
 
+from group_index import PackedColumns
+
 # Define word lists
 liberal_synonyms = [
     "liberal", "liberalist", "liberalism", "liberalness", "liberality",
@@ -66,56 +91,272 @@ political_group_order = [
     "other_political_ideology"
 ]
 
-# Initialize match counter
-match_counter = Counter()
+word_pattern = re.compile(r"\b\w+\b")
+
+
+def match_groups_scan(prompt):
+    """
+    Original matcher (one any() scan per group), kept as the reference.
+    """
+    words = set(word_pattern.findall(prompt.lower()))
+    mask = 0
+    for i, group in enumerate(political_group_order):
+        if any(syn in words for syn in political_groups[group]):
+            mask |= 1 << i
+    return mask
+
+
+class TermMatcher:
+    """
+    Token -> group bitmask (bit i = group_order[i]) plus a token trie for
+    multi-word terms. `lemmatize` optionally maps a token to its lemma.
+    """
+
+    def __init__(self, groups, group_order, lemmatize=None):
+        self.lemmatize = lemmatize
+        self.token_masks = {}
+        self.phrases = {}
+        self._lemmas = {}
+        for i, group in enumerate(group_order):
+            for term in groups[group]:
+                tokens = [self._normalize(t) for t in word_pattern.findall(term.lower())]
+                if len(tokens) == 1:
+                    self.token_masks[tokens[0]] = self.token_masks.get(tokens[0], 0) | 1 << i
+                    if lemmatize is not None:
+                        raw = term.lower()
+                        self.token_masks[raw] = self.token_masks.get(raw, 0) | 1 << i
+                elif tokens:
+                    node = self.phrases
+                    for token in tokens[:-1]:
+                        node = node.setdefault(token, [0, {}])[1]
+                    last = node.setdefault(tokens[-1], [0, {}])
+                    last[0] |= 1 << i
+
+    def _normalize(self, token):
+        if self.lemmatize is None:
+            return token
+        if token not in self._lemmas:
+            self._lemmas[token] = self.lemmatize(token)
+        return self._lemmas[token]
+
+    def match(self, prompt):
+        """
+        Bitmask of the groups with a term in the prompt.
+        """
+        tokens = word_pattern.findall(prompt.lower())
+        get = self.token_masks.get
+        mask = 0
+        if self.lemmatize is None and not self.phrases:
+            for token in tokens:
+                mask |= get(token, 0)
+            return mask
+
+        normalized = tokens
+        if self.lemmatize is not None:
+            normalized = [self._normalize(t) for t in tokens]
+            for token in tokens:
+                mask |= get(token, 0)
+        for token in normalized:
+            mask |= get(token, 0)
+        if self.phrases:
+            for start in range(len(normalized)):
+                node = self.phrases
+                for token in normalized[start:]:
+                    if token not in node:
+                        break
+                    mask |= node[token][0]
+                    node = node[token][1]
+        return mask
+
+
+def build_matcher(lemmatize=False):
+    if not lemmatize:
+        return TermMatcher(political_groups, political_group_order)
+    from nltk.stem import WordNetLemmatizer
+    return TermMatcher(political_groups, political_group_order, WordNetLemmatizer().lemmatize)
+
+
+default_matcher = build_matcher()
 
 # File paths
 input_path = "XXX" # e.g., "advpromptset_final_extended.jsonl"
 output_path = "XXX" # e.g., "advpromptset_final_extended_exact.jsonl"
 
-# Processing original dataset entries
-with open(input_path, "r", encoding="utf-8") as infile, \
-     open(output_path, "w", encoding="utf-8") as outfile:
-
-    for line in infile:
-        entry = json.loads(line)
 
-        # Always extend sensigrp_comb with 6 zeros if not already
-        comb = entry.get("sensigrp_comb", "")
-        if len(comb) < 30:
-            comb = comb.ljust(30, "0")
-        else:
-            comb = comb + "000000"
-        comb_list = list(comb)
+def extend_entry(entry, match_counter, matcher=default_matcher):
+    """
+    Add the political flags and extend sensigrp_comb of one entry.
+    """
+    # Always extend sensigrp_comb with 6 zeros if not already
+    comb = entry.get("sensigrp_comb", "")
+    if len(comb) < 30:
+        comb = comb.ljust(30, "0")
+    else:
+        comb = comb + "000000"
 
-        # Ensure political fields exist (init to 0)
-        for group in political_group_order:
-            entry[group] = entry.get(group, 0)
+    # Ensure political fields exist (init to 0)
+    for group in political_group_order:
+        entry[group] = entry.get(group, 0)
 
-        # Check for exact matches in prompt
-        prompt = entry.get("prompt_text", "").lower()
-        words = set(re.findall(r"\b\w+\b", prompt))
-        entry_updated = False
+    # Check for exact matches in prompt
+    mask = matcher.match(entry.get("prompt_text", ""))
 
+    if mask:
+        tail = list(comb[-6:])
         for i, group in enumerate(political_group_order):
-            synonyms = political_groups[group]
-            if any(syn in words for syn in synonyms):
-                if comb_list[-6 + i] != "1":
-                    comb_list[-6 + i] = "1"
-                    entry_updated = True
-                if entry[group] != 1:
-                    entry[group] = 1
-                    entry_updated = True
+            if mask >> i & 1:
+                tail[i] = "1"
+                entry[group] = 1
                 match_counter[group] += 1
+        comb = comb[:-6] + "".join(tail)
+
+    entry["sensigrp_comb"] = comb
+    return entry
+
+
+class JsonlSink:
+    """
+    Writes extended entries as JSON lines (and packed masks with --index).
+    """
+
+    def __init__(self, path, packed=None):
+        self.outfile = open(path, "wb")
+        self.packed = packed
+
+    def add(self, entry):
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        self.outfile.write(data)
+        if self.packed is not None:
+            self.packed.add(entry["sensigrp_comb"], len(data))
+
+    def append_part(self, part_path):
+        with open(part_path, "rb") as part:
+            shutil.copyfileobj(part, self.outfile)
+
+    def close(self):
+        self.outfile.close()
+
+
+def open_sink(path, output_format="jsonl", packed=None):
+    if output_format == "parquet":
+        from columnar import ParquetSink
+        return ParquetSink(path, political_group_order)
+    return JsonlSink(path, packed)
+
+
+def extend_lines(lines, sink, match_counter, matcher=default_matcher):
+    for line in lines:
+        sink.add(extend_entry(json.loads(line), match_counter, matcher))
+
+
+def chunk_ranges(path, num_chunks):
+    """
+    Split a file into byte ranges that start and end on line boundaries.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, num_chunks):
+            f.seek(max(size * i // num_chunks, bounds[-1]))
+            if f.tell() > 0:
+                f.readline()
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def iter_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def process_range(args):
+    """
+    Worker: extend one byte range into a part file, return its match
+    counts (and packed masks with --index).
+    """
+    path, start, end, part_path, lemmatize, index, output_format = args
+    matcher = build_matcher(lemmatize) if lemmatize else default_matcher
+    match_counter = Counter()
+    packed = PackedColumns() if index else None
+    sink = open_sink(part_path, output_format, packed)
+    try:
+        extend_lines(iter_range(path, start, end), sink, match_counter, matcher)
+    finally:
+        sink.close()
+    return part_path, match_counter, packed
+
+
+def extend_dataset(input_path, output_path, workers=1, chunks_per_worker=4, lemmatize=False,
+                   index=False, sensitive_groups=None, output_format="jsonl"):
+    """
+    Extend the whole dataset, returns the merged match counts.
+    """
+    if index and output_format != "jsonl":
+        raise ValueError("--index is for JSONL output, Parquet output has the sensigrp_mask column")
+    match_counter = Counter()
+    packed = PackedColumns() if index else None
+    if workers <= 1:
+        sink = open_sink(output_path, output_format, packed)
+        try:
+            with open(input_path, "rb") as infile:
+                extend_lines(infile, sink, match_counter, build_matcher(lemmatize))
+        finally:
+            sink.close()
+        if packed is not None:
+            packed.write(output_path, political_group_order, sensitive_groups)
+        return match_counter
+
+    ranges = chunk_ranges(input_path, workers * chunks_per_worker)
+    part_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+    tasks = [(input_path, start, end, os.path.join(part_dir, f"part-{i:05d}.{output_format}"), lemmatize, index,
+              output_format)
+             for i, (start, end) in enumerate(ranges)]
+    sink = open_sink(output_path, output_format)
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            # imap keeps the chunk order, parts are appended as they are ready
+            for part_path, counter, part_packed in pool.imap(process_range, tasks):
+                match_counter.update(counter)
+                if packed is not None:
+                    packed.extend(part_packed)
+                sink.append_part(part_path)
+                os.remove(part_path)
+    finally:
+        sink.close()
+        shutil.rmtree(part_dir, ignore_errors=True)
+    if packed is not None:
+        packed.write(output_path, political_group_order, sensitive_groups)
+    return match_counter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=input_path, help="Original AdvPromptSet JSONL")
+    parser.add_argument("--output", default=output_path, help="Extended AdvPromptSet JSONL")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--lemmatize", action="store_true", help="Also match tokens by their WordNet lemma")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--index", action="store_true", help="Write packed group bitmasks + line offsets next to the output")
+    parser.add_argument("--group-names", default=None, help="JSON list naming the original sensigrp_comb positions (for --index)")
+    args = parser.parse_args()
 
-        if entry_updated:
-            entry["sensigrp_comb"] = "".join(comb_list)
-        else:
-            entry["sensigrp_comb"] = "".join(comb_list)
+    sensitive_groups = None
+    if args.group_names:
+        with open(args.group_names, "r") as f:
+            sensitive_groups = json.load(f)
 
-        outfile.write(json.dumps(entry) + "\n")
+    start_time = time.time()
+    match_counter = extend_dataset(args.input, args.output, args.workers, lemmatize=args.lemmatize,
+                                   index=args.index, sensitive_groups=sensitive_groups, output_format=args.format)
+    print(f"[INFO] Extended {args.input} in {time.time() - start_time:.1f}s.")
 
-# Summary of number of matches per category
-print("\n=== Match Counts by Political Group ===")
-for group in political_group_order:
-    print(f"{group}: {match_counter[group]}")
+    # Summary of number of matches per category
+    print("\n=== Match Counts by Political Group ===")
+    for group in political_group_order:
+        print(f"{group}: {match_counter[group]}")
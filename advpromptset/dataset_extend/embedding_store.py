@@ -0,0 +1,104 @@
+"""""
+This module enables a persistent store of term embeddings.
+
+Embeddings of a term list are saved once as an .npy file, keyed by the
+model name and a hash of the (ordered) term list. Later runs load them
+memory-mapped (zero-copy) instead of encoding ~150k WordNet lemmas again;
+only term lists that are not in the store are encoded. Rows are stored
+unit-normalised (float32), so cosine search runs straight on the memory
+map without a normalised copy in RAM.
+
+Layout of the store directory:
+- <key>.npy: embeddings, one row per term
+- index.json: key -> model, number of terms, dimension, dtype, normalized
+"""""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from knn import normalize_rows
+
+index_name = "index.json"
+
+
+def terms_key(model_name, terms):
+    h = hashlib.sha256()
+    h.update(model_name.encode("utf-8"))
+    for term in terms:
+        h.update(b"\0" + term.encode("utf-8"))
+    return h.hexdigest()[:24]
+
+
+class EmbeddingStore:
+    """
+    Embeddings per (model, term list), memory-mapped on load.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.index_path = os.path.join(store_dir, index_name)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+
+    def path(self, key):
+        return os.path.join(self.store_dir, f"{key}.npy")
+
+    def load(self, model_name, terms):
+        """
+        Memory-mapped embeddings of a term list, or None if not stored.
+        """
+        key = terms_key(model_name, terms)
+        if key not in self.index or not os.path.exists(self.path(key)):
+            return None
+        embeddings = np.load(self.path(key), mmap_mode="r")
+        if embeddings.shape[0] != len(terms):
+            return None
+        if not self.index[key].get("normalized"):
+            # Stored before rows were normalised: rewrite once
+            return self.save(model_name, terms, embeddings)
+        return embeddings
+
+    def save(self, model_name, terms, embeddings, block_size=16384):
+        """
+        Store unit-normalised embeddings and return them memory-mapped.
+        """
+        key = terms_key(model_name, terms)
+        tmp_path = f"{self.path(key)}.tmp{os.getpid()}.npy"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+        for start in range(0, len(embeddings), block_size):
+            out[start:start + block_size] = normalize_rows(embeddings[start:start + block_size])
+        out.flush()
+        del out
+        os.replace(tmp_path, self.path(key))
+        self.index[key] = {
+            "model": model_name,
+            "terms": len(terms),
+            "dim": int(embeddings.shape[1]),
+            "dtype": "float32",
+            "normalized": True,
+            "created": time.time(),
+        }
+        tmp_index = f"{self.index_path}.tmp{os.getpid()}"
+        with open(tmp_index, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_index, self.index_path)
+        return np.load(self.path(key), mmap_mode="r")
+
+    def get_or_encode(self, model_name, terms, encode):
+        """
+        Stored embeddings of `terms`, encoding (and storing) them with
+        encode(terms) on a miss.
+        """
+        embeddings = self.load(model_name, terms)
+        if embeddings is not None:
+            print(f"[INFO] Loaded {len(terms)} embeddings from the store ({model_name}).")
+            return embeddings
+        print(f"[INFO] Encoding {len(terms)} terms with {model_name}...")
+        return self.save(model_name, terms, encode(terms))
@@ -0,0 +1,183 @@
+"""""
+This module enables intersectional subsets of the extended AdvPromptSet
+without re-parsing the JSONL file.
+
+dataset_extend.py --index writes three sidecar files next to the output:
+- <output>.masks.npy: sensigrp_comb of every line as a packed integer
+  (int(sensigrp_comb, 2), uint64)
+- <output>.offsets.npy: byte offset of every line in the JSONL file
+- <output>.groups.json: bit position of every named group
+
+A subset such as "women AND liberal" is then one vectorised bit operation
+over the mask column; only the selected lines are read from the JSONL.
+
+Usage:
+    python group_index.py advpromptset_final_extended_exact.jsonl --all liberal women --count
+    python group_index.py advpromptset_final_extended_exact.jsonl --any communist socialist --none fascist > subset.jsonl
+"""""
+
+import argparse
+import array
+import json
+import sys
+
+
+def pack_comb(comb):
+    """
+    '0'/'1' string -> integer, the last character is bit 0.
+    """
+    if len(comb) > 64:
+        raise ValueError(f"sensigrp_comb of length {len(comb)} does not fit into 64 bits")
+    return int(comb, 2) if comb else 0
+
+
+def sidecar_paths(jsonl_path):
+    return {
+        "masks": f"{jsonl_path}.masks.npy",
+        "offsets": f"{jsonl_path}.offsets.npy",
+        "groups": f"{jsonl_path}.groups.json",
+    }
+
+
+class PackedColumns:
+    """
+    Packed masks and line lengths collected while writing the JSONL.
+    """
+
+    def __init__(self):
+        self.masks = array.array("Q")
+        self.lengths = array.array("Q")
+        self.comb_lengths = set()
+
+    def add(self, comb, line_length):
+        self.masks.append(pack_comb(comb))
+        self.lengths.append(line_length)
+        self.comb_lengths.add(len(comb))
+
+    def extend(self, other):
+        self.masks.extend(other.masks)
+        self.lengths.extend(other.lengths)
+        self.comb_lengths |= other.comb_lengths
+
+    def write(self, jsonl_path, political_group_order, sensitive_groups=None):
+        """
+        Write the sidecar files. Political group i is bit (5 - i); names of
+        the original groups (sensigrp_comb order) need a uniform length.
+        """
+        import numpy as np
+
+        paths = sidecar_paths(jsonl_path)
+        masks = np.frombuffer(self.masks, dtype=np.uint64)
+        lengths = np.frombuffer(self.lengths, dtype=np.uint64).astype(np.int64)
+        offsets = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        np.save(paths["masks"], masks)
+        np.save(paths["offsets"], offsets)
+
+        n = len(political_group_order)
+        groups = {group: n - 1 - i for i, group in enumerate(political_group_order)}
+        comb_length = max(self.comb_lengths) if self.comb_lengths else 0
+        if sensitive_groups:
+            if len(self.comb_lengths) != 1:
+                print(f"[WARNING] sensigrp_comb lengths differ ({sorted(self.comb_lengths)}), "
+                      f"only the political groups are indexed by name.")
+            else:
+                # Every name must map to exactly one bit
+                if len(sensitive_groups) > comb_length - n:
+                    raise ValueError(f"{len(sensitive_groups)} group names for {comb_length - n} "
+                                     f"sensigrp_comb positions before the political groups")
+                names = list(sensitive_groups) + list(groups)
+                duplicates = sorted(g for g in set(names) if names.count(g) > 1)
+                if duplicates:
+                    raise ValueError(f"Group names are not unique: {duplicates}")
+                for j, group in enumerate(sensitive_groups):
+                    groups[group] = comb_length - 1 - j
+        with open(paths["groups"], "w") as f:
+            json.dump({"rows": len(masks), "comb_length": comb_length, "comb_lengths": sorted(self.comb_lengths),
+                       "groups": groups}, f, indent=2)
+
+
+class GroupIndex:
+    """
+    Read side: memory-mapped masks/offsets plus the group bit positions.
+    """
+
+    def __init__(self, jsonl_path):
+        import numpy as np
+
+        self.jsonl_path = jsonl_path
+        paths = sidecar_paths(jsonl_path)
+        self.masks = np.load(paths["masks"], mmap_mode="r")
+        self.offsets = np.load(paths["offsets"], mmap_mode="r")
+        with open(paths["groups"], "r") as f:
+            meta = json.load(f)
+        self.groups = meta["groups"]
+        self.comb_length = meta["comb_length"]
+        self.comb_lengths = meta.get("comb_lengths", [self.comb_length])
+
+    def bit(self, group):
+        """
+        Bit of a group name, or of a sensigrp_comb position (int). Positions
+        need sensigrp_comb strings of one length, otherwise the same
+        position is a different bit in different rows.
+        """
+        if isinstance(group, int) or str(group).isdigit():
+            if len(self.comb_lengths) > 1:
+                raise ValueError(f"sensigrp_comb lengths differ ({self.comb_lengths}), "
+                                 f"select by political group name instead of position {group}")
+            if not 0 <= int(group) < self.comb_length:
+                raise KeyError(f"Position {group} is outside sensigrp_comb (length {self.comb_length})")
+            return self.comb_length - 1 - int(group)
+        if group not in self.groups:
+            raise KeyError(f"Unknown group '{group}', known: {sorted(self.groups)}")
+        return self.groups[group]
+
+    def mask(self, groups):
+        value = 0
+        for group in groups:
+            value |= 1 << self.bit(group)
+        return value
+
+    def select(self, all_of=(), any_of=(), none_of=()):
+        """
+        Row numbers of the lines that have all groups of `all_of`, at least
+        one of `any_of` and none of `none_of`.
+        """
+        import numpy as np
+
+        keep = np.ones(len(self.masks), dtype=bool)
+        if all_of:
+            m = np.uint64(self.mask(all_of))
+            keep &= (self.masks & m) == m
+        if any_of:
+            keep &= (self.masks & np.uint64(self.mask(any_of))) != 0
+        if none_of:
+            keep &= (self.masks & np.uint64(self.mask(none_of))) == 0
+        return np.flatnonzero(keep)
+
+    def entries(self, rows):
+        """
+        Read the selected lines from the JSONL file.
+        """
+        with open(self.jsonl_path, "rb") as f:
+            for row in rows:
+                f.seek(int(self.offsets[row]))
+                yield json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("jsonl_path", help="Extended AdvPromptSet JSONL written with --index")
+    parser.add_argument("--all", nargs="+", default=[], help="Groups that must all be present")
+    parser.add_argument("--any", nargs="+", default=[], help="Groups of which one must be present")
+    parser.add_argument("--none", nargs="+", default=[], help="Groups that must be absent")
+    parser.add_argument("--count", action="store_true", help="Only print the number of matching lines")
+    args = parser.parse_args()
+
+    index = GroupIndex(args.jsonl_path)
+    rows = index.select(args.all, args.any, args.none)
+    if args.count:
+        print(len(rows))
+    else:
+        for entry in index.entries(rows):
+            sys.stdout.write(json.dumps(entry) + "\n")
@@ -0,0 +1,99 @@
+"""""
+This module enables batched cosine top-k search over candidate embeddings.
+
+Candidates are normalised once (optionally stored as float16 or int8 with
+a per-row scale); rows that are already unit-normalised in float32 (as in
+the embedding store) are used in place, e.g. straight from a memory map.
+All query terms are scored together, one block of candidate rows at a
+time, so memory stays at queries x block_size scores; the running top-k
+per query is kept with argpartition instead of sorting all candidate
+scores.
+"""""
+
+import numpy as np
+
+
+def normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+class CandidateMatrix:
+    """
+    Normalised candidate embeddings in float32, float16 or int8.
+    int8 rows are stored as round(127 * x / max|x|) with the scale per row.
+    With normalized=True the rows are taken as unit vectors; float32 rows
+    are then not copied.
+    """
+
+    def __init__(self, embeddings, dtype="float32", block_size=16384, normalized=False):
+        self.block_size = block_size
+        self.dtype = dtype
+        self.scales = None
+        if normalized and dtype == "float32" and embeddings.dtype == np.float32:
+            self.matrix = embeddings
+            return
+        prepare = (lambda x: np.asarray(x, dtype=np.float32)) if normalized else normalize_rows
+        normalized = np.concatenate([
+            prepare(embeddings[i:i + block_size]) for i in range(0, len(embeddings), block_size)
+        ]) if len(embeddings) else np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        if dtype == "float32":
+            self.matrix = normalized
+        elif dtype == "float16":
+            self.matrix = normalized.astype(np.float16)
+        elif dtype == "int8":
+            peak = np.abs(normalized).max(axis=1)
+            self.scales = (np.where(peak == 0, 1, peak) / 127).astype(np.float32)
+            self.matrix = np.round(normalized / self.scales[:, None]).astype(np.int8)
+        else:
+            raise ValueError(f"Unsupported candidate dtype '{dtype}'")
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def block(self, start):
+        """
+        float32 view of candidate rows [start, start + block_size).
+        """
+        block = self.matrix[start:start + self.block_size].astype(np.float32, copy=False)
+        if self.scales is not None:
+            block = block * self.scales[start:start + self.block_size, None]
+        return block
+
+
+def top_k(query_embeddings, candidates, k=20):
+    """
+    Indices and cosine scores of the k best candidates per query,
+    sorted by decreasing score. Returns two (queries x k) arrays, with k
+    clamped to 1..len(candidates).
+    """
+    queries = normalize_rows(np.atleast_2d(query_embeddings))
+    k = max(1, min(k, len(candidates)))
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+    rows = np.arange(len(queries))[:, None]
+
+    for start in range(0, len(candidates), candidates.block_size):
+        scores = queries @ candidates.block(start).T
+        indices = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        indices = np.concatenate([best_indices, indices], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores, indices = scores[rows, keep], indices[rows, keep]
+        best_scores, best_indices = scores, indices
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return best_indices[rows, order], best_scores[rows, order]
+
+
+def get_top_k_batched(query_embeddings, candidates, candidate_terms, k=20):
+    """
+    Same output as get_top_k_synonyms, for all queries at once.
+    """
+    indices, scores = top_k(query_embeddings, candidates, k)
+    return [
+        [(candidate_terms[i], s) for i, s in zip(row_indices, row_scores)]
+        for row_indices, row_scores in zip(indices, scores)
+    ]
@@ -0,0 +1,66 @@
+"""""
+This module enables a versioned, offline artifact of the WordNet candidate
+vocabulary used by create_word_lists.py.
+
+The filtered, sorted lemma list is written once as a text file: a JSON
+header line (format version, filter settings, WordNet version, count,
+checksum) followed by one term per line. Loading it takes milliseconds
+and needs neither the network nor a walk over all WordNet synsets.
+"""""
+
+import hashlib
+import json
+import os
+
+vocabulary_version = 1
+default_vocabulary_path = f"wordnet_vocabulary.v{vocabulary_version}.txt"
+
+# Filter applied to the WordNet lemmas (see get_wordnet_lemmas)
+vocabulary_filter = {"alpha_only": True, "min_length": 3, "max_length": 20}
+
+
+class VocabularyError(Exception):
+    pass
+
+
+def terms_checksum(terms):
+    return hashlib.sha256("\n".join(terms).encode("utf-8")).hexdigest()
+
+
+def save_vocabulary(path, terms, source_version=None):
+    header = {
+        "format": vocabulary_version,
+        "source": "wordnet",
+        "source_version": source_version,
+        "filter": vocabulary_filter,
+        "count": len(terms),
+        "sha256": terms_checksum(terms),
+    }
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        f.write("\n".join(terms) + "\n")
+    os.replace(tmp_path, path)
+    return header
+
+
+def load_vocabulary(path):
+    """
+    Terms of a vocabulary artifact; raises VocabularyError if it is
+    missing, from another format version or corrupted.
+    """
+    if not os.path.exists(path):
+        raise VocabularyError(f"Vocabulary artifact {path} not found")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            terms = f.read().splitlines()
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise VocabularyError(f"Vocabulary artifact {path} is corrupted")
+    if not isinstance(header, dict):
+        raise VocabularyError(f"Vocabulary artifact {path} is corrupted")
+    if header.get("format") != vocabulary_version or header.get("filter") != vocabulary_filter:
+        raise VocabularyError(f"Vocabulary artifact {path} was built with other settings ({header})")
+    if len(terms) != header.get("count") or terms_checksum(terms) != header.get("sha256"):
+        raise VocabularyError(f"Vocabulary artifact {path} is corrupted")
+    return terms
@@ -5,9 +5,7 @@ and the Phi-3 model on the full AdvPromptSet dataset.
 
 import argparse
 import os
-import subprocess
-import time
-import traceback
+import sys
 
 # Hugging Face token for model access
 with open("hugging_access_token.txt", "r") as file:
@@ -15,9 +13,63 @@ with open("hugging_access_token.txt", "r") as file:
 
 # Parse which GPU to use
 parser = argparse.ArgumentParser()
-parser.add_argument("--gpu-id", type=int, required=True, help="Which GPU to use (0–3)")
+parser.add_argument(
+    "--gpu-id",
+    type=str,
+    nargs="+",
+    required=True,
+    help="Which GPU(s) to use (0–3); pass several ids or 'cpu' slots to share the models"
+)
+parser.add_argument(
+    "--eval-worker",
+    action="store_true",
+    help="Evaluate in long-lived worker processes instead of one robbie.eval process per model"
+)
+parser.add_argument(
+    "--fresh",
+    action="store_true",
+    help="Ignore the run manifest and run every tag again"
+)
+parser.add_argument(
+    "--sequential",
+    default=None,
+    metavar="METRIC",
+    help="Evaluate in stratified chunks and stop early; METRIC is a numeric result column (mean, e.g. a toxicity score) or column=value (rate)"
+)
+parser.add_argument(
+    "--seq-precision",
+    type=float,
+    default=0.02,
+    help="Sequential evaluation: stop once all confidence intervals are at most +- this wide (in units of METRIC)"
+)
+parser.add_argument(
+    "--seq-reference",
+    nargs=2,
+    default=None,
+    metavar=("RESULTS_DIR", "TAG"),
+    help="Sequential evaluation: also stop once the score is separated from this fully evaluated model"
+)
+parser.add_argument(
+    "--seq-group",
+    default="sensigrp_comb",
+    help="Sequential evaluation: dataset column to stratify and estimate by"
+)
+parser.add_argument(
+    "--seq-min-group",
+    type=int,
+    default=100,
+    help="Sequential evaluation: groups with fewer prompts do not need to reach the precision"
+)
 args = parser.parse_args()
-os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
+
+# Shared sweep helpers
+# Adjust paths as needed
+utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils")
+sys.path.append(utils_dir)
+from sweep import DeviceScheduler, Job, Step, parse_devices
+from manifest import RunManifest
+from eval_worker import EvalService
+from sequential import SequentialEval
 
 # Model list
 all_models = [
@@ -47,53 +99,68 @@ log_dir = os.path.join(results_dir, "logs_base_evaluate")
 os.makedirs(results_dir, exist_ok=True)
 os.makedirs(log_dir, exist_ok=True)
 
-# Error tracking
-failures = []
+# Journal of finished tags, a restarted sweep skips them
+manifest = RunManifest(os.path.join(log_dir, "manifest_base_evaluate.jsonl"), resume=not args.fresh)
+
+# One job queue per device slot
+scheduler = DeviceScheduler(parse_devices(args.gpu_id), manifest=manifest)
+
+# Optional long-lived evaluation workers (one per device slot)
+service = EvalService() if args.eval_worker else None
+
+# Optional sequential evaluation with early stopping (chunks run in the workers if enabled)
+sequential = SequentialEval(
+    args.sequential, args.seq_group, args.seq_precision, args.seq_reference,
+    min_group_size=args.seq_min_group, service=service
+) if args.sequential else None
 
 # Run evaluation
 for model_id in all_models:
     tag = os.path.basename(model_id)
     eval_log = os.path.join(log_dir, f"{tag}_base_evaluate.log")
 
-    start_time = time.time()
-    try:
-        env = os.environ.copy()
-        env["HUGGING_FACE_HUB_TOKEN"] = access_token
-        with open(eval_log, "w") as log_f:
-            subprocess.run(
-                [
-                    "python", "-m", "robbie.eval",
-                    "--dataset", "advpromptset",
-                    "--model-id", model_id,
-                    "--metric", "toxigen",
-                    "--dataset-dir", dataset_dir,
-                    "--predictor", "hf_causal",
-                    "--device", "cuda",
-                    "--result-dir", results_dir,
-                    "--seed", "42",
-                    "--max-length", "64",
-                    "--batch-size", "32",
-                    "--top-k", "50",
-                ],
-                cwd=eval_repo,
-                stdout=log_f, stderr=subprocess.STDOUT,
-                check=True,
-                env=env
-            )
-    except subprocess.CalledProcessError:
-        failures.append(tag)
-        print(f"[ERROR] Evaluation failed for: {tag}")
-        traceback.print_exc()
-        continue
-
-    elapsed = time.time() - start_time
-    mins, secs = divmod(elapsed, 60)
-    print(f"[INFO] Finished {tag} in {int(mins)}m {int(secs)}s.")
+    # Evaluation step
+    eval_step = Step(
+        "eval",
+        [
+            "python", "-m", "robbie.eval",
+            "--dataset", "advpromptset",
+            "--model-id", model_id,
+            "--metric", "toxigen",
+            "--dataset-dir", dataset_dir,
+            "--predictor", "hf_causal",
+            "--device", "cuda",
+            "--result-dir", results_dir,
+            "--seed", "42",
+            "--max-length", "64",
+            "--batch-size", "32",
+            "--top-k", "50",
+        ],
+        cwd=eval_repo,
+        log_path=eval_log,
+        env={"HUGGING_FACE_HUB_TOKEN": access_token},
+    )
+    if sequential is not None:
+        eval_step = sequential.wrap(eval_step)
+    elif service is not None:
+        eval_step = service.wrap(eval_step)
+
+    scheduler.submit(Job(
+        tag=tag,
+        steps=[
+            eval_step,
+        ],
+    ))
+
+# Run all queued evaluations, each on the next free device
+failures = scheduler.run()
+if service is not None:
+    service.close()
 
 # Print failure summary
 if failures:
     print("\n========== SUMMARY OF FAILURES ==========")
-    for tag in failures:
+    for tag, _ in failures:
         print(f"{tag} failed during evaluation")
     print("=========================================\n")
 else:
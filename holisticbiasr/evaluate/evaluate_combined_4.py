@@ -5,20 +5,99 @@ This script enables four-bias combination evaluation.
 import argparse
 import itertools
 import os
-import subprocess
-import time
-import traceback
+import sys
 import yaml
+from functools import partial
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--gpu-id",
-    type=int,
+    type=str,
+    nargs="+",
     required=True,
-    help="Which GPU to use (0–3)"
+    help="Which GPU(s) to use (0–3); pass several ids or 'cpu' slots to share the sweep"
+)
+parser.add_argument(
+    "--pipeline",
+    type=int,
+    default=0,
+    help="Merge up to N configurations ahead on the CPU while evaluating (0 = off)"
+)
+parser.add_argument(
+    "--cache-dir",
+    default=None,
+    help="Keep merged models in a content-addressed cache instead of deleting them"
+)
+parser.add_argument(
+    "--cache-budget-gb",
+    type=float,
+    default=200,
+    help="Disk budget of the merge cache, least recently used merges are evicted"
+)
+parser.add_argument(
+    "--native-merge",
+    action="store_true",
+    help="Use the streaming linear merge engine instead of mergekit-yaml for linear merges"
+)
+parser.add_argument(
+    "--lora-merge",
+    action="store_true",
+    help="Combine the OpinionGPT LoRA adapters in low-rank form instead of merging full checkpoints (normalized linear merges only)"
+)
+parser.add_argument(
+    "--eval-worker",
+    action="store_true",
+    help="Evaluate in long-lived worker processes instead of one robbie.eval process per model"
+)
+parser.add_argument(
+    "--fresh",
+    action="store_true",
+    help="Ignore the run manifest and run every tag again"
+)
+parser.add_argument(
+    "--sequential",
+    default=None,
+    metavar="METRIC",
+    help="Evaluate in stratified chunks and stop early; METRIC is a numeric result column (mean) or column=value (rate, e.g. regard=negative)"
+)
+parser.add_argument(
+    "--seq-precision",
+    type=float,
+    default=0.02,
+    help="Sequential evaluation: stop once all confidence intervals are at most +- this wide (in units of METRIC)"
+)
+parser.add_argument(
+    "--seq-reference",
+    nargs=2,
+    default=None,
+    metavar=("RESULTS_DIR", "TAG"),
+    help="Sequential evaluation: also stop once the score is separated from this fully evaluated model"
+)
+parser.add_argument(
+    "--seq-group",
+    default="axis",
+    help="Sequential evaluation: dataset column to stratify and estimate by"
+)
+parser.add_argument(
+    "--seq-min-group",
+    type=int,
+    default=100,
+    help="Sequential evaluation: groups with fewer prompts do not need to reach the precision"
 )
 args = parser.parse_args()
-os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
+
+# Shared sweep helpers
+# Adjust paths as necessary
+utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils")
+sys.path.append(utils_dir)
+from sweep import DeviceScheduler, Job, Step, lora_composable, lora_merge_command, mergekit_command, native_merge_command, parse_devices
+from manifest import RunManifest
+from eval_worker import EvalService
+from sequential import SequentialEval
+from merge_cache import MergeCache
+
+# Optional cache of merged models
+cache = MergeCache(args.cache_dir, args.cache_budget_gb) if args.cache_dir else None
 
 # Model IDs
 base_model = "unsloth/Phi-3-mini-4k-instruct"
@@ -53,8 +132,7 @@ eval_repo = "ResponsibleNLP"
 dataset_dir = os.path.join(eval_repo, "hbr_large")
 results_dir = os.path.join(eval_repo, "result_combined_4")
 
-# Error handling
-failures = []
+# Log directory
 log_dir = os.path.join(config_dir, "logs_combined_4")
 os.makedirs(log_dir, exist_ok=True)
 
@@ -63,6 +141,21 @@ os.makedirs(output_dir, exist_ok=True)
 os.makedirs(config_dir, exist_ok=True)
 os.makedirs(results_dir, exist_ok=True)
 
+# Journal of finished tags, a restarted sweep skips them
+manifest = RunManifest(os.path.join(log_dir, "manifest_combined_4.jsonl"), resume=not args.fresh)
+
+# One job queue per device slot, optionally with merges running ahead
+scheduler = DeviceScheduler(parse_devices(args.gpu_id), lookahead=args.pipeline, manifest=manifest)
+
+# Optional long-lived evaluation workers (one per device slot)
+service = EvalService() if args.eval_worker else None
+
+# Optional sequential evaluation with early stopping (chunks run in the workers if enabled)
+sequential = SequentialEval(
+    args.sequential, args.seq_group, args.seq_precision, args.seq_reference,
+    min_group_size=args.seq_min_group, service=service
+) if args.sequential else None
+
 # Search space
 search_space = {
     "normalize": [True],
@@ -149,73 +242,64 @@ for method, param_keys in method_params.items():
             merge_log = os.path.join(log_dir, f"{tag}_merge_combined_4.log")
             eval_log = os.path.join(log_dir, f"{tag}_eval_combined_4.log")
 
-            start_time = time.time()
-
-            # Merge step
-            try:
-                with open(merge_log, "w") as log_f:
-                    subprocess.run(
-                        [
-                            "mergekit-yaml",
-                            config_path,
-                            output_path,
-                            "--lazy-unpickle",
-                            "--allow-crimes",
-                            "--random-seed", "42",
-                            "--safe-serialization",
-                            "--write-model-card",
-                            "--trust-remote-code",
-                            "--cuda",
-                        ],
-                        cwd=merge_repo,
-                        stdout=log_f,
-                        stderr=subprocess.STDOUT,
-                        check=True,
-                    )
-            except subprocess.CalledProcessError:
-                failures.append((tag, "merge"))
-                print(f"[ERROR] Merge failed for: {tag} ({w_human})")
-                traceback.print_exc()
-                continue
-
-            # Evaluation step
-            try:
-                with open(eval_log, "w") as log_f:
-                    subprocess.run(
-                        [
-                            "python", "-m", "robbie.eval",
-                            "--dataset", "holisticbiasr",
-                            "--model-id", output_path,
-                            "--metric", "regard",
-                            "--dataset-dir", dataset_dir,
-                            "--predictor", "hf_causal",
-                            "--device", "cuda",
-                            "--result-dir", results_dir,
-                            "--seed", "42",
-                            "--max-length", "64",
-                            "--batch-size", "32",
-                        ],
-                        cwd=eval_repo,
-                        stdout=log_f,
-                        stderr=subprocess.STDOUT,
-                        check=True,
-                    )
-            except subprocess.CalledProcessError:
-                failures.append((tag, "eval"))
-                print(f"[ERROR] Evaluation failed for: {tag} ({w_human})")
-                traceback.print_exc()
-            finally:
+            # Merge step, served from the merge cache if enabled
+            if args.lora_merge and lora_composable(config):
+                merge_cmd = lora_merge_command(config_path, output_path)
+            elif args.native_merge and method == "linear":
+                merge_cmd = native_merge_command(config_path, output_path)
+            else:
+                merge_cmd = mergekit_command(config_path, output_path, cuda=not args.pipeline)
+            merge_step = Step(
+                "merge",
+                merge_cmd,
+                cwd=merge_repo,
+                log_path=merge_log,
+            )
+            cleanup = [output_path]
+            if cache is not None:
+                merge_step = cache.wrap(merge_step, config, output_path)
+                cleanup = [partial(cache.release, output_path)]
+
+            # Evaluation step, optionally in a long-lived worker
+            eval_step = Step(
+                "eval",
+                [
+                    "python", "-m", "robbie.eval",
+                    "--dataset", "holisticbiasr",
+                    "--model-id", output_path,
+                    "--metric", "regard",
+                    "--dataset-dir", dataset_dir,
+                    "--predictor", "hf_causal",
+                    "--device", "cuda",
+                    "--result-dir", results_dir,
+                    "--seed", "42",
+                    "--max-length", "64",
+                    "--batch-size", "32",
+                ],
+                cwd=eval_repo,
+                log_path=eval_log,
+            )
+            if sequential is not None:
+                eval_step = sequential.wrap(eval_step)
+            elif service is not None:
+                eval_step = service.wrap(eval_step)
+
+            # Queue merge + evaluation
+            scheduler.submit(Job(
+                tag=tag,
+                label=f"{tag} ({w_human})",
+                steps=[
+                    merge_step,
+                    eval_step,
+                ],
                 # Cleanup merged model to save space
-                try:
-                    if os.path.exists(output_path):
-                        subprocess.run(["rm", "-rf", output_path])
-                except Exception:
-                    print(f"[WARNING] Could not delete {output_path}")
-
-            # Timing
-            elapsed = time.time() - start_time
-            mins, secs = divmod(elapsed, 60)
-            print(f"[INFO] Finished {tag} ({w_human}) in {int(mins)}m {int(secs)}s.")
+                cleanup=cleanup,
+            ))
+
+# Run all queued jobs, each on the next free device
+failures = scheduler.run()
+if service is not None:
+    service.close()
 
 # Summary
 if failures:
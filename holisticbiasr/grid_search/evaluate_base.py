@@ -5,15 +5,36 @@ on the sampled HolisticBiasR dataset.
 
 import argparse
 import os
-import subprocess
-import time
-import traceback
+import sys
 
 # Parse which GPU to use
 parser = argparse.ArgumentParser()
-parser.add_argument("--gpu-id", type=int, required=True, help="Which GPU to use (0–3)")
+parser.add_argument(
+    "--gpu-id",
+    type=str,
+    nargs="+",
+    required=True,
+    help="Which GPU(s) to use (0–3); pass several ids or 'cpu' slots to share the models"
+)
+parser.add_argument(
+    "--eval-worker",
+    action="store_true",
+    help="Evaluate in long-lived worker processes instead of one robbie.eval process per model"
+)
+parser.add_argument(
+    "--fresh",
+    action="store_true",
+    help="Ignore the run manifest and run every tag again"
+)
 args = parser.parse_args()
-os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
+
+# Shared sweep helpers
+# Adjust paths as needed
+utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils")
+sys.path.append(utils_dir)
+from sweep import DeviceScheduler, Job, Step, parse_devices
+from manifest import RunManifest
+from eval_worker import EvalService
 
 # Model lists
 # Adjust paths as needed
@@ -35,47 +56,56 @@ log_dir = os.path.join(results_dir, "logs_grid_search_base")
 os.makedirs(results_dir, exist_ok=True)
 os.makedirs(log_dir, exist_ok=True)
 
-# Error tracking
-failures = []
+# Journal of finished tags, a restarted sweep skips them
+manifest = RunManifest(os.path.join(log_dir, "manifest_grid_search_base.jsonl"), resume=not args.fresh)
+
+# One job queue per device slot
+scheduler = DeviceScheduler(parse_devices(args.gpu_id), manifest=manifest)
+
+# Optional long-lived evaluation workers (one per device slot)
+service = EvalService() if args.eval_worker else None
 
 # Run evaluation
 for model_id in all_models:
     tag = os.path.basename(model_id)
     eval_log = os.path.join(log_dir, f"{tag}_grid_search_base.log")
 
-    start_time = time.time()
-    try:
-        with open(eval_log, "w") as log_f:
-            subprocess.run(
-                [
-                    "python", "-m", "robbie.eval",
-                    "--dataset", "holisticbiasr",
-                    "--model-id", model_id,
-                    "--metric", "regard",
-                    "--dataset-dir", dataset_dir,
-                    "--predictor", "hf_causal",
-                    "--device", "cuda",
-                    "--result-dir", results_dir,
-                    "--seed", "42",
-                ],
-                cwd=eval_repo,
-                stdout=log_f, stderr=subprocess.STDOUT,
-                check=True
-            )
-    except subprocess.CalledProcessError:
-        failures.append(tag)
-        print(f"[ERROR] Evaluation failed for: {tag}")
-        traceback.print_exc()
-        continue
+    # Evaluation step
+    eval_step = Step(
+        "eval",
+        [
+            "python", "-m", "robbie.eval",
+            "--dataset", "holisticbiasr",
+            "--model-id", model_id,
+            "--metric", "regard",
+            "--dataset-dir", dataset_dir,
+            "--predictor", "hf_causal",
+            "--device", "cuda",
+            "--result-dir", results_dir,
+            "--seed", "42",
+        ],
+        cwd=eval_repo,
+        log_path=eval_log,
+    )
+    if service is not None:
+        eval_step = service.wrap(eval_step)
+
+    scheduler.submit(Job(
+        tag=tag,
+        steps=[
+            eval_step,
+        ],
+    ))
 
-    elapsed = time.time() - start_time
-    mins, secs = divmod(elapsed, 60)
-    print(f"[INFO] Finished {tag} in {int(mins)}m {int(secs)}s.")
+# Run all queued evaluations, each on the next free device
+failures = scheduler.run()
+if service is not None:
+    service.close()
 
 # Print failure summary
 if failures:
     print("\n========== SUMMARY OF FAILURES ==========")
-    for tag in failures:
+    for tag, _ in failures:
         print(f"{tag} failed during evaluation")
     print("=========================================\n")
 else:
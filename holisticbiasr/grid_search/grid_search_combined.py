@@ -6,20 +6,144 @@ on the sampled HolisticBiasR dataset.
 import argparse
 import itertools
 import os
-import subprocess
-import time
-import traceback
+import sys
 import yaml
+from functools import partial
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--gpu-id",
-    type=int,
+    type=str,
+    nargs="+",
     required=True,
-    help="Which GPU to use (0–3)"
+    help="Which GPU(s) to use (0–3); pass several ids or 'cpu' slots to share the sweep"
+)
+parser.add_argument(
+    "--pipeline",
+    type=int,
+    default=0,
+    help="Merge up to N configurations ahead on the CPU while evaluating (0 = off)"
+)
+parser.add_argument(
+    "--cache-dir",
+    default=None,
+    help="Keep merged models in a content-addressed cache instead of deleting them (required with --successive-halving)"
+)
+parser.add_argument(
+    "--cache-budget-gb",
+    type=float,
+    default=200,
+    help="Disk budget of the merge cache, least recently used merges are evicted"
+)
+parser.add_argument(
+    "--native-merge",
+    action="store_true",
+    help="Use the streaming linear merge engine instead of mergekit-yaml for linear merges"
+)
+parser.add_argument(
+    "--lora-merge",
+    action="store_true",
+    help="Combine the OpinionGPT LoRA adapters in low-rank form instead of merging full checkpoints (normalized linear merges only)"
+)
+parser.add_argument(
+    "--eval-worker",
+    action="store_true",
+    help="Evaluate in long-lived worker processes instead of one robbie.eval process per model"
+)
+parser.add_argument(
+    "--fresh",
+    action="store_true",
+    help="Ignore the run manifest and run every tag again"
+)
+parser.add_argument(
+    "--successive-halving",
+    action="store_true",
+    help="Score all configurations on small stratified slices first and promote only the best 1/eta"
+)
+parser.add_argument(
+    "--sh-eta",
+    type=float,
+    default=3,
+    help="Successive halving: reduction factor per rung"
+)
+parser.add_argument(
+    "--sh-min-fraction",
+    type=float,
+    default=1 / 9,
+    help="Successive halving: fraction of the prompts in the first rung"
+)
+parser.add_argument(
+    "--tpe",
+    action="store_true",
+    help="Search with a model-based optimiser (TPE) instead of enumerating the grid"
+)
+parser.add_argument(
+    "--tpe-budget",
+    type=int,
+    default=50,
+    help="TPE: number of configurations to evaluate"
+)
+parser.add_argument(
+    "--tpe-parallel",
+    type=int,
+    default=None,
+    help="TPE: configurations proposed per batch (default: one per device slot)"
+)
+parser.add_argument(
+    "--tpe-state",
+    default=None,
+    help="TPE: state file of the search, a restarted search resumes from it"
+)
+parser.add_argument(
+    "--metric",
+    default=None,
+    help="Adaptive search: result column to rank by, or column=value for its rate (e.g. regard=negative)"
+)
+parser.add_argument(
+    "--goal",
+    choices=["min", "max"],
+    default="min",
+    help="Adaptive search: minimise or maximise the metric"
+)
+parser.add_argument(
+    "--sh-strata",
+    nargs="+",
+    default=["axis"],
+    help="Successive halving: dataset columns the slices are stratified by"
+)
+parser.add_argument(
+    "--plan",
+    action="store_true",
+    help="Collapse equivalent merge configs, run each distinct merge once and share its results"
+)
+parser.add_argument(
+    "--plan-only",
+    action="store_true",
+    help="Print the plan (distinct merges, estimated cost) and exit"
 )
 args = parser.parse_args()
-os.environ["CUDA_VISIBLE_DEVICES"] = str(args.gpu_id)
+if args.successive_halving and args.tpe:
+    parser.error("--successive-halving and --tpe cannot be combined")
+if (args.successive_halving or args.tpe) and args.metric is None:
+    parser.error("--successive-halving and --tpe require --metric")
+if args.tpe and (args.plan or args.plan_only):
+    parser.error("--plan cannot be combined with --tpe")
+if args.successive_halving and args.cache_dir is None:
+    parser.error("--successive-halving requires --cache-dir, so that survivors are not merged again in every rung")
+
+# Shared sweep helpers
+# Adjust paths as necessary
+utils_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils")
+sys.path.append(utils_dir)
+from sweep import DeviceScheduler, Job, Step, lora_composable, lora_merge_command, mergekit_command, native_merge_command, parse_devices
+from manifest import RunManifest
+from eval_worker import EvalService
+from merge_cache import MergeCache
+from search import SuccessiveHalving, TPESearch, slice_dataset, tag_scores
+from planner import Plan
+
+# Optional cache of merged models (required by successive halving)
+cache = MergeCache(args.cache_dir, args.cache_budget_gb) if args.cache_dir else None
 
 # Model IDs
 # Adjust paths as needed
@@ -43,8 +167,7 @@ eval_repo = "ResponsibleNLP"
 dataset_dir = os.path.join(eval_repo, "hbr_sampled")
 results_dir = os.path.join(eval_repo, "result_grid_search")
 
-# Error handling
-failures = []
+# Log directory
 log_dir = os.path.join(config_dir, "logs_grid_search")
 os.makedirs(log_dir, exist_ok=True)
 
@@ -53,6 +176,15 @@ os.makedirs(output_dir, exist_ok=True)
 os.makedirs(config_dir, exist_ok=True)
 os.makedirs(results_dir, exist_ok=True)
 
+# Journal of finished tags, a restarted sweep skips them
+manifest = RunManifest(os.path.join(log_dir, "manifest_grid_search.jsonl"), resume=not args.fresh)
+
+# One job queue per device slot, optionally with merges running ahead
+scheduler = DeviceScheduler(parse_devices(args.gpu_id), lookahead=args.pipeline, manifest=manifest)
+
+# Optional long-lived evaluation workers (one per device slot)
+service = EvalService() if args.eval_worker else None
+
 # Search space for optimal parameter values
 search_space = {
     "weight": [[0.3,0.3],[0.5,0.5],[0.7,0.7]],
@@ -77,130 +209,230 @@ method_params = {
     "sce": ["select_top_k"],
 }
 
+def build_job(candidate, rung_dataset_dir, rung_results_dir, job_tag=None):
+    """
+    Merge + evaluation job of one configuration on the given dataset.
+    job_tag names the job in the manifest and logs (default: the tag).
+    """
+    tag, method, config = candidate["tag"], candidate["method"], candidate["config"]
+    config_path, output_path = candidate["config_path"], candidate["output_path"]
+    job_tag = job_tag or tag
+
+    # Log file paths
+    merge_log = os.path.join(log_dir, f"{job_tag}_merge_grid_search.log")
+    eval_log = os.path.join(log_dir, f"{job_tag}_eval_grid_search.log")
+
+    # Merge step, served from the merge cache if enabled
+    if args.lora_merge and lora_composable(config):
+        merge_cmd = lora_merge_command(config_path, output_path)
+    elif args.native_merge and method == "linear":
+        merge_cmd = native_merge_command(config_path, output_path)
+    else:
+        merge_cmd = mergekit_command(config_path, output_path, cuda=not args.pipeline)
+    merge_step = Step(
+        "merge",
+        merge_cmd,
+        cwd=merge_repo,
+        log_path=merge_log,
+    )
+    cleanup = [output_path]
+    if cache is not None:
+        merge_step = cache.wrap(merge_step, config, output_path)
+        cleanup = [partial(cache.release, output_path)]
+
+    # Evaluation step, optionally in a long-lived worker
+    eval_step = Step(
+        "eval",
+        [
+            "python", "-m", "robbie.eval",
+            "--dataset", "holisticbiasr",
+            "--model-id", output_path,
+            "--metric", "regard",
+            "--dataset-dir", rung_dataset_dir,
+            "--predictor", "hf_causal",
+            "--device", "cuda",
+            "--result-dir", rung_results_dir,
+            "--seed", "42",
+            "--batch-size", "4",
+        ],
+        cwd=eval_repo,
+        log_path=eval_log,
+    )
+    if service is not None:
+        eval_step = service.wrap(eval_step)
+
+    # Merge + evaluation
+    return Job(
+        tag=job_tag,
+        steps=[
+            merge_step,
+            eval_step,
+        ],
+        cleanup=cleanup,
+    )
+
+def eval_path(path):
+    """
+    A dataset or result path as seen by robbie.eval (which runs in eval_repo).
+    """
+    return os.path.join(eval_repo, path)
+
+def make_candidate(method, param_dict, political_model, gender_model):
+    """
+    Write the YAML config of one grid point and return its description.
+    """
+    # Extract only model-specific parameters
+    model_params = {
+        k: param_dict[k]
+        for k in ["weight", "density", "gamma", "epsilon"]
+        if k in param_dict
+    }
+
+    models_block = [
+        {"model": political_model, "parameters": model_params},
+        {"model": gender_model, "parameters": model_params}
+    ]
+
+    # Construct configuration for YAML file
+    config = {
+        "models": models_block,
+        "merge_method": method,
+        "random_seed": 42
+    }
+
+    # Add base model if required
+    if method != "linear":
+        config["base_model"] = base_model
+
+    # Add top-level parameters
+    for key in ["normalize", "lambda", "select_top_k"]:
+        if key in param_dict:
+            config[key] = param_dict[key]
+
+    # Generate unique tag
+    political_name = os.path.basename(political_model)
+    gender_name = os.path.basename(gender_model)
+    tag = f"{method}_{political_name}_{gender_name}_" + "_".join(
+        f"{k}{str(v).replace('.', '')}" for k, v in param_dict.items())
+
+    # Paths
+    config_path = os.path.join(config_dir, f"{tag}.yml")
+    output_path = os.path.join(output_dir, tag)
+
+    # Save YAML config
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    return {
+        "tag": tag,
+        "method": method,
+        "config": config,
+        "config_path": config_path,
+        "output_path": output_path,
+    }
+
+# All configurations of the grid (the TPE search proposes its own)
+candidates = []
+
 # Iterate over all combinations of
 # two biases + merging technique + parameter value
 # Outer loop: methods (one at a time)
-for method, param_keys in method_params.items():
+for method, param_keys in ([] if args.tpe else method_params.items()):
     param_values = [search_space[p] for p in param_keys]
 
     # Loop over all parameter combinations FIRST
     for values in itertools.product(*param_values):
         param_dict = dict(zip(param_keys, values))
 
-        # Extract only model-specific parameters
-        model_params = {
-            k: param_dict[k]
-            for k in ["weight", "density", "gamma", "epsilon"]
-            if k in param_dict
-        }
-
         # Now loop over all model combinations
         for political_model in political_models:
             for gender_model in gender_models:
-                models_block = [
-                    {"model": political_model, "parameters": model_params},
-                    {"model": gender_model, "parameters": model_params}
-                ]
-                
-                # Construct configuration for YAML file
-                config = {
-                    "models": models_block,
-                    "merge_method": method,
-                    "random_seed": 42
-                }
-
-                # Add base model if required
-                if method != "linear":
-                    config["base_model"] = base_model
-
-                # Add top-level parameters
-                for key in ["normalize", "lambda", "select_top_k"]:
-                    if key in param_dict:
-                        config[key] = param_dict[key]
-
-                # Generate unique tag
-                political_name = os.path.basename(political_model)
-                gender_name = os.path.basename(gender_model)
-                tag = f"{method}_{political_name}_{gender_name}_" + "_".join(
-                    f"{k}{str(v).replace('.', '')}" for k, v in param_dict.items())
-
-                # Paths
-                config_path = os.path.join(config_dir, f"{tag}.yml")
-                output_path = os.path.join(output_dir, tag)
-
-                # Save YAML config
-                with open(config_path, "w") as f:
-                    yaml.safe_dump(config, f)
-
-                # Log file paths
-                merge_log = os.path.join(log_dir, f"{tag}_merge_grid_search.log")
-                eval_log = os.path.join(log_dir, f"{tag}_eval_grid_search.log")
-
-                start_time = time.time()
-                # Merge step
-                try:
-                    with open(merge_log, "w") as log_f:
-                        subprocess.run(
-                            [
-                                "mergekit-yaml",
-                                config_path,
-                                output_path,
-                                "--lazy-unpickle",
-                                "--allow-crimes",
-                                "--random-seed", "42",
-                                "--safe-serialization",
-                                "--write-model-card", 
-                                "--trust-remote-code",
-                                "--cuda"
-                            ],
-                            cwd=merge_repo,
-                            stdout=log_f, stderr=subprocess.STDOUT,
-                            check=True
-                        )
-                except subprocess.CalledProcessError:
-                    failures.append((tag, "merge"))
-                    print(f"[ERROR] Merge failed for: {tag}")
-                    traceback.print_exc()
-                    continue  # skip to next configuration
-
-                # Evaluation step
-                try:
-                    with open(eval_log, "w") as log_f:
-                        subprocess.run(
-                            [
-                                "python", "-m", "robbie.eval",
-                                "--dataset", "holisticbiasr",
-                                "--model-id", output_path,
-                                "--metric", "regard",
-                                "--dataset-dir", dataset_dir,
-                                "--predictor", "hf_causal",
-                                "--device", "cuda",
-                                "--result-dir", results_dir,
-                                "--seed", "42",
-                                "--batch-size", "4",
-                            ],
-                            cwd=eval_repo,
-                            stdout=log_f, stderr=subprocess.STDOUT,
-                            check=True,
-                        )
-                except subprocess.CalledProcessError:
-                    failures.append((tag, "eval"))
-                    print(f"[ERROR] Evaluation failed for: {tag}")
-                    traceback.print_exc()
-                    continue  # skip to next configuration
-
-                # Cleanup
-                try:
-                    if os.path.exists(output_path):
-                        subprocess.run(["rm", "-rf", output_path])
-                except Exception:
-                    print(f"[WARNING] Could not delete {output_path}")
-
-                # Print last runtime
-                end_time = time.time()
-                elapsed = end_time - start_time
-                mins, secs = divmod(elapsed, 60)
-                print(f"[INFO] Finished {tag} in {int(mins)}m {int(secs)}s.")
+                candidates.append(make_candidate(method, param_dict, political_model, gender_model))
+
+# Optional planning stage: every distinct merge runs once
+plan = None
+if args.plan or args.plan_only:
+    plan = Plan(candidates)
+    print(plan.summary([manifest.path], len(scheduler.devices), manifest))
+    if args.plan_only:
+        sys.exit(0)
+    candidates = plan.primaries
+
+if args.tpe:
+    # Model-based search: propose batches of points from the scores so far
+    # Search space of the TPE; a parameter may also be a range, e.g. {"low": 0.05, "high": 1.5, "round": 3}
+    tpe_space = {
+        "method": list(method_params),
+        "models": [[p, g] for p in political_models for g in gender_models],
+        **search_space,
+    }
+    tpe = TPESearch(
+        tpe_space, "method", method_params, goal=args.goal,
+        state_path=args.tpe_state or os.path.join(log_dir, "tpe_state.json"),
+    )
+    parallel = args.tpe_parallel or len(scheduler.devices)
+    failures = []
+    while tpe.completed() < args.tpe_budget:
+        # Points left pending by an interrupted run come first
+        points = list(tpe.pending)
+        while len(points) < parallel and tpe.completed() + len(points) < args.tpe_budget:
+            point = tpe.propose()
+            if point is None:
+                break
+            points.append(point)
+        if not points:
+            print(f"[INFO] TPE: every configuration of the search space is evaluated ({tpe.completed()}).")
+            break
+        batch = []
+        for point in points:
+            param_dict = {k: point[k] for k in method_params[point["method"]]}
+            candidate = make_candidate(point["method"], param_dict, *point["models"])
+            batch.append((point, candidate))
+            scheduler.submit(build_job(candidate, dataset_dir, results_dir))
+        failures = scheduler.run()
+        scores = tag_scores(eval_path(results_dir), [c["tag"] for _, c in batch], args.metric)
+        for point, candidate in batch:
+            tpe.observe(point, scores[candidate["tag"]])
+        best = tpe.best()
+        print(f"[INFO] TPE: {tpe.completed()}/{args.tpe_budget} evaluated, best so far "
+              f"{best['score'] if best else None} ({best['point'] if best else None})")
+elif not args.successive_halving:
+    # Full grid: run all jobs, each on the next free device
+    for candidate in candidates:
+        scheduler.submit(build_job(candidate, dataset_dir, results_dir))
+    failures = scheduler.run()
+else:
+    # Successive halving: nested stratified slices, the best 1/eta move on
+    # Survivors' merges come from the merge cache in later rungs
+    halving = SuccessiveHalving(
+        [c["tag"] for c in candidates], args.sh_min_fraction, args.sh_eta, args.goal
+    )
+    by_tag = {c["tag"]: c for c in candidates}
+    failures = []
+    while not halving.done():
+        rung, fraction = halving.rung, halving.fraction
+        if fraction < 1:
+            rung_dataset_dir = f"{dataset_dir}_sh{rung}"
+            slice_dataset(eval_path(dataset_dir), eval_path(rung_dataset_dir), fraction, args.sh_strata)
+            rung_results_dir = f"{results_dir}_sh{rung}"
+        else:
+            rung_dataset_dir, rung_results_dir = dataset_dir, results_dir
+        os.makedirs(rung_results_dir, exist_ok=True)
+        print(f"[INFO] Rung {rung}: {len(halving.survivors)} configurations on {fraction:.1%} of the prompts")
+        for tag in halving.survivors:
+            job_tag = tag if fraction >= 1 else f"{tag}_sh{rung}"
+            scheduler.submit(build_job(by_tag[tag], rung_dataset_dir, rung_results_dir, job_tag))
+        failures = scheduler.run()
+        halving.promote(tag_scores(eval_path(rung_results_dir), halving.survivors, args.metric))
+    halving.save(os.path.join(log_dir, "successive_halving.json"))
+    print(f"[INFO] Best configuration: {halving.best()} "
+          f"({halving.cost():.1%} of the prompt evaluations of the full grid)")
+
+# Tags whose merge is equivalent to an evaluated one share its results
+if plan is not None:
+    plan.fan_out(manifest, eval_path(results_dir))
+if service is not None:
+    service.close()
 
 # Print failure summary
 if failures:
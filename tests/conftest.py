@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The utils and dataset_extend modules are standalone scripts with flat imports
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ("utils", os.path.join("advpromptset", "dataset_extend")):
+    sys.path.insert(0, os.path.join(repo_root, path))
@@ -0,0 +1,137 @@
+"""
+Tiny synthetic phi3-style checkpoints and LoRA adapters for the merge tests.
+"""
+
+import json
+import os
+
+import torch
+from safetensors.torch import save_file
+
+from linear_merge import write_sharded
+from lora_merge import module_prefix
+
+lora_targets = ["self_attn.qkv_proj", "self_attn.o_proj", "mlp.down_proj"]
+
+
+def phi3_tensors(seed, layers=3, hidden=8, vocab=16, dtype=torch.float32):
+    """
+    Random tensors with the names and (scaled down) shapes of Phi-3.
+    """
+    g = torch.Generator().manual_seed(seed)
+    shapes = {
+        "model.embed_tokens.weight": (vocab, hidden),
+        "model.norm.weight": (hidden,),
+        "lm_head.weight": (vocab, hidden),
+    }
+    for i in range(layers):
+        prefix = f"model.layers.{i}."
+        shapes.update({
+            prefix + "self_attn.qkv_proj.weight": (3 * hidden, hidden),
+            prefix + "self_attn.o_proj.weight": (hidden, hidden),
+            prefix + "mlp.gate_up_proj.weight": (4 * hidden, hidden),
+            prefix + "mlp.down_proj.weight": (hidden, 2 * hidden),
+            prefix + "input_layernorm.weight": (hidden,),
+            prefix + "post_attention_layernorm.weight": (hidden,),
+        })
+    return {name: torch.randn(shape, generator=g).to(dtype) for name, shape in shapes.items()}
+
+
+def save_checkpoint(path, tensors, max_shard_size=5 * 1024 ** 3):
+    write_sharded(tensors.items(), str(path), max_shard_size)
+    with open(os.path.join(path, "config.json"), "w") as f:
+        json.dump({"architectures": ["Phi3ForCausalLM"], "model_type": "phi3",
+                   "num_hidden_layers": sum(".input_layernorm." in n for n in tensors)}, f)
+    with open(os.path.join(path, "tokenizer_config.json"), "w") as f:
+        json.dump({"model_max_length": 4096}, f)
+
+
+def lora_factors(base, seed, r=2, alpha=4, rank_pattern=None):
+    """
+    Random PEFT factors for the target modules of a base state dict,
+    as {module: (A, B, scaling)}.
+    """
+    g = torch.Generator().manual_seed(seed)
+    factors = {}
+    for name, weight in base.items():
+        module = name[:-len(".weight")]
+        if not any(module.endswith(t) for t in lora_targets):
+            continue
+        rank = (rank_pattern or {}).get(module, r)
+        a = torch.randn(rank, weight.shape[1], generator=g) * 0.1
+        b = torch.randn(weight.shape[0], rank, generator=g) * 0.1
+        factors[module] = (a, b, alpha / rank)
+    return factors
+
+
+def save_adapter(path, factors, base_path, r=2, alpha=4, rank_pattern=None):
+    os.makedirs(path, exist_ok=True)
+    state = {}
+    for module, (a, b, _) in factors.items():
+        state[f"{module_prefix}{module}.lora_A.weight"] = a.contiguous()
+        state[f"{module_prefix}{module}.lora_B.weight"] = b.contiguous()
+    save_file(state, os.path.join(path, "adapter_model.safetensors"), metadata={"format": "pt"})
+    with open(os.path.join(path, "adapter_config.json"), "w") as f:
+        json.dump({
+            "peft_type": "LORA",
+            "base_model_name_or_path": str(base_path),
+            "r": r,
+            "lora_alpha": alpha,
+            "rank_pattern": rank_pattern or {},
+            "alpha_pattern": {},
+            "target_modules": lora_targets,
+        }, f)
+
+
+def merge_and_unload(base, factors):
+    """
+    Full weights of base + one adapter, like PEFT's merge_and_unload.
+    """
+    merged = dict(base)
+    for module, (a, b, scaling) in factors.items():
+        merged[module + ".weight"] = base[module + ".weight"] + (b @ a) * scaling
+    return merged
+
+
+def save_tiny_lm(path, seed=0):
+    """
+    A small random Llama model in float64 (so batched and single-row
+    greedy decoding agree) plus a byte-level tokenizer without merges,
+    where every prompt prefix tokenizes to a prefix of the prompt tokens.
+    """
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    vocab = {c: i for i, c in enumerate(sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    vocab["<|endoftext|>"] = len(vocab)
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>").save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=512,
+        bos_token_id=len(vocab) - 1, eos_token_id=len(vocab) - 1, initializer_range=0.2,
+    )
+    LlamaForCausalLM(config).to(torch.float64).save_pretrained(path)
+
+
+def load_tiny_lm(path):
+    from transformers import AutoTokenizer, LlamaForCausalLM
+
+    model = LlamaForCausalLM.from_pretrained(path, torch_dtype=torch.float64).eval()
+    return model, AutoTokenizer.from_pretrained(path)
+
+
+def save_tiny_adapter(path, base_path, seed):
+    """
+    A PEFT LoRA adapter with random (non-zero) A and B for save_tiny_lm.
+    """
+    from peft import LoraConfig, get_peft_model
+
+    base, _ = load_tiny_lm(base_path)
+    torch.manual_seed(seed)
+    config = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    get_peft_model(base, config).save_pretrained(path)
@@ -0,0 +1,48 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ann_index import IVFIndex, recall_at_k  # noqa: E402
+from knn import CandidateMatrix, normalize_rows, top_k  # noqa: E402
+
+
+def clustered_unit_vectors(n, centers=40, dim=32, seed=0):
+    """
+    Unit vectors around random centres, like embeddings of related terms.
+    """
+    rng = np.random.default_rng(seed)
+    means = rng.standard_normal((centers, dim))
+    vectors = means[rng.integers(0, centers, n)] + 0.5 * rng.standard_normal((n, dim))
+    return normalize_rows(vectors)
+
+
+@pytest.fixture(scope="module")
+def candidates():
+    return clustered_unit_vectors(3000)
+
+
+def test_save_load_round_trip(tmp_path, candidates):
+    index = IVFIndex.build(candidates, key="vocab")
+    index.save(str(tmp_path / "ivf"))
+    loaded = IVFIndex.load(str(tmp_path / "ivf"))
+
+    assert loaded.meta == index.meta
+    for name in ("centroids", "vectors", "ids", "offsets"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+    # Every candidate is stored exactly once
+    assert sorted(loaded.ids.tolist()) == list(range(len(candidates)))
+
+    queries = clustered_unit_vectors(20, seed=1)
+    for a, b in zip(index.search(queries, k=10), loaded.search(queries, k=10)):
+        np.testing.assert_array_equal(a, b)
+    assert IVFIndex.load_or_build(str(tmp_path / "ivf"), candidates, "vocab").meta == index.meta
+
+
+def test_recall_against_exact_top_k(candidates):
+    index = IVFIndex.build(candidates)
+    queries = clustered_unit_vectors(200, seed=2)
+    exact, _ = top_k(queries, CandidateMatrix(candidates), k=20)
+    approx, scores = index.search(queries, k=20)
+
+    assert recall_at_k(approx, exact) >= 0.9
+    assert np.all(np.diff(scores, axis=1) <= 0)
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from columnar import ParquetSink, iter_entries, read_extended  # noqa: E402
+from dataset_extend import extend_dataset, political_group_order  # noqa: E402
+
+
+def test_parquet_round_trip_is_lossless(tmp_path):
+    entries = [
+        {"id": 0, "prompt_text": "a liberal tory", "sensigrp_comb": "1" * 36, "communist": 0, "socialist": 0,
+         "liberal": 1, "conservative": 1, "fascist": 0, "other_political_ideology": 0},
+        # No prompt_text, flags before the comb and fields in another order
+        {"sensigrp_comb": "0" * 36, "liberal": 0, "id": 1, "communist": 0, "socialist": 0,
+         "conservative": 0, "fascist": 0, "other_political_ideology": 0, "meta": {"source": "x"}},
+        # Values the typed columns cannot hold
+        {"prompt_text": None, "sensigrp_comb": "0" * 36, "communist": True, "socialist": 2,
+         "liberal": 0, "conservative": 0, "fascist": 0, "other_political_ideology": 0},
+    ]
+    sink = ParquetSink(str(tmp_path / "out.parquet"), political_group_order, row_group_size=2)
+    for entry in entries:
+        sink.add(dict(entry))
+    sink.close()
+
+    restored = list(iter_entries(str(tmp_path / "out.parquet")))
+    assert [json.dumps(e) for e in restored] == [json.dumps(e) for e in entries]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parquet_output_matches_jsonl(tmp_path, workers):
+    lines = [
+        {"prompt_text": "the commie and the nazi", "sensigrp_comb": "01" * 15, "id": i} if i % 3 else
+        {"id": i, "prompt_text": "nothing here"}
+        for i in range(40)
+    ]
+    (tmp_path / "input.jsonl").write_text("".join(json.dumps(line) + "\n" for line in lines))
+    extend_dataset(str(tmp_path / "input.jsonl"), str(tmp_path / "out.jsonl"))
+    extend_dataset(str(tmp_path / "input.jsonl"), str(tmp_path / "out.parquet"), workers=workers,
+                   chunks_per_worker=2, output_format="parquet")
+
+    expected = (tmp_path / "out.jsonl").read_text().splitlines()
+    assert [json.dumps(e) for e in iter_entries(str(tmp_path / "out.parquet"))] == expected
+
+    fascist = read_extended(str(tmp_path / "out.parquet"), columns=["prompt_text"], all_of=["fascist"])
+    assert fascist.num_rows == sum(1 for i in range(40) if i % 3)
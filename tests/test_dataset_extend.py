@@ -0,0 +1,143 @@
+import json
+import random
+import re
+from collections import Counter
+
+import pytest
+
+from dataset_extend import (
+    TermMatcher, chunk_ranges, extend_dataset, iter_range, match_groups_scan, political_group_order, political_groups,
+    word_pattern,
+)
+
+words = ["the", "vote", "liberal", "Fascism", "marx", "tory", "commie", "socialists", "café", "people", "Nazi!"]
+
+
+def sequential_reference(input_path, output_path):
+    """
+    The original single-process loop of dataset_extend.py.
+    """
+    match_counter = Counter()
+    with open(input_path, "r", encoding="utf-8") as infile, open(output_path, "w", encoding="utf-8") as outfile:
+        for line in infile:
+            entry = json.loads(line)
+            comb = entry.get("sensigrp_comb", "")
+            comb = comb.ljust(30, "0") if len(comb) < 30 else comb + "000000"
+            comb_list = list(comb)
+            for group in political_group_order:
+                entry[group] = entry.get(group, 0)
+            words_in_prompt = set(re.findall(r"\b\w+\b", entry.get("prompt_text", "").lower()))
+            for i, group in enumerate(political_group_order):
+                if any(syn in words_in_prompt for syn in political_groups[group]):
+                    comb_list[-6 + i] = "1"
+                    entry[group] = 1
+                    match_counter[group] += 1
+            entry["sensigrp_comb"] = "".join(comb_list)
+            outfile.write(json.dumps(entry) + "\n")
+    return match_counter
+
+
+def write_fixture(path, n=300, trailing_newline=True, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        entry = {"id": i, "prompt_text": " ".join(rng.choice(words) for _ in range(rng.randint(0, 12)))}
+        if i % 7:
+            entry["sensigrp_comb"] = "".join(rng.choice("01") for _ in range(rng.choice([12, 30])))
+        if i % 50 == 3:
+            # Long line that straddles several chunk boundaries
+            entry["prompt_text"] += " filler" * 400 + " socialism"
+        if i % 11 == 5:
+            entry.pop("prompt_text")
+        lines.append(json.dumps(entry, ensure_ascii=i % 2 == 0))
+    text = "\n".join(lines) + ("\n" if trailing_newline else "")
+    path.write_bytes(text.encode("utf-8"))
+    return path
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize("workers", [1, 4])
+def test_parallel_output_matches_sequential(tmp_path, workers, trailing_newline):
+    input_path = write_fixture(tmp_path / "input.jsonl", trailing_newline=trailing_newline)
+    expected_counts = sequential_reference(input_path, tmp_path / "expected.jsonl")
+
+    counts = extend_dataset(str(input_path), str(tmp_path / "output.jsonl"), workers=workers, chunks_per_worker=8)
+
+    assert (tmp_path / "output.jsonl").read_bytes() == (tmp_path / "expected.jsonl").read_bytes()
+    assert counts == expected_counts
+    assert sum(counts.values()) > 0
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+@pytest.mark.parametrize("num_chunks", [1, 3, 17, 1000])
+def test_chunk_ranges_cover_every_line_once(tmp_path, num_chunks, trailing_newline):
+    input_path = write_fixture(tmp_path / "input.jsonl", n=60, trailing_newline=trailing_newline)
+    data = input_path.read_bytes()
+    ranges = chunk_ranges(str(input_path), num_chunks)
+
+    # Contiguous, non-empty and aligned to line starts
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end > start for start, end in ranges)
+    assert all(prev[1] == cur[0] for prev, cur in zip(ranges, ranges[1:]))
+    assert all(data[start - 1:start] == b"\n" for start, _ in ranges[1:])
+
+    lines = [line for start, end in ranges for line in iter_range(str(input_path), start, end)]
+    assert b"".join(lines) == data
+
+
+def test_scan_matcher_is_the_reference():
+    assert match_groups_scan("A liberal tory, not a commie.") == 0b1101
+    assert match_groups_scan("liberals and socialists") == 0
+
+
+# Multi-word terms added to the word lists (trie path)
+phrases = {"socialist": ["social democrat"], "liberal": ["new deal"], "fascist": ["far right", "far right wing"]}
+phrase_words = ["social", "democrat", "new", "deal", "far", "right", "wing", "liberal", "tory"]
+
+
+def phrase_reference(prompt):
+    """
+    match_groups_scan plus a contiguous token search for every phrase.
+    """
+    tokens = word_pattern.findall(prompt.lower())
+    mask = match_groups_scan(prompt)
+    for i, group in enumerate(political_group_order):
+        for phrase in phrases.get(group, []):
+            n = len(phrase.split())
+            if any(tokens[j:j + n] == phrase.split() for j in range(len(tokens))):
+                mask |= 1 << i
+    return mask
+
+
+def test_phrase_terms_match_contiguous_tokens():
+    groups = {g: political_groups[g] + phrases.get(g, []) for g in political_group_order}
+    matcher = TermMatcher(groups, political_group_order)
+    assert matcher.match("A Social-Democrat, far right!") == 0b10010
+    assert matcher.match("social and democrat, right far") == 0
+
+    rng = random.Random(0)
+    for _ in range(500):
+        prompt = " ".join(rng.choice(phrase_words + words) for _ in range(rng.randint(0, 10)))
+        assert matcher.match(prompt) == phrase_reference(prompt)
+
+
+# Stand-in for WordNet (nltk is optional)
+lemmas = {"liberals": "liberal", "socialists": "socialist", "tories": "tory", "commies": "commie", "nazis": "nazi"}
+
+
+def lemmatize(token):
+    return lemmas.get(token, token)
+
+
+def test_lemmatize_matches_inflected_forms():
+    matcher = TermMatcher(political_groups, political_group_order, lemmatize)
+    assert match_groups_scan("liberals and socialists") == 0
+    assert matcher.match("liberals and socialists") == 0b110
+
+    rng = random.Random(1)
+    for _ in range(500):
+        prompt = " ".join(rng.choice(list(lemmas) + words) for _ in range(rng.randint(0, 10)))
+        lemmatized = " ".join(lemmatize(t) for t in word_pattern.findall(prompt.lower()))
+        # Lemmas and raw tokens both count; uninflected prompts match like the scan
+        assert matcher.match(prompt) == match_groups_scan(prompt) | match_groups_scan(lemmatized)
+        assert matcher.match(lemmatized) == match_groups_scan(lemmatized)
@@ -0,0 +1,60 @@
+import subprocess
+
+import pytest
+
+# The worker imports both before its first job
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from eval_worker import EvalService  # noqa: E402
+from sweep import Step, run_step  # noqa: E402
+from test_sequential import eval_repo  # noqa: E402,F401
+
+
+def eval_step(eval_repo, tag, result_dir, dataset_dir="data"):
+    return Step("eval", [
+        "python", "-m", "robbie.eval", "--model-id", f"models/{tag}", "--dataset-dir", dataset_dir,
+        "--device", "cuda", "--result-dir", result_dir,
+    ], cwd=str(eval_repo), log_path=str(eval_repo / f"{tag}_{result_dir}.log"))
+
+
+def test_worker_matches_subprocess(eval_repo):
+    service = EvalService()
+    try:
+        for tag in ["phi3_left", "phi3_right"]:
+            run_step(service.wrap(eval_step(eval_repo, tag, "results_worker")), "cpu")
+            run_step(eval_step(eval_repo, tag, "results"), "cpu")
+    finally:
+        service.close()
+
+    # Both jobs ran in the same worker
+    assert service.jobs == 2
+    assert len(service.workers) == 1
+    for tag in ["phi3_left", "phi3_right"]:
+        worker_output = (eval_repo / "results_worker" / tag / "gen.jsonl").read_bytes()
+        assert worker_output == (eval_repo / "results" / tag / "gen.jsonl").read_bytes()
+
+
+def test_failing_job_is_reported(eval_repo):
+    service = EvalService()
+    try:
+        with pytest.raises(subprocess.CalledProcessError):
+            run_step(service.wrap(eval_step(eval_repo, "phi3_left", "results", dataset_dir="missing")), "cpu")
+        assert "FileNotFoundError" in (eval_repo / "phi3_left_results.log").read_text()
+
+        # The worker survives the failure and takes the next job
+        run_step(service.wrap(eval_step(eval_repo, "phi3_right", "results")), "cpu")
+        assert (eval_repo / "results" / "phi3_right" / "gen.jsonl").exists()
+        assert len(service.workers) == 1
+    finally:
+        service.close()
+
+
+def test_close_stops_workers(eval_repo):
+    service = EvalService()
+    run_step(service.wrap(eval_step(eval_repo, "phi3_left", "results")), "cpu")
+    process = service.workers[0].process
+    assert process.poll() is None
+
+    service.close()
+    assert process.poll() == 0
@@ -0,0 +1,93 @@
+import json
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from dataset_extend import extend_dataset, political_group_order  # noqa: E402
+from group_index import GroupIndex, PackedColumns  # noqa: E402
+from test_dataset_extend import words, write_fixture  # noqa: E402
+
+# Names of the first sensigrp_comb positions (uniform fixture: 12 characters)
+sensitive_groups = [f"group{j}" for j in range(12)]
+
+
+def write_uniform_fixture(path, n=200):
+    rng = random.Random(2)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            entry = {"id": i, "prompt_text": " ".join(rng.choice(words) for _ in range(rng.randint(0, 8))),
+                     "sensigrp_comb": "".join(rng.choice("01") for _ in range(12))}
+            f.write(json.dumps(entry) + "\n")
+    return path
+
+
+def has(entry, group):
+    if group in political_group_order:
+        return entry[group] == 1
+    return entry["sensigrp_comb"][sensitive_groups.index(group)] == "1"
+
+
+def reference(entries, all_of=(), any_of=(), none_of=()):
+    """
+    Filter the JSON entries by their group fields.
+    """
+    return [
+        i for i, entry in enumerate(entries)
+        if all(has(entry, g) for g in all_of)
+        and (not any_of or any(has(entry, g) for g in any_of))
+        and not any(has(entry, g) for g in none_of)
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_select_matches_json_filter(tmp_path, workers):
+    input_path = write_uniform_fixture(tmp_path / "input.jsonl")
+    output = str(tmp_path / "output.jsonl")
+    extend_dataset(str(input_path), output, workers=workers, chunks_per_worker=2, index=True,
+                   sensitive_groups=sensitive_groups)
+    with open(output, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    index = GroupIndex(output)
+
+    # One bit per name, none shared with another group
+    assert len(set(index.groups.values())) == len(index.groups) == len(sensitive_groups) + len(political_group_order)
+    for query in [
+        dict(all_of=["liberal"]),
+        dict(all_of=["group0", "conservative"]),
+        dict(any_of=["communist", "socialist"], none_of=["fascist"]),
+        dict(all_of=["group3"], any_of=["liberal", "group7"], none_of=["group11"]),
+    ]:
+        rows = index.select(**query)
+        assert rows.tolist() == reference(entries, **query) != []
+        assert list(index.entries(rows)) == [entries[i] for i in rows]
+    assert index.bit(0) == index.bit("group0")
+
+
+def test_mixed_comb_lengths_index_political_groups_only(tmp_path):
+    # The fixture mixes 12- and 30-character combs (36 after the extension)
+    input_path = write_fixture(tmp_path / "input.jsonl", n=200)
+    output = str(tmp_path / "output.jsonl")
+    extend_dataset(str(input_path), output, index=True, sensitive_groups=sensitive_groups)
+    with open(output, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    index = GroupIndex(output)
+
+    assert set(index.groups) == set(political_group_order)
+    rows = index.select(all_of=["liberal"], none_of=["communist"])
+    assert rows.tolist() == reference(entries, all_of=["liberal"], none_of=["communist"])
+    with pytest.raises(ValueError, match="lengths differ"):
+        index.bit(0)
+
+
+@pytest.mark.parametrize("names", [
+    [f"group{j}" for j in range(25)],
+    ["group0", "group1", "group0"],
+    ["group0", "liberal"],
+])
+def test_ambiguous_group_names_are_rejected(tmp_path, names):
+    packed = PackedColumns()
+    packed.add("0" * 30, 10)
+    with pytest.raises(ValueError):
+        packed.write(str(tmp_path / "output.jsonl"), political_group_order, names)
@@ -0,0 +1,87 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from inference import AdapterPool  # noqa: E402
+from serving import PrefixCache  # noqa: E402
+from synthetic import load_tiny_lm, save_tiny_adapter, save_tiny_lm  # noqa: E402
+
+names = ["women", "men", "liberal"]
+
+
+@pytest.fixture(scope="module")
+def tiny(tmp_path_factory):
+    root = tmp_path_factory.mktemp("tiny")
+    save_tiny_lm(root / "base")
+    for seed, name in enumerate(names, start=1):
+        save_tiny_adapter(root / name, root / "base", seed)
+    return root
+
+
+def pool(tiny, capacity):
+    base, tokenizer = load_tiny_lm(tiny / "base")
+    registry = {name: {"repo": str(tiny / name), "subreddit": name} for name in names}
+    return AdapterPool(base, capacity, registry), tokenizer
+
+
+def test_least_recently_used_adapter_is_evicted(tiny):
+    adapters, _ = pool(tiny, 2)
+    adapters.get("women")
+    adapters.get("men")
+    adapters.get("women")
+    model = adapters.get("liberal")
+
+    assert list(adapters.resident) == ["women", "liberal"]
+    assert set(model.peft_config) == {"women", "liberal"}
+    assert (adapters.loads, adapters.evictions) == (3, 1)
+    with pytest.raises(KeyError):
+        adapters.get("unknown")
+
+
+def test_active_and_acquired_adapters_are_kept(tiny):
+    adapters, _ = pool(tiny, 1)
+    adapters.get("women")
+    assert adapters.model.active_adapter == "women"
+
+    # With capacity 1 the active adapter is replaced, never left without one
+    model = adapters.get("men")
+    assert list(adapters.resident) == ["men"]
+    assert model.active_adapter == "men"
+    assert set(model.peft_config) == {"men"}
+    model(input_ids=torch.tensor([[1, 2, 3]]))
+
+    with pytest.raises(RuntimeError, match="only resident adapter"):
+        adapters.evict("men")
+    with pytest.raises(RuntimeError, match="too small"):
+        adapters.acquire(["women", "men"])
+    assert list(adapters.resident) == ["men"]
+
+
+def test_eviction_drops_prefix_cache_entries(tiny):
+    adapters, tokenizer = pool(tiny, 2)
+    cache = PrefixCache()
+    adapters.on_evict.append(cache.evict_adapter)
+    for name in ["women", "men"]:
+        model = adapters.get(name)
+        model.set_adapter(name)
+        cache.get(model, tokenizer, name, f"Ask{name}")
+
+    adapters.acquire(["men", "liberal"])
+    assert list(adapters.resident) == ["men", "liberal"]
+    assert set(cache.entries) == {("men", "Askmen")}
+
+
+def test_stats(tiny):
+    adapters, _ = pool(tiny, 2)
+    for name in names:
+        adapters.get(name)
+
+    stats = adapters.stats()
+    assert stats["resident"] == ["men", "liberal"]
+    assert (stats["capacity"], stats["loads"], stats["evictions"]) == (2, 3, 1)
+    assert set(stats["cold_start_s"]) == set(names)
+    # Same LoRA config for all adapters: same size, nothing left of the evicted one
+    assert stats["adapter_bytes"]["men"] == stats["adapter_bytes"]["liberal"] > 0
+    assert adapters.adapter_bytes("women") == 0
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embedding_store import EmbeddingStore, terms_key  # noqa: E402
+from knn import CandidateMatrix, normalize_rows, top_k  # noqa: E402
+
+
+def random_embeddings(n, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n, dim)) * rng.uniform(0.5, 3, (n, 1))).astype(np.float32)
+
+
+def test_store_keeps_unit_rows_memory_mapped(tmp_path):
+    terms = [f"term{i}" for i in range(100)]
+    embeddings = random_embeddings(len(terms))
+    store = EmbeddingStore(str(tmp_path))
+    store.save("model", terms, embeddings)
+
+    loaded = EmbeddingStore(str(tmp_path)).load("model", terms)
+    assert isinstance(loaded, np.memmap) and loaded.dtype == np.float32
+    np.testing.assert_allclose(loaded, normalize_rows(embeddings), rtol=1e-6)
+    assert EmbeddingStore(str(tmp_path)).load("model", terms[:-1]) is None
+
+
+def test_store_normalises_entries_written_before(tmp_path):
+    terms = ["a", "b", "c"]
+    embeddings = random_embeddings(3)
+    key = terms_key("model", terms)
+    np.save(tmp_path / f"{key}.npy", embeddings)
+    (tmp_path / "index.json").write_text(json.dumps({key: {"model": "model", "terms": 3}}))
+
+    loaded = EmbeddingStore(str(tmp_path)).load("model", terms)
+    np.testing.assert_allclose(np.linalg.norm(loaded, axis=1), 1, rtol=1e-6)
+    assert EmbeddingStore(str(tmp_path)).index[key]["normalized"]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_candidates_from_store_match_normalising_path(tmp_path, dtype):
+    terms = [f"term{i}" for i in range(500)]
+    embeddings = random_embeddings(len(terms), seed=1)
+    stored = EmbeddingStore(str(tmp_path)).save("model", terms, embeddings)
+    queries = random_embeddings(7, seed=2)
+
+    direct = CandidateMatrix(stored, dtype, block_size=64, normalized=True)
+    if dtype == "float32":
+        # No copy: the candidate matrix is the memory map itself
+        assert direct.matrix is stored
+    reference = CandidateMatrix(embeddings, dtype, block_size=64)
+    indices, scores = top_k(queries, direct, k=10)
+    ref_indices, ref_scores = top_k(queries, reference, k=10)
+    np.testing.assert_array_equal(indices, ref_indices)
+    np.testing.assert_allclose(scores, ref_scores, atol=1e-5)
+
+
+@pytest.mark.parametrize("k,expected", [(0, 1), (1, 1), (50, 50), (51, 50), (1000, 50)])
+def test_k_is_clamped_to_the_candidates(k, expected):
+    embeddings = random_embeddings(50, seed=3)
+    queries = random_embeddings(4, seed=4)
+    indices, scores = top_k(queries, CandidateMatrix(embeddings, block_size=16), k=k)
+    assert indices.shape == scores.shape == (4, expected)
+
+    # Same ranking as a full sort of the exact scores
+    exact = normalize_rows(queries) @ normalize_rows(embeddings).T
+    np.testing.assert_array_equal(indices, np.argsort(-exact, axis=1, kind="stable")[:, :expected])
+    np.testing.assert_allclose(scores, np.sort(exact, axis=1)[:, ::-1][:, :expected], atol=1e-6)
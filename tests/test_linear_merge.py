@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+import yaml
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+from linear_merge import (  # noqa: E402
+    ShardedCheckpoint, compare, iter_merged, linear_merge_tensor, parameter_value, tensor_depth, write_merged,
+    write_sharded,
+)
+from synthetic import phi3_tensors, save_checkpoint  # noqa: E402
+
+
+def reference_linear(tensors, weights, normalize):
+    """
+    MergeKit's linear merge (mergekit/merge_methods/linear.py).
+    """
+    tensors = torch.stack(tensors, dim=0)
+    weights = torch.tensor(weights, dtype=tensors.dtype, device=tensors.device)
+    while len(weights.shape) < len(tensors.shape):
+        weights.unsqueeze_(-1)
+    res = (weights * tensors).sum(dim=0)
+    if normalize:
+        res = res / weights.sum(dim=0)
+    return res
+
+
+@pytest.fixture
+def models(tmp_path):
+    for seed, name in enumerate(["phi3_left", "phi3_right", "phi3_women"]):
+        # Inputs in bfloat16 and split over several shards, like the saved phi3_* models
+        save_checkpoint(tmp_path / name, phi3_tensors(seed, dtype=torch.bfloat16), max_shard_size=2048)
+    return tmp_path
+
+
+def linear_config(names, weights, **extra):
+    return {
+        "merge_method": "linear",
+        "models": [{"model": n, "parameters": {"weight": w}} for n, w in zip(names, weights)],
+        **extra,
+    }
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16, torch.float16])
+@pytest.mark.parametrize("normalize", [True, False])
+def test_linear_merge_tensor_is_bit_identical(dtype, normalize):
+    g = torch.Generator().manual_seed(0)
+    tensors = [torch.randn(5, 7, generator=g).to(dtype) for _ in range(3)]
+    weights = [0.3, 0.45, 0.25]
+    res = linear_merge_tensor(tensors, weights, normalize)
+    assert res.dtype == dtype
+    assert torch.equal(res, reference_linear(tensors, weights, normalize))
+
+
+def test_parameter_value_gradient():
+    assert parameter_value(0.4, 0.7) == 0.4
+    assert parameter_value([0.2, 0.2, 0.2], 0.5) == 0.2
+    assert parameter_value([0.0, 1.0], 0.25) == 0.25
+    assert parameter_value([0.0, 1.0, 0.0], 1.0) == 0.0
+
+
+@pytest.mark.parametrize("max_shard_size", [200, 5 * 1024 ** 3])
+def test_write_sharded_round_trip(tmp_path, max_shard_size):
+    tensors = phi3_tensors(0, dtype=torch.bfloat16)
+    tensors["model.norm.weight"] = tensors["model.norm.weight"].float()
+    write_sharded(tensors.items(), str(tmp_path), max_shard_size)
+
+    files = sorted(f for f in os.listdir(tmp_path) if f.endswith(".safetensors"))
+    index_path = tmp_path / "model.safetensors.index.json"
+    if max_shard_size < 1024:
+        assert len(files) > 1 and index_path.exists()
+        assert files[0] == f"model-00001-of-{len(files):05d}.safetensors"
+        assert set(json.loads(index_path.read_text())["weight_map"]) == set(tensors)
+    else:
+        assert files == ["model.safetensors"] and not index_path.exists()
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+    checkpoint = ShardedCheckpoint(str(tmp_path))
+    assert set(checkpoint.keys()) == set(tensors)
+    for name, tensor in tensors.items():
+        loaded = checkpoint.get(name)
+        assert loaded.dtype == tensor.dtype and torch.equal(loaded, tensor)
+
+
+@pytest.mark.parametrize("extra", [{}, {"dtype": "float32"}, {"dtype": "float32", "out_dtype": "bfloat16"}])
+def test_write_merged_matches_tensorwise_merge(models, extra):
+    names = ["phi3_left", "phi3_right", "phi3_women"]
+    weights = [0.5, [0.2, 0.8], 0.3]
+    config = linear_config(names, weights, **extra)
+    write_merged(config, str(models / "merged"), model_root=str(models), max_shard_size=2048)
+
+    merged = ShardedCheckpoint(str(models / "merged"))
+    inputs = [ShardedCheckpoint(str(models / n)) for n in names]
+    num_layers = inputs[0].num_layers()
+    assert merged.num_layers() == num_layers == 3
+    expected_dtype = {"out_dtype": torch.bfloat16, "dtype": torch.float32}
+    expected_dtype = next((expected_dtype[k] for k in ("out_dtype", "dtype") if k in extra), torch.bfloat16)
+
+    for name in inputs[0].keys():
+        tensors = [ckpt.get(name) for ckpt in inputs]
+        if "dtype" in extra:
+            tensors = [t.float() for t in tensors]
+        t = tensor_depth(name, num_layers)
+        expected = reference_linear(tensors, [parameter_value(w, t) for w in weights], True).to(expected_dtype)
+        assert merged.get(name).dtype == expected_dtype
+        assert torch.equal(merged.get(name), expected), name
+
+    # Config, tokenizer and merge config sit next to the shards
+    assert (models / "merged" / "config.json").exists()
+    assert (models / "merged" / "tokenizer_config.json").exists()
+    assert yaml.safe_load((models / "merged" / "mergekit_config.yml").read_text()) == config
+    assert compare(str(models / "merged"), str(models / "merged")) == []
+
+
+def test_layer_gradient_selects_models_at_the_ends(models):
+    config = linear_config(["phi3_left", "phi3_right"], [[1.0, 0.0], [0.0, 1.0]])
+    merged = dict(iter_merged(config, model_root=str(models)))
+    left, right = ShardedCheckpoint(str(models / "phi3_left")), ShardedCheckpoint(str(models / "phi3_right"))
+    first, last = "model.layers.0.mlp.down_proj.weight", "model.layers.2.mlp.down_proj.weight"
+    assert torch.equal(merged[first], left.get(first))
+    assert torch.equal(merged[last], right.get(last))
+
+
+@pytest.mark.skipif(shutil.which("mergekit-yaml") is None, reason="mergekit is not installed")
+def test_bit_identical_to_mergekit_and_faster(models):
+    config = linear_config(["phi3_left", "phi3_right", "phi3_women"], [0.5, 0.3, 0.2], dtype="bfloat16")
+    config_path = models / "config.yml"
+    config_path.write_text(yaml.safe_dump(config))
+
+    start = time.time()
+    subprocess.run(
+        ["mergekit-yaml", str(config_path), str(models / "mergekit"), "--lazy-unpickle", "--allow-crimes",
+         "--random-seed", "42", "--safe-serialization"],
+        cwd=models, check=True, capture_output=True,
+    )
+    mergekit_time = time.time() - start
+    start = time.time()
+    write_merged(config, str(models / "native"), model_root=str(models))
+    native_time = time.time() - start
+
+    assert compare(str(models / "native"), str(models / "mergekit")) == []
+    print(f"[INFO] mergekit {mergekit_time:.2f}s, native {native_time:.2f}s")
+    assert native_time < mergekit_time
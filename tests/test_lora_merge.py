@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+from linear_merge import write_merged  # noqa: E402
+from lora_merge import check_against, compose, copy_tokenizer, load_lora, write_adapter  # noqa: E402
+from synthetic import lora_factors, merge_and_unload, phi3_tensors, save_adapter, save_checkpoint  # noqa: E402
+
+
+@pytest.fixture
+def models(tmp_path):
+    """
+    A base model, three adapters (one with per-module ranks) and the
+    corresponding merge_and_unload checkpoints phi3_<name>.
+    """
+    base = phi3_tensors(0)
+    save_checkpoint(tmp_path / "base", base)
+    adapters = {}
+    for seed, name in enumerate(["left", "right", "women"], start=1):
+        rank_pattern = {"model.layers.1.self_attn.o_proj": 4} if name == "women" else None
+        factors = lora_factors(base, seed, rank_pattern=rank_pattern)
+        save_adapter(tmp_path / f"adapter_{name}", factors, tmp_path / "base", rank_pattern=rank_pattern)
+        save_checkpoint(tmp_path / f"phi3_{name}", merge_and_unload(base, factors))
+        adapters[name] = str(tmp_path / f"adapter_{name}")
+    return adapters
+
+
+@pytest.mark.parametrize("weights,normalize", [
+    ([0.5, 0.5], True),
+    ([0.2, 0.7, 0.1], True),
+    ([[0.1, 0.9], [0.6, 0.4], 0.5], True),
+    ([0.2, 0.7, 0.1], False),
+    ([0.6, 0.6], False),
+])
+def test_composed_adapter_matches_full_weight_merge(tmp_path, models, weights, normalize):
+    names = ["left", "right", "women"][:len(weights)]
+    config = {
+        "merge_method": "linear",
+        "dtype": "float32",
+        "normalize": normalize,
+        "models": [{"model": f"phi3_{n}", "parameters": {"weight": w}} for n, w in zip(names, weights)],
+    }
+    if not normalize and sum(weights) > 1.0 + 1e-6:
+        # The dense merge scales the base weights too, no adapter equals it
+        with pytest.raises(ValueError, match="sum to 1"):
+            compose([models[n] for n in names], weights, normalize)
+        return
+    write_merged(config, str(tmp_path / "dense"), model_root=str(tmp_path))
+
+    composed = compose([models[n] for n in names], weights, normalize)
+    _, template = load_lora(models[names[0]])
+    write_adapter(composed, template, str(tmp_path / "combined"))
+
+    # Rank of the combination is the sum of the adapter ranks
+    factors, config = load_lora(str(tmp_path / "combined"))
+    module = "base_model.model.model.layers.0.self_attn.o_proj"
+    assert factors[module][0].shape[0] == 2 * len(names)
+    assert config["r"] >= 2 * len(names)
+
+    diff = check_against(str(tmp_path / "combined"), str(tmp_path / "base"), str(tmp_path / "dense"))
+    assert diff < 1e-5
+
+
+def test_tokenizer_is_copied_from_base(tmp_path, models):
+    output = tmp_path / "combined"
+    os.makedirs(output)
+    copy_tokenizer(str(tmp_path / "base"), str(output))
+    assert (output / "tokenizer_config.json").exists()
+    assert not (output / "config.json").exists()
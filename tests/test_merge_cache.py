@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from merge_cache import MergeCache
+
+utils_dir = os.path.dirname(sys.modules["merge_cache"].__file__)
+
+
+def build_entry(cache, key, size):
+    os.makedirs(cache.entry_path(key))
+    with open(os.path.join(cache.entry_path(key), "model.safetensors"), "wb") as f:
+        f.write(b"\0" * size)
+    cache.commit(key, {"key": key})
+
+
+def test_lru_eviction_skips_pinned_entries(tmp_path):
+    cache = MergeCache(str(tmp_path), budget_gb=2500 / 1024 ** 3)
+    build_entry(cache, "a", 1000)
+    build_entry(cache, "b", 1000)
+    assert cache.lookup("a", pin=True)
+    build_entry(cache, "c", 1000)
+
+    # b is the least recently used unpinned entry
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") and cache.lookup("c")
+
+    cache.unpin("a")
+    build_entry(cache, "d", 1000)
+    assert cache.lookup("a") is None
+
+
+def test_pins_are_shared_between_processes(tmp_path):
+    cache = MergeCache(str(tmp_path), budget_gb=1500 / 1024 ** 3)
+    build_entry(cache, "shared", 1000)
+
+    # Another driver pins the entry and keeps running until told to stop
+    other = subprocess.Popen(
+        [sys.executable, "-c", textwrap.dedent(f"""
+            import sys
+            sys.path.insert(0, {utils_dir!r})
+            from merge_cache import MergeCache
+            cache = MergeCache({str(tmp_path)!r}, {1500 / 1024 ** 3!r})
+            assert cache.lookup("shared", pin=True)
+            print("pinned", flush=True)
+            sys.stdin.readline()
+        """)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert other.stdout.readline().strip() == "pinned"
+        build_entry(cache, "new", 1000)
+        assert cache.lookup("shared") is not None
+    finally:
+        other.communicate("\n")
+
+    # The pin of the finished process is stale and no longer protects the entry
+    build_entry(cache, "newer", 1000)
+    assert cache.lookup("shared") is None
+
+
+def test_key_depends_on_merge_engine(tmp_path):
+    from sweep import Step, lora_merge_command, mergekit_command, native_merge_command
+
+    cache = MergeCache(str(tmp_path), budget_gb=1)
+    config = {"merge_method": "linear", "models": [{"model": "phi3_a", "parameters": {"weight": 0.5}}]}
+    keys = {}
+    for name, command in [("mergekit", mergekit_command), ("native", native_merge_command), ("lora", lora_merge_command)]:
+        keys[name] = {
+            cache.step_key(Step("merge", command(f"configs/{tag}.yml", f"merged/{tag}")), config)
+            for tag in ("x", "y")
+        }
+    # Same engine: one key whatever the paths; different engines: different keys
+    assert all(len(k) == 1 for k in keys.values())
+    assert len(set.union(*keys.values())) == 3
+    assert cache.step_key(Step("merge", mergekit_command("c.yml", "out", cuda=False)), config) in keys["mergekit"]
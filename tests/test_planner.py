@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from manifest import RunManifest, evaluated
+from planner import Plan, canonical_merge, link_results, merge_key
+from search import tag_records
+
+
+def config(method, weights, models=("phi3_liberal", "phi3_men"), **extra):
+    return {
+        "merge_method": method,
+        "models": [{"model": m, "parameters": {"weight": w}} for m, w in zip(models, weights)],
+        **extra,
+    }
+
+
+@pytest.mark.parametrize("a,b", [
+    # Same weights after normalisation
+    (config("linear", [0.3, 0.3]), config("linear", [0.7, 0.7], normalize=True)),
+    (config("linear", [0.2, 0.6]), config("linear", [0.1, 0.3])),
+    # Model order of an order-independent method
+    (config("linear", [0.2, 0.8]), config("linear", [0.8, 0.2], models=("phi3_men", "phi3_liberal"))),
+    (config("ties", [0.3, 0.5], base_model="phi3", lambda_=1),
+     config("ties", [0.5, 0.3], models=("phi3_men", "phi3_liberal"), base_model="phi3", lambda_=1)),
+    # Parameters the method does not read
+    (config("linear", [0.5, 0.5], base_model="phi3", **{"lambda": 1}), config("linear", [0.5, 0.5])),
+    (config("ties", [[0.5, 0.5], 0.5], base_model="phi3"), config("ties", [0.5, 0.5], base_model="phi3")),
+])
+def test_equivalent_configs_share_a_key(a, b):
+    assert merge_key(a) == merge_key(b)
+
+
+@pytest.mark.parametrize("a,b", [
+    (config("linear", [0.3, 0.3], normalize=False), config("linear", [0.5, 0.5], normalize=False)),
+    (config("linear", [0.5, 0.5], normalize=False), config("linear", [0.5, 0.5])),
+    (config("ties", [0.5, 0.5], base_model="phi3"), config("ties", [0.5, 0.5], base_model="phi3_base")),
+    (config("ties", [0.3, 0.3], base_model="phi3"), config("ties", [0.5, 0.5], base_model="phi3")),
+    (config("linear", [0.2, 0.8]), config("linear", [0.8, 0.2])),
+    # Random drops per model: the order matters
+    (config("dare_ties", [0.3, 0.5], base_model="phi3"),
+     config("dare_ties", [0.5, 0.3], models=("phi3_men", "phi3_liberal"), base_model="phi3")),
+])
+def test_real_differences_keep_their_keys(a, b):
+    assert merge_key(a) != merge_key(b)
+
+
+def test_canonical_form_leaves_the_config_unchanged():
+    original = config("linear", [0.3, 0.3], models=("phi3_men", "phi3_liberal"), base_model="phi3")
+    canonical = canonical_merge(original)
+    assert original["models"][0]["parameters"]["weight"] == 0.3
+    assert canonical["models"][0]["model"] == "phi3_liberal"
+    assert "base_model" not in canonical
+
+
+def write_result(results_dir, *parts):
+    path = os.path.join(results_dir, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write('{"regard": "negative", "axis": "gender"}\n')
+
+
+def test_fan_out_gives_every_tag_its_results(tmp_path):
+    candidates = [
+        {"tag": f"linear_phi3_liberal_phi3_men_weight[0{w}, 0{w}]", "config": config("linear", [w / 10, w / 10])}
+        for w in (3, 5, 7)
+    ] + [{"tag": "ties_phi3_liberal_phi3_men_weight[05, 05]", "config": config("ties", [0.5, 0.5], base_model="phi3")}]
+    plan = Plan(candidates)
+    assert len(plan) == 4 and len(plan.primaries) == 2 and plan.duplicates() == 2
+    primary = plan.primaries[0]["tag"]
+    assert primary == candidates[0]["tag"]
+
+    results = str(tmp_path / "results")
+    manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+    for candidate in plan.primaries:
+        write_result(results, candidate["tag"], "holisticbias", "regard.jsonl")
+        write_result(results, "summary", candidate["tag"] + ".json")
+        manifest.record(candidate["tag"], evaluated)
+
+    assert plan.fan_out(manifest, results) == 2
+    # One result entry per original tag, the aliases point at the primary's files
+    records = tag_records(results, {c["tag"] for c in candidates})
+    assert set(records) == {c["tag"] for c in candidates}
+    assert all(len(rows) == 2 for rows in records.values())
+    for alias in candidates[1:3]:
+        assert manifest.is_done(alias["tag"])
+        path = os.path.join(results, alias["tag"], "holisticbias", "regard.jsonl")
+        assert os.path.realpath(path) == os.path.realpath(os.path.join(results, primary, "holisticbias", "regard.jsonl"))
+
+    # Nothing left to fan out, and links are not created twice
+    assert plan.fan_out(RunManifest(str(tmp_path / "manifest.jsonl")), results) == 0
+    assert link_results(results, primary, candidates[1]["tag"]) == 0
@@ -0,0 +1,64 @@
+import importlib
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from linear_merge import compare, write_sharded  # noqa: E402
+from lora_merge import module_prefix  # noqa: E402
+from synthetic import lora_factors, merge_and_unload, phi3_tensors, save_checkpoint  # noqa: E402
+
+
+@pytest.fixture
+def save_models(tmp_path, monkeypatch):
+    # The script reads the access token relative to its working directory
+    (tmp_path / "hugging_access_token.txt").write_text("token\n")
+    (tmp_path / "utils").mkdir()
+    monkeypatch.chdir(tmp_path / "utils")
+    monkeypatch.delitem(sys.modules, "save_models", raising=False)
+    return importlib.import_module("save_models")
+
+
+def adapter(base, seed):
+    # Module names as load_lora returns them
+    return {module_prefix + m: f for m, f in lora_factors(base, seed).items()}
+
+
+def test_streamed_delta_matches_merge_and_unload(tmp_path, save_models):
+    base = phi3_tensors(0)
+    before = {name: tensor.clone() for name, tensor in base.items()}
+
+    for seed, name in [(1, "left"), (2, "right")]:
+        write_sharded(save_models.iter_with_delta(base, adapter(base, seed), "cpu"), str(tmp_path / f"streamed_{name}"), 2048)
+        save_checkpoint(tmp_path / f"phi3_{name}", merge_and_unload(base, lora_factors(base, seed)))
+        assert compare(str(tmp_path / f"streamed_{name}"), str(tmp_path / f"phi3_{name}")) == []
+
+    # The resident base weights are reused untouched for the next adapter
+    for name, tensor in base.items():
+        assert torch.equal(tensor, before[name])
+
+
+def test_tied_weights_are_written_once(save_models):
+    base = phi3_tensors(0)
+    base["lm_head.weight"] = base["model.embed_tokens.weight"]
+    names = [name for name, _ in save_models.iter_with_delta(base, adapter(base, 1), "cpu")]
+    assert "model.embed_tokens.weight" in names
+    assert "lm_head.weight" not in names
+    assert len(names) == len(base) - 1
+
+
+def test_unknown_target_is_rejected(save_models):
+    base = phi3_tensors(0, layers=2)
+    with pytest.raises(ValueError, match="unknown weights"):
+        list(save_models.iter_with_delta(base, adapter(phi3_tensors(0, layers=3), 1), "cpu"))
+
+
+def test_single_worker_exports_every_adapter(save_models, monkeypatch):
+    calls = []
+    monkeypatch.setattr(save_models, "export_adapters", lambda *args: calls.append(args))
+    save_models.save_models_batch(["cpu", "cuda:1"], 1, torch.float32, 1024)
+    assert calls == [(save_models.adapters, "cpu", torch.float32, 1024)]
@@ -0,0 +1,155 @@
+import csv
+import json
+import random
+
+import pytest
+
+from search import SuccessiveHalving, TPESearch, point_key, replay, rung_fractions, slice_dataset, stratified_order
+
+axes = ["gender"] * 6 + ["race"] * 3 + ["age"]
+
+
+def test_rung_fractions():
+    assert rung_fractions(1 / 9, 3) == pytest.approx([1 / 9, 1 / 3, 1])
+    assert rung_fractions(0.25, 2) == pytest.approx([0.25, 0.5, 1])
+    assert rung_fractions(1, 3) == [1.0]
+
+
+def test_stratified_order_keeps_proportions():
+    strata = [axes[i % len(axes)] for i in range(600)]
+    order = stratified_order(strata)
+    assert sorted(order) == list(range(600))
+    for n in (10, 67, 200, 599):
+        prefix = [strata[i] for i in order[:n]]
+        for axis in set(axes):
+            assert abs(prefix.count(axis) - n * axes.count(axis) / len(axes)) <= 1
+    assert stratified_order(strata, seed=1) != order
+
+
+def read_ids(path):
+    with open(path, newline="") as f:
+        return [(row["id"], row["axis"]) for row in csv.DictReader(f)]
+
+
+def test_slices_are_nested(tmp_path):
+    dataset = tmp_path / "data"
+    dataset.mkdir()
+    with open(dataset / "prompts.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["id", "axis"])
+        writer.writeheader()
+        writer.writerows({"id": i, "axis": axes[i % len(axes)]} for i in range(900))
+    with open(dataset / "prompts.jsonl", "w") as f:
+        for i in range(90):
+            f.write(json.dumps({"id": i, "axis": axes[i % len(axes)]}) + "\n")
+    (dataset / "README").write_text("not sliced")
+
+    slices = []
+    for fraction in rung_fractions(1 / 9, 3):
+        output = slice_dataset(str(dataset), str(tmp_path / f"slice_{fraction:.3f}"), fraction)
+        rows = read_ids(f"{output}/prompts.csv")
+        # Original order is kept and the strata stay in proportion
+        assert rows == sorted(rows, key=lambda row: int(row[0]))
+        assert sum(axis == "gender" for _, axis in rows) == pytest.approx(0.6 * len(rows), abs=1)
+        assert (tmp_path / f"slice_{fraction:.3f}" / "README").read_text() == "not sliced"
+        slices.append(set(rows))
+    assert [len(s) for s in slices] == [100, 300, 900]
+    assert slices[0] < slices[1] < slices[2]
+    assert slices[2] == set(read_ids(dataset / "prompts.csv"))
+
+    # A chunk is the difference of two nested slices
+    chunk = slice_dataset(str(dataset), str(tmp_path / "chunk"), 1 / 3, start_fraction=1 / 9)
+    assert set(read_ids(f"{chunk}/prompts.csv")) == slices[1] - slices[0]
+    with open(tmp_path / "slice_0.333" / "prompts.jsonl") as f:
+        assert len(f.readlines()) == 30
+
+
+def recorded_results(n_tags=27, rows=900, seed=0):
+    """
+    A recorded full grid: per tag, regard of every prompt; tag i has a
+    negative rate of about 0.05 + 0.02 * i.
+    """
+    rng = random.Random(seed)
+    tags = [f"ties_phi3_liberal_phi3_men_weight[0{i % 9}, 05]_lambda{i}" for i in range(n_tags)]
+    rng.shuffle(tags)
+    records = {}
+    for i, tag in enumerate(tags):
+        rate = 0.05 + 0.02 * i
+        records[tag] = [
+            {"axis": axes[j % len(axes)], "regard": "negative" if rng.random() < rate else "positive"}
+            for j in range(rows)
+        ]
+    return records
+
+
+@pytest.mark.parametrize("goal", ["min", "max"])
+def test_replay_finds_the_grid_winner(goal):
+    records = recorded_results()
+    halving, grid_best = replay(records, "regard=negative", goal)
+
+    assert halving.best() == grid_best
+    assert [rung["evaluated"] for rung in halving.history] == [27, 9, 3]
+    assert halving.cost() == pytest.approx((27 / 9 + 9 / 3 + 3) / 27)
+
+
+def test_promote_keeps_the_best_and_drops_failures():
+    halving = SuccessiveHalving(["a", "b", "c", "d", "e", "f"], min_fraction=1 / 4, eta=2, goal="min")
+    assert halving.fractions == pytest.approx([0.25, 0.5, 1])
+    assert halving.promote({"a": 0.5, "b": 0.1, "c": None, "d": 0.3, "e": 0.2, "f": 0.9}) == ["b", "e", "d"]
+    assert halving.promote({"b": 0.4, "e": 0.2, "d": 0.2}) == ["e", "d"]
+    assert halving.promote({"e": 0.3, "d": 0.1}) == ["d", "e"]
+    assert halving.done() and halving.best() == "d"
+    with pytest.raises(ValueError):
+        SuccessiveHalving(["a"], goal="median")
+
+
+space = {
+    "method": ["linear", "ties"],
+    "models": [["phi3_liberal", "phi3_men"], ["phi3_conservative", "phi3_women"]],
+    "weight": [[0.3, 0.3], [0.5, 0.5], [0.7, 0.7]],
+    "density": [0.5, 0.9],
+}
+conditions = {"linear": ["weight"], "ties": ["weight", "density"]}
+# 2 x 3 linear points + 2 x 3 x 2 ties points
+space_size = 18
+
+
+def objective(point):
+    return point["weight"][0] + point.get("density", 0) + (point["models"][0] == "phi3_liberal")
+
+
+def test_tpe_batches_have_no_duplicates():
+    tpe = TPESearch(space, "method", conditions, n_startup=4)
+    proposed = []
+    for _ in range(5):
+        batch = [tpe.propose() for _ in range(3)]
+        proposed += batch
+        for point in batch:
+            tpe.observe(point, objective(point))
+    # Keep going until the space is used up
+    while (point := tpe.propose()) is not None:
+        proposed.append(point)
+        tpe.observe(point, objective(point))
+
+    keys = [point_key(p) for p in proposed]
+    assert len(keys) == len(set(keys)) == space_size
+    assert tpe.best()["score"] == min(objective(p) for p in proposed)
+    assert tpe.pending == []
+
+
+def test_tpe_resumes_from_saved_state(tmp_path):
+    state_path = str(tmp_path / "tpe_state.json")
+    tpe = TPESearch(space, "method", conditions, n_startup=4, state_path=state_path)
+    for _ in range(6):
+        point = tpe.propose()
+        tpe.observe(point, objective(point))
+    pending = tpe.propose()
+
+    resumed = TPESearch(space, "method", conditions, n_startup=4, state_path=state_path)
+    assert resumed.observations == tpe.observations
+    assert resumed.pending == [pending]
+    # Same history, same next proposals, none of them repeated
+    for _ in range(3):
+        point = tpe.propose()
+        assert resumed.propose() == point
+        assert point_key(point) not in {point_key(o["point"]) for o in tpe.observations}
+        assert point != pending
@@ -0,0 +1,103 @@
+import csv
+import json
+import sys
+import textwrap
+
+import pytest
+
+from sequential import GroupEstimates, SequentialEval, chunk_fractions, look_z, mean_interval, wilson_interval
+from sweep import Step, run_step
+
+# Stand-in for robbie.eval: one result line per prompt of the dataset
+stand_in_eval = textwrap.dedent("""
+    import argparse, csv, json, os, random
+    parser = argparse.ArgumentParser()
+    for name in ["--model-id", "--dataset-dir", "--result-dir", "--device"]:
+        parser.add_argument(name)
+    args = parser.parse_args()
+    tag = os.path.basename(args.model_id)
+    with open(os.path.join(args.dataset_dir, "prompts.csv")) as f:
+        rows = list(csv.DictReader(f))
+    os.makedirs(os.path.join(args.result_dir, tag), exist_ok=True)
+    with open(os.path.join(args.result_dir, tag, "gen.jsonl"), "w") as f:
+        for row in rows:
+            rng = random.Random(row["id"])
+            negative = rng.random() < (0.3 if row["axis"] == "gender" else 0.1)
+            f.write(json.dumps({"axis": row["axis"], "regard": "negative" if negative else "positive",
+                                "length": 20 + 10 * rng.random()}) + "\\n")
+""")
+
+
+def test_intervals():
+    estimate, low, high = wilson_interval(30, 100)
+    assert estimate == 0.3 and 0.2 < low < 0.3 < high < 0.4
+    assert wilson_interval(0, 0) == (None, 0.0, 1.0)
+
+    # Numeric metrics are not clipped to [0, 1]
+    estimate, low, high = mean_interval(250.0, 250.0 * 25 + 99 * 4, 100)
+    assert estimate == 2.5 and low < 2.5 < high and high > 1
+    assert mean_interval(3.0, 9.0, 1)[1:] == (float("-inf"), float("inf"))
+
+
+def test_repeated_looks_widen_z():
+    assert look_z(0.95, 1) == pytest.approx(1.96, abs=1e-3)
+    looks = len(chunk_fractions(0.05, 2))
+    assert look_z(0.95, looks) > look_z(0.95, 2) > look_z(0.95, 1)
+    assert SequentialEval("regard=negative").z == pytest.approx(look_z(0.95, looks))
+
+
+def test_group_estimates_pick_the_interval():
+    records = [{"axis": "a", "length": 20.0 + i % 5, "regard": "negative" if i % 4 else "positive"} for i in range(200)]
+    rate = GroupEstimates("regard=negative", "axis")
+    rate.update(records)
+    mean = GroupEstimates("length", "axis")
+    mean.update(records)
+    assert rate.interval()[0] == pytest.approx(0.75)
+    assert mean.interval("a")[0] == pytest.approx(22.0)
+    assert mean.interval()[1] > 21 and mean.interval()[2] < 23
+    assert mean.report()["groups"]["a"]["n"] == 200
+
+
+@pytest.fixture
+def eval_repo(tmp_path):
+    repo = tmp_path / "eval_repo"
+    (repo / "robbie").mkdir(parents=True)
+    (repo / "robbie" / "__init__.py").write_text("")
+    (repo / "robbie" / "eval.py").write_text(stand_in_eval)
+    (repo / "data").mkdir()
+    with open(repo / "data" / "prompts.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["id", "axis"])
+        writer.writeheader()
+        writer.writerows({"id": i, "axis": "gender" if i % 3 else "race"} for i in range(6000))
+    return repo
+
+
+def run_sequential(eval_repo, sequential):
+    step = Step("eval", [
+        sys.executable, "-m", "robbie.eval", "--model-id", "models/phi3_test", "--dataset-dir", "data",
+        "--device", "cuda", "--result-dir", "results",
+    ], cwd=str(eval_repo))
+    run_step(sequential.wrap(step), "cpu")
+    with open(eval_repo / "results_seq" / "phi3_test.json") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("metric", ["regard=negative", "length"])
+def test_stops_once_precise(eval_repo, metric):
+    precision = 0.03 if "=" in metric else 0.3
+    summary = run_sequential(eval_repo, SequentialEval(metric, "axis", precision, min_group_size=100))
+
+    assert summary["stopped"] == "precision"
+    assert summary["prompts_total"] == 6000
+    assert 0 < summary["prompts_used"] < 6000
+    assert summary["interval"] == ("wilson" if "=" in metric else "mean")
+    for entry in [summary["overall"], *summary["groups"].values()]:
+        assert (entry["high"] - entry["low"]) / 2 <= precision
+    if metric == "length":
+        assert 24 < summary["overall"]["estimate"] < 26
+
+
+def test_min_group_size_exempts_small_groups(eval_repo):
+    strict = run_sequential(eval_repo, SequentialEval("regard=negative", "axis", 0.02, min_group_size=100))
+    lenient = run_sequential(eval_repo, SequentialEval("regard=negative", "axis", 0.02, min_group_size=10 ** 6))
+    assert lenient["prompts_used"] <= strict["prompts_used"]
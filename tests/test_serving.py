@@ -0,0 +1,216 @@
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from serving import BatchServer, PrefixCache, Request, ServingStats, percentile  # noqa: E402
+from synthetic import load_tiny_lm, save_tiny_adapter, save_tiny_lm  # noqa: E402
+
+greedy = {"do_sample": False}
+
+instructions = [
+    "Is remote work here to stay?",
+    "Tea or coffee?",
+    "What should I read next, and why do people still buy paper books?",
+    "Why?",
+]
+
+
+@pytest.fixture(scope="module")
+def tiny(tmp_path_factory):
+    """
+    Paths of a tiny base model and two LoRA adapters.
+    """
+    root = tmp_path_factory.mktemp("tiny")
+    save_tiny_lm(root / "base")
+    for seed, name in enumerate(["women", "men"], start=1):
+        save_tiny_adapter(root / name, root / "base", seed)
+    return root
+
+
+def load_with_adapters(tiny):
+    from peft import PeftModel
+
+    base, tokenizer = load_tiny_lm(tiny / "base")
+    model = PeftModel.from_pretrained(base, str(tiny / "women"), adapter_name="women").eval()
+    model.load_adapter(str(tiny / "men"), "men")
+    return model, tokenizer
+
+
+def reference(model, tokenizer, request):
+    """
+    Greedy output of one request on its own, without batching or caching.
+    """
+    ids = torch.tensor([request.input_ids])
+
+    def generate():
+        return model.generate(input_ids=ids, attention_mask=torch.ones_like(ids), max_new_tokens=request.max_new_tokens,
+                              pad_token_id=tokenizer.pad_token_id, do_sample=False)
+
+    if request.adapter is None:
+        with model.disable_adapter():
+            output = generate()
+    else:
+        model.set_adapter(request.adapter)
+        output = generate()
+    new_ids = output[0, ids.shape[1]:].tolist()
+    if tokenizer.eos_token_id in new_ids:
+        new_ids = new_ids[:new_ids.index(tokenizer.eos_token_id)]
+    return tokenizer.decode(new_ids, skip_special_tokens=True)
+
+
+def serve(server, requests):
+    """
+    Submit all requests at once, wait for them and stop the server.
+    """
+    for request in requests:
+        server.submit(request)
+    for request in requests:
+        request.done.wait()
+    server.close()
+    assert not [r.error for r in requests if r.error]
+    return requests
+
+
+def mixed_requests():
+    adapters = ["women", "men", None, "women"]
+    return [Request(text, adapter=adapter, max_new_tokens=6 + i) for i, (text, adapter) in enumerate(zip(instructions, adapters))]
+
+
+class StubTokenizer:
+    pad_token_id = 0
+
+
+def queued(server, costs):
+    for i, cost in enumerate(costs):
+        server.queue.put(Request(f"prompt {i}", id=i, input_ids=[1] * (cost - 10), max_new_tokens=10))
+
+
+def test_next_batch_respects_size_and_token_budget():
+    server = BatchServer(object(), StubTokenizer(), max_batch_size=3, max_batch_tokens=100, max_wait=0)
+    server.close()
+
+    queued(server, [30] * 5)
+    assert [r.id for r in server._next_batch()] == [0, 1, 2]
+    assert [r.id for r in server._next_batch()] == [3, 4]
+
+    # The request over the budget starts the next batch
+    queued(server, [40, 50, 20, 20])
+    assert [r.id for r in server._next_batch()] == [0, 1]
+    assert [r.id for r in server._next_batch()] == [2, 3]
+
+    server.queue.put(None)
+    assert server._next_batch() is None
+
+
+def test_percentile_is_nearest_rank():
+    values = [i / 10 for i in range(10, 0, -1)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 90) == 0.9
+    assert percentile(values, 99) == 1.0
+    assert percentile(values, 0) == 0.1
+    assert percentile([], 50) is None
+
+
+def test_stats_report_latency_and_throughput():
+    stats = ServingStats()
+    requests = [Request("x", latency=i / 10, new_tokens=5) for i in range(1, 11)]
+    stats.record_batch(requests[:4])
+    stats.record_batch(requests[4:])
+    stats.start = time.time() - 10
+
+    report = stats.report()
+    assert report["requests"] == 10
+    assert report["mean_batch_size"] == 5
+    assert report["tokens_per_s"] == pytest.approx(5.0, rel=0.01)
+    assert report["requests_per_s"] == pytest.approx(1.0, rel=0.01)
+    assert (report["latency_p50"], report["latency_p90"], report["latency_p99"]) == (0.5, 0.9, 1.0)
+
+
+def test_batched_greedy_matches_single_requests(tiny):
+    model, tokenizer = load_with_adapters(tiny)
+    server = BatchServer(model, tokenizer, max_batch_size=8, max_wait=1.0, generation_kwargs=greedy)
+    requests = serve(server, mixed_requests())
+
+    # One batch, with prompts of different lengths (left padding)
+    assert server.stats.batches == 1
+    assert len({len(r.input_ids) for r in requests}) > 1
+    for request in requests:
+        assert request.output == reference(model, tokenizer, request)
+        assert request.new_tokens <= request.max_new_tokens
+
+
+def test_prefix_cache_greedy_matches_no_cache(tiny):
+    model, tokenizer = load_with_adapters(tiny)
+    cache = PrefixCache()
+    server = BatchServer(model, tokenizer, max_wait=1.0, generation_kwargs=greedy, prefix_cache=cache)
+    requests = mixed_requests() + [Request(text, adapter="men", max_new_tokens=8) for text in instructions]
+    serve(server, requests)
+
+    assert server.stats.batches == 1
+    assert cache.misses == 3 and cache.hits == len(requests) - 3
+    assert server.stats.prefix_tokens_saved > 0
+    for request in requests:
+        assert request.output == reference(model, tokenizer, request)
+
+
+def test_prefix_cache_is_keyed_per_adapter_and_subreddit(tiny):
+    model, tokenizer = load_with_adapters(tiny)
+    cache = PrefixCache()
+    server = BatchServer(model, tokenizer, max_wait=1.0, generation_kwargs=greedy, prefix_cache=cache)
+    requests = [
+        Request(instructions[0], adapter="women", max_new_tokens=4),
+        Request(instructions[0], adapter="women", subreddit="AskMen", max_new_tokens=4),
+        Request(instructions[0], adapter="men", max_new_tokens=4),
+    ]
+    serve(server, requests)
+
+    assert set(cache.entries) == {("women", "AskWomen"), ("women", "AskMen"), ("men", "AskMen")}
+    # Same header, different adapter: different values (v_proj has LoRA layers)
+    (women_ids, women_past), (men_ids, men_past) = cache.entries[("women", "AskMen")], cache.entries[("men", "AskMen")]
+    assert women_ids == men_ids
+    assert not torch.equal(women_past[0][1], men_past[0][1])
+    for request in requests:
+        assert request.output == reference(model, tokenizer, request)
+
+    cache.evict_adapter("women")
+    assert set(cache.entries) == {("men", "AskMen")}
+
+
+def mixed_server(model, tokenizer, prefix_cache=None):
+    from peft import PeftModel
+
+    if not hasattr(PeftModel, "_enable_peft_forward_hooks"):
+        pytest.skip("PEFT without adapter_names support")
+    return BatchServer(model, tokenizer, max_wait=1.0, generation_kwargs=greedy, prefix_cache=prefix_cache,
+                       mixed_adapters=True)
+
+
+def test_mixed_adapter_batch_matches_single_adapters(tiny):
+    model, tokenizer = load_with_adapters(tiny)
+    server = mixed_server(model, tokenizer)
+    requests = serve(server, mixed_requests())
+
+    assert server.stats.batches == 1
+    for request in requests:
+        assert request.output == reference(model, tokenizer, request)
+
+
+def test_mixed_adapter_batch_with_prefix_hits(tiny):
+    model, tokenizer = load_with_adapters(tiny)
+    cache = PrefixCache()
+    # Warm the cache for women and men, the base model row is a miss
+    serve(mixed_server(model, tokenizer, cache), [Request(instructions[1], adapter="women", max_new_tokens=2),
+                                                  Request(instructions[1], adapter="men", max_new_tokens=2)])
+    misses = cache.misses
+
+    server = mixed_server(model, tokenizer, cache)
+    requests = serve(server, mixed_requests())
+    assert server.stats.batches == 1
+    assert cache.misses == misses + 1
+    assert cache.hits == 3
+    for request in requests:
+        assert request.output == reference(model, tokenizer, request)
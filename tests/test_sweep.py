@@ -0,0 +1,104 @@
+import json
+import sys
+
+import pytest
+
+from manifest import RunManifest
+from sweep import DeviceScheduler, Job, Step, device_command, lora_composable, mergekit_command, parse_devices
+
+# Stand-in for mergekit-yaml / robbie.eval: records its argv and the device it saw
+stand_in = (
+    "import json, os, sys\n"
+    "out = sys.argv[1]\n"
+    "with open(out, 'w') as f:\n"
+    "    json.dump({'argv': sys.argv[2:], 'visible': os.environ['CUDA_VISIBLE_DEVICES']}, f)\n"
+    "sys.exit(1 if 'fail' in out else 0)\n"
+)
+
+
+def stand_in_step(stage, out, *args):
+    return Step(stage, [sys.executable, "-c", stand_in, str(out), *args])
+
+
+def make_job(tmp_path, tag):
+    return Job(tag=tag, steps=[
+        stand_in_step("merge", tmp_path / f"{tag}.merge", "--allow-crimes", "--cuda"),
+        stand_in_step("eval", tmp_path / f"{tag}.eval", "--device", "cuda", "--seed", "42"),
+    ])
+
+
+def test_parse_devices():
+    assert parse_devices(["0,1", "cpu", "cpu"]) == ["0", "1", "cpu", "cpu"]
+    with pytest.raises(ValueError):
+        parse_devices(["gpu0"])
+
+
+def test_device_command():
+    cmd = mergekit_command("config.yml", "out")
+    assert device_command(cmd, "0") == cmd
+    assert "--cuda" not in device_command(cmd, "cpu")
+    eval_cmd = ["python", "-m", "robbie.eval", "--device", "cuda", "--result-dir", "cuda"]
+    assert device_command(eval_cmd, "cpu") == ["python", "-m", "robbie.eval", "--device", "cpu", "--result-dir", "cuda"]
+
+
+def test_lora_composable():
+    assert lora_composable({"merge_method": "linear"})
+    assert lora_composable({"merge_method": "linear", "normalize": True})
+    assert not lora_composable({"merge_method": "linear", "normalize": False})
+    assert not lora_composable({"merge_method": "linear", "parameters": {"normalize": False}})
+    assert not lora_composable({"merge_method": "ties", "normalize": True})
+
+
+@pytest.mark.parametrize("lookahead", [0, 2])
+def test_scheduler_runs_all_jobs_on_cpu_slots(tmp_path, lookahead):
+    scheduler = DeviceScheduler(["cpu", "cpu", "cpu"], lookahead=lookahead)
+    tags = [f"job{i}" for i in range(7)]
+    for tag in tags:
+        scheduler.submit(make_job(tmp_path, tag))
+
+    assert scheduler.run() == []
+    for tag in tags:
+        merge = json.loads((tmp_path / f"{tag}.merge").read_text())
+        evaluation = json.loads((tmp_path / f"{tag}.eval").read_text())
+        assert merge == {"argv": ["--allow-crimes"], "visible": ""}
+        assert evaluation == {"argv": ["--device", "cpu", "--seed", "42"], "visible": ""}
+
+
+def test_scheduler_stops_job_at_first_failure(tmp_path):
+    scheduler = DeviceScheduler(["cpu", "cpu"])
+    scheduler.submit(make_job(tmp_path, "ok"))
+    scheduler.submit(Job(tag="broken", steps=[
+        stand_in_step("merge", tmp_path / "fail.merge"),
+        stand_in_step("eval", tmp_path / "broken.eval"),
+    ]))
+
+    assert scheduler.run() == [("broken", "merge")]
+    assert (tmp_path / "ok.eval").exists()
+    assert not (tmp_path / "broken.eval").exists()
+
+
+def test_idle_slot_takes_work_from_busiest_queue(tmp_path):
+    scheduler = DeviceScheduler(["cpu", "cpu"])
+    for i in range(4):
+        scheduler.submit(make_job(tmp_path, f"job{i}"))
+    # Everything queued on slot 0: slot 1 takes from the back of it
+    scheduler.queues[0].extend(scheduler.queues[1])
+    scheduler.queues[1].clear()
+    order = [job.tag for job in scheduler.queues[0]]
+
+    assert scheduler._next_job(1).tag == order[-1]
+    assert scheduler._next_job(0).tag == order[0]
+    assert scheduler.run() == []
+    assert len(scheduler) == 0
+
+
+def test_manifest_skips_finished_tags(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.jsonl"))
+    scheduler = DeviceScheduler(["cpu"], manifest=manifest)
+    scheduler.submit(make_job(tmp_path, "first"))
+    assert scheduler.run() == []
+    assert manifest.is_done("first")
+
+    rerun = DeviceScheduler(["cpu"], manifest=RunManifest(str(tmp_path / "manifest.jsonl")))
+    rerun.submit(make_job(tmp_path, "first"))
+    assert len(rerun) == 0 and rerun.skipped == 1
@@ -0,0 +1,79 @@
+import pytest
+
+from vocabulary import VocabularyError, load_vocabulary, save_vocabulary
+
+terms = ["anarchy", "liberal", "tory"]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "vocabulary.txt")
+    header = save_vocabulary(path, terms, source_version="3.0")
+    assert header["count"] == 3
+    assert load_vocabulary(path) == terms
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda text: text.replace("liberal", "liberals"),
+    lambda text: text.rsplit("tory", 1)[0],
+    lambda text: text + "extra\n",
+    lambda text: "{not json\n" + text.split("\n", 1)[1],
+    lambda text: "[]\n" + text.split("\n", 1)[1],
+    lambda text: "",
+])
+def test_corrupted_artifact_is_detected(tmp_path, corrupt):
+    path = tmp_path / "vocabulary.txt"
+    save_vocabulary(str(path), terms)
+    path.write_text(corrupt(path.read_text(encoding="utf-8")), encoding="utf-8")
+    with pytest.raises(VocabularyError, match="corrupted"):
+        load_vocabulary(str(path))
+
+
+def test_other_settings_and_missing_artifact(tmp_path):
+    path = tmp_path / "vocabulary.txt"
+    save_vocabulary(str(path), terms)
+    path.write_text(path.read_text(encoding="utf-8").replace('"min_length": 3', '"min_length": 4'), encoding="utf-8")
+    with pytest.raises(VocabularyError, match="other settings"):
+        load_vocabulary(str(path))
+    with pytest.raises(VocabularyError, match="not found"):
+        load_vocabulary(str(tmp_path / "missing.txt"))
+
+
+class WordNetStub:
+    @staticmethod
+    def get_version():
+        return "3.0"
+
+
+@pytest.fixture
+def create_word_lists(monkeypatch):
+    pytest.importorskip("numpy")
+    pytest.importorskip("sklearn")
+    nltk = pytest.importorskip("nltk")
+    import create_word_lists
+
+    downloads = []
+    monkeypatch.setattr(nltk, "download", downloads.append)
+    monkeypatch.setattr(create_word_lists, "wn", WordNetStub())
+    monkeypatch.setattr(create_word_lists, "get_wordnet_lemmas", lambda: list(terms))
+    return create_word_lists, downloads
+
+
+def test_corrupted_artifact_is_rebuilt(tmp_path, create_word_lists):
+    create_word_lists, downloads = create_word_lists
+    path = tmp_path / "vocabulary.txt"
+    save_vocabulary(str(path), ["other"])
+    path.write_text(path.read_text(encoding="utf-8").replace("other", "changed"), encoding="utf-8")
+
+    assert create_word_lists.load_candidate_terms(str(path)) == terms
+    assert downloads == ["wordnet", "omw-1.4"]
+    assert load_vocabulary(str(path)) == terms
+
+
+def test_offline_without_artifact_fails_cleanly(tmp_path, create_word_lists):
+    create_word_lists, downloads = create_word_lists
+    with pytest.raises(SystemExit, match="not found. Build it once without --offline"):
+        create_word_lists.load_candidate_terms(str(tmp_path / "missing.txt"), offline=True)
+    with pytest.raises(SystemExit, match="cannot be used with --offline"):
+        create_word_lists.load_candidate_terms(str(tmp_path / "missing.txt"), offline=True, rebuild=True)
+    assert downloads == []
+    assert not (tmp_path / "missing.txt").exists()
@@ -0,0 +1,117 @@
+import json
+import os
+
+import pytest
+
+from warehouse import Warehouse, find_tag, parse_tag, partition_values
+
+
+def pair_tag(method, political, gender, params):
+    """
+    Tag of grid_search_combined.py / evaluate_combined_2.py.
+    """
+    return f"{method}_{political}_{gender}_" + "_".join(f"{k}{str(v).replace('.', '')}" for k, v in params.items())
+
+
+def weight_tag(method, models, weights):
+    """
+    Tag of evaluate_combined_3.py / evaluate_combined_4.py.
+    """
+    w_tag = "w" + "-".join(str(w).replace(".", "") for w in weights)
+    return f"{method}_" + "_".join(models) + f"_{w_tag}"
+
+
+@pytest.mark.parametrize("tag,method,models,params,weight", [
+    (pair_tag("linear", "phi3_liberal", "phi3_women", {"weight": [0.5, 0.5], "normalize": True}),
+     "linear", ["phi3_liberal", "phi3_women"], {"weight": "[05, 05]", "normalize": "True"}, "05-05"),
+    (pair_tag("della_linear", "phi3_conservative", "phi3_men",
+              {"weight": [0.3, 0.3], "lambda": 1.5, "density": 0.7, "epsilon": 0.05}),
+     "della_linear", ["phi3_conservative", "phi3_men"],
+     {"weight": "[03, 03]", "lambda": "15", "density": "07", "epsilon": "005"}, "03-03"),
+    (pair_tag("sce", "phi3_liberal", "phi3_men", {"select_top_k": 0.7}),
+     "sce", ["phi3_liberal", "phi3_men"], {"select_top_k": "07"}, "none"),
+    (weight_tag("ties", ["phi3_women", "phi3_american", "phi3_old_people"], [0.4, 0.3, 0.3]),
+     "ties", ["phi3_women", "phi3_american", "phi3_old_people"], {"weight": "04-03-03"}, "04-03-03"),
+    (weight_tag("dare_ties", ["phi3_men", "phi3_liberal", "phi3_people_over_30", "phi3_latin_america"],
+                [0.25, 0.25, 0.25, 0.25]),
+     "dare_ties", ["phi3_men", "phi3_liberal", "phi3_people_over_30", "phi3_latin_america"],
+     {"weight": "025-025-025-025"}, "025-025-025-025"),
+    ("phi3_middle_east", "base", ["phi3_middle_east"], {}, "none"),
+])
+def test_driver_tags_round_trip(tag, method, models, params, weight):
+    parsed = parse_tag(tag)
+    assert parsed == {"method": method, "models": models, "params": params}
+
+    partition = partition_values("holisticbiasr", tag)
+    assert partition["method"] == method
+    assert partition["combination"] == "-".join(m[len("phi3_"):] for m in models)
+    assert partition["weight"] == weight
+
+    # Result layouts of robbie: <results>/<tag>/..., or the tag as file stem
+    assert find_tag(f"{tag}/holisticbias/regard.jsonl") == tag
+    assert find_tag(f"rung0/{tag}/gen.jsonl") == tag
+    assert find_tag(f"summary/{tag}.json") == tag
+    assert find_tag(f"other/{tag}/gen.jsonl", known_tags={tag}) == tag
+
+
+tags = [
+    pair_tag("linear", "phi3_liberal", "phi3_women", {"weight": [0.5, 0.5], "normalize": True}),
+    pair_tag("ties", "phi3_liberal", "phi3_men", {"weight": [0.3, 0.3], "lambda": 1, "density": 0.5}),
+    pair_tag("ties", "phi3_conservative", "phi3_men", {"weight": [0.3, 0.3], "lambda": 1, "density": 0.5}),
+]
+
+
+def write_results(results_dir, tag, scores):
+    os.makedirs(results_dir / tag, exist_ok=True)
+    with open(results_dir / tag / "gen.jsonl", "w") as f:
+        for score in scores:
+            f.write(json.dumps({"score": score, "meta": {"axis": "gender"}}) + "\n")
+
+
+def partition_files(root):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, name), root)
+        for dirpath, _, names in os.walk(root) for name in names if name.endswith(".parquet")
+    )
+
+
+def test_ingest_is_incremental(tmp_path):
+    pytest.importorskip("pyarrow")
+    results = tmp_path / "results"
+    write_results(results, tags[0], [0.1, 0.3])
+    write_results(results, tags[1], [0.5, 0.7, 0.9])
+    warehouse = Warehouse(str(tmp_path / "wh"))
+    assert warehouse.ingest([str(results)], "holisticbiasr") == 2
+    before = {p: os.stat(tmp_path / "wh" / p).st_mtime_ns for p in partition_files(tmp_path / "wh")}
+
+    # A second ingest finds nothing new and adds no rows
+    assert Warehouse(str(tmp_path / "wh")).ingest([str(results)], "holisticbiasr") == 0
+    assert Warehouse(str(tmp_path / "wh")).dataset().count_rows() == 5
+
+    # New results only add their own partition
+    write_results(results, tags[2], [0.2, 0.4])
+    warehouse = Warehouse(str(tmp_path / "wh"))
+    assert warehouse.ingest([str(results)], "holisticbiasr") == 1
+    after = partition_files(tmp_path / "wh")
+    assert set(after) - set(before) == {p for p in after if "combination=conservative-men" in p}
+    assert len(after) == 3
+    assert all(os.stat(tmp_path / "wh" / p).st_mtime_ns == mtime for p, mtime in before.items())
+    assert warehouse.dataset().count_rows() == 7
+
+
+def test_partition_filtered_query(tmp_path):
+    pytest.importorskip("pyarrow")
+    results = tmp_path / "results"
+    for tag, scores in zip(tags, [[0.1, 0.3], [0.5, 0.7, 0.9], [0.2, 0.4]]):
+        write_results(results, tag, scores)
+    warehouse = Warehouse(str(tmp_path / "wh"))
+    warehouse.ingest([str(results)], "holisticbiasr")
+
+    rows = warehouse.query(["combination"], ["score"], where={"method": "ties"}).to_pylist()
+    assert [(r["combination"], r["score_count"]) for r in rows] == [("conservative-men", 2), ("liberal-men", 3)]
+    assert rows[0]["score_mean"] == pytest.approx(0.3)
+    assert rows[1]["score_mean"] == pytest.approx(0.7)
+
+    rows = warehouse.query(["method", "weight"], ["score"], where={"dataset": "holisticbiasr", "weight": "05-05"})
+    assert rows.to_pylist()[0]["score_count"] == 2 and rows.num_rows == 1
+    assert warehouse.query(["method"], ["score"], where={"dataset": "advpromptset"}).num_rows == 0
@@ -0,0 +1,266 @@
+"""""
+This module enables long-lived evaluation workers instead of one
+`python -m robbie.eval` process per model.
+
+A worker is started once per device slot (in the ResponsibleNLP repo, with
+the device pinned through CUDA_VISIBLE_DEVICES). It imports torch,
+transformers and robbie a single time and then runs robbie.eval in-process
+for every job it receives, with the job's output redirected to its log.
+Inside a worker:
+- classifiers (Regard, ToxiGen) are loaded once and reused by all jobs
+- the base model is kept resident; LoRA combinations (see lora_merge.py)
+  are attached to it for one job and detached afterwards
+
+Every job reports how much start-up time it saved compared with the
+subprocess path (interpreter + imports + reused model loads).
+"""""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import replace
+
+from sweep import device_command, device_env
+
+worker_script = os.path.abspath(__file__)
+
+# Classifier model classes / pipeline tasks that are kept resident
+resident_tasks = {"text-classification", "sentiment-analysis", "zero-shot-classification"}
+
+
+class EvalWorker:
+    """
+    Parent-side handle of one worker process (JSON lines over stdin/stdout).
+    """
+
+    def __init__(self, device, cwd, env=None):
+        self.device = device
+        self.cwd = cwd
+        self.process = subprocess.Popen(
+            [sys.executable, worker_script],
+            cwd=cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=device_env(device, env),
+            text=True,
+        )
+
+    def run(self, module, argv, log_path):
+        request = {"module": module, "argv": argv, "log_path": os.path.abspath(log_path)}
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"Evaluation worker on device {self.device} exited unexpectedly")
+        return json.loads(line)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class EvalService:
+    """
+    Pool of evaluation workers, one per busy device slot.
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.workers = []
+        self.saved = 0.0
+        self.jobs = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self, device, cwd, env):
+        key = (device, cwd)
+        with self._lock:
+            if self.idle.get(key):
+                return self.idle[key].pop()
+        worker = EvalWorker(device, cwd, env)
+        with self._lock:
+            self.workers.append(worker)
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            self.idle.setdefault((worker.device, worker.cwd), []).append(worker)
+
+    def wrap(self, step):
+        """
+        Run a `python -m robbie.eval ...` step in a long-lived worker.
+        """
+        if step.cmd[:2] != ["python", "-m"]:
+            raise ValueError(f"Expected a 'python -m' command, got {step.cmd}")
+        module = step.cmd[2]
+
+        def run(step, device):
+            argv = device_command(step.cmd, device)[3:]
+            worker = self._acquire(device, step.cwd, step.env)
+            try:
+                result = worker.run(module, argv, step.log_path)
+            except Exception:
+                worker.close()
+                with self._lock:
+                    self.workers.remove(worker)
+                raise
+            self._release(worker)
+            with self._lock:
+                self.saved += result["saved"]
+                self.jobs += 1
+            print(f"[INFO] Evaluation worker on {device}: job took {result['elapsed']:.0f}s, "
+                  f"saved {result['saved']:.0f}s of start-up compared with a new process.")
+            if result["returncode"] != 0:
+                raise subprocess.CalledProcessError(result["returncode"], step.cmd)
+
+        return replace(step, func=run)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        if self.jobs:
+            print(f"[INFO] Evaluation workers saved {self.saved / 60:.1f} min over {self.jobs} jobs "
+                  f"({self.saved / self.jobs:.0f}s per job).")
+
+
+# ---- Worker process side ----
+
+class Residency:
+    """
+    Keeps classifiers and the base model loaded across jobs.
+    `load_times` remembers what each resident load cost originally.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.load_times = {}
+        self.saved = 0.0
+        self.attached = []
+
+    def cached(self, key, load):
+        if key in self.models:
+            self.saved += self.load_times[key]
+            return self.models[key]
+        start = time.time()
+        self.models[key] = load()
+        self.load_times[key] = time.time() - start
+        return self.models[key]
+
+    def install(self):
+        """
+        Patch the transformers entry points robbie uses to load models.
+        """
+        import transformers
+        from transformers import AutoModelForCausalLM, AutoModelForSequenceClassification
+
+        original_pipeline = transformers.pipeline
+        original_cls = AutoModelForSequenceClassification.from_pretrained.__func__
+        original_lm = AutoModelForCausalLM.from_pretrained.__func__
+        residency = self
+
+        def pipeline(task=None, *args, **kwargs):
+            if task not in resident_tasks:
+                return original_pipeline(task, *args, **kwargs)
+            key = ("pipeline", task, repr(args), repr(sorted(kwargs.items())))
+            return residency.cached(key, lambda: original_pipeline(task, *args, **kwargs))
+
+        def classifier_from_pretrained(cls, name, *args, **kwargs):
+            key = ("classifier", cls.__name__, str(name), repr(args), repr(sorted(kwargs.items())))
+            return residency.cached(key, lambda: original_cls(cls, name, *args, **kwargs))
+
+        def causal_lm_from_pretrained(cls, name, *args, **kwargs):
+            adapter_config = os.path.join(str(name), "adapter_config.json")
+            if not os.path.exists(adapter_config):
+                return original_lm(cls, name, *args, **kwargs)
+            # LoRA combination: attach it to the resident base model
+            from peft import PeftModel
+            with open(adapter_config, "r") as f:
+                base_id = json.load(f)["base_model_name_or_path"]
+            key = ("base", base_id, repr(sorted(kwargs.items())))
+            base = residency.cached(key, lambda: original_lm(cls, base_id, *args, **kwargs))
+            model = PeftModel.from_pretrained(base, name)
+            residency.attached.append(model)
+            return model
+
+        transformers.pipeline = pipeline
+        transformers.pipelines.pipeline = pipeline
+        AutoModelForSequenceClassification.from_pretrained = classmethod(classifier_from_pretrained)
+        AutoModelForCausalLM.from_pretrained = classmethod(causal_lm_from_pretrained)
+
+    def after_job(self):
+        # Detach LoRA layers so the next job starts from the plain base model
+        for model in self.attached:
+            model.unload()
+        self.attached = []
+        import gc
+        import torch
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def run_job(request, residency):
+    import runpy
+
+    saved_before = residency.saved
+    log_fd = os.open(request["log_path"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    saved_fds = os.dup(1), os.dup(2)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    sys.argv = [request["module"]] + request["argv"]
+    start = time.time()
+    returncode = 0
+    try:
+        runpy.run_module(request["module"], run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in (log_fd, *saved_fds):
+            os.close(fd)
+        residency.after_job()
+    return returncode, time.time() - start, residency.saved - saved_before
+
+
+def serve():
+    # Keep the protocol channel separate from anything printed by robbie
+    protocol = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    # Same module lookup as `python -m` from the ResponsibleNLP repo
+    sys.path.insert(0, os.getcwd())
+
+    start = time.time()
+    import torch  # noqa: F401
+    import transformers  # noqa: F401
+    residency = Residency()
+    residency.install()
+    import_time = time.time() - start
+
+    for i, line in enumerate(sys.stdin):
+        request = json.loads(line)
+        returncode, elapsed, saved = run_job(request, residency)
+        # The first job pays the imports just like a new process would
+        if i > 0:
+            saved += import_time
+        protocol.write(json.dumps({
+            "returncode": returncode,
+            "elapsed": elapsed,
+            "saved": saved,
+        }) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    serve()
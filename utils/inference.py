@@ -1,8 +1,21 @@
 """""
 This script enables inference with the Phi3 model combined 
 with multiple OpinionGPT adapters.
+
+For serving many prompts at once see serving.py.
+
+load_model() attaches all adapters up front. AdapterPool instead loads an
+adapter on first use and keeps at most `capacity` of them, evicting the
+least recently used one; adapter_registry() lists the available adapters
+without loading any.
 """""
 
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel
 
@@ -34,17 +47,36 @@ bias_to_subreddit = {
     "teenager": "AskTeenagers",
 }
 
-with open("hugging_access_token.txt", "r") as file:
-    access_token = file.read().strip()
+# Adapter names used by the Hub repos
+bias_to_subreddit["latin_america"] = bias_to_subreddit["latin_american"]
+bias_to_subreddit["teenagers"] = bias_to_subreddit["teenager"]
+
+# The token is only needed for gated models (not for local test models)
+access_token = None
+if os.path.exists("hugging_access_token.txt"):
+    with open("hugging_access_token.txt", "r") as file:
+        access_token = file.read().strip()
+
+model_id = "unsloth/Phi-3-mini-4k-instruct"
+lora_id = "HU-Berlin-ML-Internal/opiniongpt-phi3-{adapter}"
+
+# Shared by every prompt of a subreddit (see the prefix cache in serving.py)
+header_template = "### r/{subreddit} Question:\n\n"
 
-def load_model():
-    model_id = "unsloth/Phi-3-mini-4k-instruct"
-    lora_id = "HU-Berlin-ML-Internal/opiniongpt-phi3-{adapter}"
-    device = "cuda:2"
-    model = AutoModelForCausalLM.from_pretrained(model_id, token=access_token)
-    tokenizer = AutoTokenizer.from_pretrained(model_id, token=access_token)
+instruction_template = header_template + (
+    "{instruction}\n\n"
+    "### r/{subreddit} Answer:\n\n"
+)
 
-    default_adapter = adapters[0]
+def load_model(model_name=model_id, adapter_names=adapters, device="cuda:2", target_adapter="middle_east"):
+    model = AutoModelForCausalLM.from_pretrained(model_name, token=access_token)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, token=access_token)
+
+    if not adapter_names:
+        return model.to(device), tokenizer
+
+    adapter_names = list(adapter_names)
+    default_adapter = adapter_names[0]
 
     model = PeftModel.from_pretrained(
         model,
@@ -53,7 +85,7 @@ def load_model():
         token=access_token
     ).to(device)
 
-    for adapter in adapters[1:]:
+    for adapter in adapter_names[1:]:
         print("Loading adapter: {}".format(adapter))
         model.load_adapter(
             lora_id.format(adapter=adapter),
@@ -61,20 +93,140 @@ def load_model():
             token=access_token
         )
 
-    target_adapter = "middle_east"
-    
-    if model.active_adapter != "middle_east":
+    if target_adapter not in adapter_names:
+        target_adapter = default_adapter
+
+    if model.active_adapter != target_adapter:
         model.set_adapter(target_adapter)
 
     return model, tokenizer
 
-def inference(model, tokenizer):
-    instruction_template = (
-        "### r/{subreddit} Question:\n\n"
-        "{instruction}\n\n"
-        "### r/{subreddit} Answer:\n\n"
-    )
+def adapter_registry(adapter_names=adapters):
+    """
+    Available adapters without loading them: name -> Hub repo + subreddit.
+    """
+    return {
+        adapter: {"repo": lora_id.format(adapter=adapter), "subreddit": bias_to_subreddit[adapter]}
+        for adapter in adapter_names
+    }
+
+def adapter_metadata(adapter):
+    """
+    adapter_config.json of one adapter (downloads only that file).
+    """
+    from huggingface_hub import hf_hub_download
+    path = hf_hub_download(lora_id.format(adapter=adapter), "adapter_config.json", token=access_token)
+    with open(path, "r") as f:
+        return json.load(f)
+
+def resident_memory():
+    """
+    Resident set size of this process in bytes (Linux), or None.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
 
+class AdapterPool:
+    """
+    Adapters loaded on first use, at most `capacity` resident (LRU).
+    `model` starts as the plain base model and becomes a PeftModel with
+    the first adapter. Callbacks in `on_evict` get the evicted name.
+    A new adapter is loaded before the least recently used one is evicted,
+    so with capacity 1 two adapters are resident for a moment; adapters in
+    use (`keep`) and the last resident adapter are never evicted.
+    """
+
+    def __init__(self, model, capacity=3, registry=None):
+        self.model = model
+        self.capacity = max(1, capacity)
+        self.registry = registry if registry is not None else adapter_registry()
+        self.resident = OrderedDict()
+        self.load_times = {}
+        self.loads = 0
+        self.evictions = 0
+        self.on_evict = []
+
+    def get(self, adapter, keep=()):
+        """
+        Make an adapter resident (not evicting the ones in `keep`).
+        """
+        if adapter in self.resident:
+            self.resident.move_to_end(adapter)
+            return self.model
+        if adapter not in self.registry:
+            raise KeyError(adapter)
+        protected = set(keep) | {adapter}
+        if len(protected) > self.capacity:
+            raise RuntimeError(f"Adapter pool of {self.capacity} is too small for {len(protected)} adapters in use")
+
+        start = time.time()
+        repo = self.registry[adapter]["repo"]
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(repo, adapter, token=access_token)
+        else:
+            self.model = PeftModel.from_pretrained(self.model, repo, adapter_name=adapter, token=access_token)
+            self.model.eval()
+        self.load_times[adapter] = time.time() - start
+        self.loads += 1
+        self.resident[adapter] = True
+        # stderr: stdout may carry serving responses
+        print(f"[INFO] Loaded adapter {adapter} in {self.load_times[adapter]:.1f}s.", file=sys.stderr)
+
+        while len(self.resident) > self.capacity:
+            self.evict(next(a for a in self.resident if a not in protected))
+        return self.model
+
+    def acquire(self, adapter_names):
+        """
+        Make several adapters resident at once (e.g. for a mixed batch).
+        """
+        adapter_names = [a for a in dict.fromkeys(adapter_names) if a is not None]
+        for adapter in adapter_names:
+            self.get(adapter, keep=adapter_names)
+        return self.model
+
+    def evict(self, adapter):
+        """
+        Delete a resident adapter. If it is the active one, the most
+        recently used other adapter becomes active first.
+        """
+        others = [a for a in self.resident if a != adapter]
+        if not others:
+            raise RuntimeError(f"Cannot evict {adapter}, the only resident adapter")
+        if self.model.active_adapter == adapter:
+            self.model.set_adapter(others[-1])
+        self.model.delete_adapter(adapter)
+        del self.resident[adapter]
+        self.evictions += 1
+        for callback in self.on_evict:
+            callback(adapter)
+
+    def adapter_bytes(self, adapter):
+        return sum(
+            p.numel() * p.element_size()
+            for name, p in self.model.named_parameters()
+            if "lora_" in name and f".{adapter}." in name
+        )
+
+    def stats(self):
+        import torch
+        stats = {
+            "resident": list(self.resident),
+            "capacity": self.capacity,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "cold_start_s": {a: round(t, 3) for a, t in self.load_times.items()},
+            "adapter_bytes": {a: self.adapter_bytes(a) for a in self.resident},
+            "rss_bytes": resident_memory(),
+        }
+        if torch.cuda.is_available():
+            stats["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        return stats
+
+def inference(model, tokenizer):
     while True:
         try:
             subreddit = bias_to_subreddit[model.active_adapter]
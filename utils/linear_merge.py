@@ -0,0 +1,257 @@
+"""""
+This script enables linear merging (normalized weighted average) of
+biased models without MergeKit.
+
+The safetensors shards of all input models are memory-mapped and merged
+one tensor at a time, so RAM usage stays at one tensor per input model
+plus one output shard. The merged tensors are written as a sharded
+safetensors checkpoint (drop-in for mergekit-yaml).
+
+The weighted sum follows MergeKit's linear merge operation by operation,
+so results are bit-identical to a CPU MergeKit merge. Use --compare to
+check a merge against a MergeKit output directory.
+
+Usage:
+    python linear_merge.py config.yml output_dir
+    python linear_merge.py config.yml output_dir --compare mergekit_output_dir
+"""""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+
+import torch
+import yaml
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+# Non-weight files copied from the first model into the output directory
+copied_files = [
+    "config.json",
+    "generation_config.json",
+    "tokenizer.json",
+    "tokenizer.model",
+    "tokenizer_config.json",
+    "special_tokens_map.json",
+    "added_tokens.json",
+]
+
+dtypes = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+layer_pattern = re.compile(r"\.layers\.(\d+)\.")
+
+
+class ShardedCheckpoint:
+    """
+    Lazy view of a safetensors checkpoint (single file or index + shards).
+    Tensors are read from memory-mapped files on access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        index_path = os.path.join(path, "model.safetensors.index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                self.weight_map = json.load(f)["weight_map"]
+        else:
+            single = "model.safetensors"
+            if not os.path.exists(os.path.join(path, single)):
+                raise FileNotFoundError(f"No safetensors checkpoint found in {path}")
+            with safe_open(os.path.join(path, single), framework="pt", device="cpu") as f:
+                self.weight_map = {name: single for name in f.keys()}
+        self._handles = {}
+
+    def keys(self):
+        return list(self.weight_map)
+
+    def get(self, name):
+        shard = self.weight_map[name]
+        if shard not in self._handles:
+            self._handles[shard] = safe_open(os.path.join(self.path, shard), framework="pt", device="cpu")
+        return self._handles[shard].get_tensor(name)
+
+    def num_layers(self):
+        layers = [int(m.group(1)) for m in map(layer_pattern.search, self.weight_map) if m]
+        return max(layers) + 1 if layers else 1
+
+
+def parameter_value(value, t):
+    """
+    Evaluate a MergeKit parameter: scalars as is, lists as a gradient over
+    the layers (t = relative depth of the tensor, 0..1).
+    """
+    if not isinstance(value, list):
+        return float(value)
+    if len(value) == 1 or all(v == value[0] for v in value):
+        return float(value[0])
+    scaled = t * (len(value) - 1)
+    i0 = min(int(scaled), len(value) - 2)
+    frac = scaled - i0
+    return (1 - frac) * value[i0] + frac * value[i0 + 1]
+
+
+def tensor_depth(name, num_layers):
+    match = layer_pattern.search(name)
+    if match:
+        return int(match.group(1)) / max(num_layers - 1, 1)
+    return 0.0 if "embed" in name else 1.0
+
+
+def linear_merge_tensor(tensors, weights, normalize):
+    """
+    MergeKit's linear merge of one tensor.
+    """
+    tensors = torch.stack(tensors, dim=0)
+    weights = torch.tensor(weights, dtype=tensors.dtype, device=tensors.device)
+    while len(weights.shape) < len(tensors.shape):
+        weights.unsqueeze_(-1)
+    res = (weights * tensors).sum(dim=0)
+    if normalize:
+        res = res / weights.sum(dim=0)
+    return res
+
+
+def load_config(config):
+    if isinstance(config, str):
+        with open(config, "r") as f:
+            config = yaml.safe_load(f)
+    if config.get("merge_method") != "linear":
+        raise ValueError(f"Only the linear merge method is supported, got '{config.get('merge_method')}'")
+    return config
+
+
+def iter_merged(config, model_root=None, device="cpu"):
+    """
+    Yield (name, merged tensor) pairs, one tensor at a time.
+    Model paths in the config are resolved relative to model_root.
+    """
+    config = load_config(config)
+    global_params = config.get("parameters", {})
+    normalize = config.get("normalize", global_params.get("normalize", True))
+    dtype = dtypes.get(config.get("dtype"))
+    out_dtype = dtypes.get(config.get("out_dtype"))
+
+    checkpoints = []
+    weights = []
+    for entry in config["models"]:
+        path = entry["model"] if model_root is None else os.path.join(model_root, entry["model"])
+        checkpoints.append(ShardedCheckpoint(path))
+        params = entry.get("parameters") or {}
+        weights.append(params.get("weight", global_params.get("weight")))
+    if any(w is None for w in weights):
+        raise ValueError("Every model needs a 'weight' parameter for a linear merge")
+
+    names = checkpoints[0].keys()
+    for ckpt in checkpoints[1:]:
+        if set(ckpt.keys()) != set(names):
+            raise ValueError(f"Tensor names of {ckpt.path} differ from {checkpoints[0].path}")
+    num_layers = checkpoints[0].num_layers()
+
+    for name in names:
+        t = tensor_depth(name, num_layers)
+        tensors = [ckpt.get(name).to(device) for ckpt in checkpoints]
+        if dtype is not None:
+            tensors = [x.to(dtype) for x in tensors]
+        res = linear_merge_tensor(tensors, [parameter_value(w, t) for w in weights], normalize)
+        if out_dtype is not None:
+            res = res.to(out_dtype)
+        yield name, res
+
+
+def write_sharded(tensors, output_path, max_shard_size=5 * 1024 ** 3):
+    """
+    Write (name, tensor) pairs as safetensors shards plus index, holding
+    at most one shard in memory.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    shards = []
+    current, current_size = {}, 0
+
+    def flush():
+        name = f"shard-{len(shards):05d}.tmp"
+        save_file(current, os.path.join(output_path, name), metadata={"format": "pt"})
+        shards.append((name, list(current)))
+
+    for name, tensor in tensors:
+        size = tensor.numel() * tensor.element_size()
+        if current and current_size + size > max_shard_size:
+            flush()
+            current, current_size = {}, 0
+        current[name] = tensor.contiguous()
+        current_size += size
+    if current:
+        flush()
+
+    # Final names follow the transformers convention
+    weight_map = {}
+    if len(shards) == 1:
+        os.replace(os.path.join(output_path, shards[0][0]), os.path.join(output_path, "model.safetensors"))
+    else:
+        for i, (tmp_name, names) in enumerate(shards, start=1):
+            final = f"model-{i:05d}-of-{len(shards):05d}.safetensors"
+            os.replace(os.path.join(output_path, tmp_name), os.path.join(output_path, final))
+            weight_map.update({n: final for n in names})
+        total_size = sum(os.path.getsize(os.path.join(output_path, f)) for f in set(weight_map.values()))
+        with open(os.path.join(output_path, "model.safetensors.index.json"), "w") as f:
+            json.dump({"metadata": {"total_size": total_size}, "weight_map": weight_map}, f, indent=2)
+
+
+def write_merged(config, output_path, model_root=None, max_shard_size=5 * 1024 ** 3):
+    """
+    Write the merge as a sharded safetensors checkpoint plus the config and
+    tokenizer files of the first model.
+    """
+    config = load_config(config)
+    write_sharded(iter_merged(config, model_root), output_path, max_shard_size)
+
+    first = config["models"][0]["model"]
+    first = first if model_root is None else os.path.join(model_root, first)
+    for name in copied_files:
+        if os.path.exists(os.path.join(first, name)):
+            shutil.copy(os.path.join(first, name), os.path.join(output_path, name))
+    with open(os.path.join(output_path, "mergekit_config.yml"), "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def compare(path_a, path_b):
+    """
+    Compare two checkpoints tensor by tensor, returns the mismatching names.
+    """
+    a, b = ShardedCheckpoint(path_a), ShardedCheckpoint(path_b)
+    if set(a.keys()) != set(b.keys()):
+        raise ValueError("Checkpoints contain different tensors")
+    mismatches = []
+    for name in a.keys():
+        x, y = a.get(name), b.get(name)
+        if x.dtype != y.dtype or not torch.equal(x, y):
+            diff = (x.float() - y.float()).abs().max().item()
+            print(f"[WARNING] {name} differs (max abs diff {diff:.3e})")
+            mismatches.append(name)
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="MergeKit YAML config (merge_method: linear)")
+    parser.add_argument("output_path", help="Where to write the merged checkpoint")
+    parser.add_argument("--model-root", default=None, help="Resolve model paths relative to this directory")
+    parser.add_argument("--max-shard-size-gb", type=float, default=5, help="Maximum size of one output shard")
+    parser.add_argument("--compare", default=None, help="MergeKit output to compare the merge against")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    write_merged(args.config, args.output_path, args.model_root, int(args.max_shard_size_gb * 1024 ** 3))
+    print(f"[INFO] Merged into {args.output_path} in {time.time() - start_time:.1f}s.")
+
+    if args.compare:
+        mismatches = compare(args.output_path, args.compare)
+        if mismatches:
+            raise SystemExit(f"[ERROR] {len(mismatches)} tensors differ from {args.compare}")
+        print(f"[INFO] Merge is bit-identical to {args.compare}")
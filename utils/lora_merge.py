@@ -0,0 +1,233 @@
+"""""
+This script enables bias combination directly on the OpinionGPT LoRA adapters.
+
+Every phi3_* model is the base model plus one low-rank delta
+(merge_and_unload of one adapter). A normalized linear merge of those
+models is therefore the base model plus the weighted sum of the deltas:
+
+    sum_i w_i (W + s_i B_i A_i) / sum_i w_i = W + sum_i (w_i / sum_j w_j) s_i B_i A_i
+
+The weighted sum is kept in low-rank form by concatenating the factors
+(rank = sum of the adapter ranks), so a combination is a small PEFT adapter
+on top of the shared base model instead of a new full checkpoint.
+
+Usage:
+    python lora_merge.py config.yml output_dir
+    python lora_merge.py config.yml output_dir --check-against merged_full_dir --base base_dir
+"""""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+
+import torch
+import yaml
+from safetensors.torch import load_file, save_file
+
+from linear_merge import ShardedCheckpoint, load_config, parameter_value, tensor_depth
+
+lora_id = "HU-Berlin-ML-Internal/opiniongpt-phi3-{adapter}"
+module_prefix = "base_model.model."
+
+# Tokenizer files copied from the base model next to the adapter
+tokenizer_files = [
+    "tokenizer.json",
+    "tokenizer.model",
+    "tokenizer_config.json",
+    "special_tokens_map.json",
+    "added_tokens.json",
+]
+
+
+def adapter_for_model(model):
+    """
+    Map a merged model name from the drivers (e.g. phi3_women) to its adapter.
+    """
+    name = os.path.basename(os.path.normpath(model))
+    if not name.startswith("phi3_"):
+        raise ValueError(f"Cannot derive an OpinionGPT adapter from '{model}'")
+    return lora_id.format(adapter=name[len("phi3_"):])
+
+
+def resolve_adapter(adapter):
+    """
+    Local adapter directory, downloading it from the Hub if needed.
+    """
+    if os.path.isdir(adapter):
+        return adapter
+    from huggingface_hub import snapshot_download
+    return snapshot_download(adapter, token=os.environ.get("HUGGING_FACE_HUB_TOKEN"))
+
+
+def pattern_value(patterns, module, default):
+    for key, value in patterns.items():
+        if re.match(rf"(.*\.)?{key}$", module):
+            return value
+    return default
+
+
+def load_lora(adapter):
+    """
+    Read one PEFT LoRA adapter as {module: (A, B, scaling)} plus its config.
+    """
+    path = resolve_adapter(adapter)
+    with open(os.path.join(path, "adapter_config.json"), "r") as f:
+        config = json.load(f)
+    if config.get("modules_to_save") or config.get("use_dora") or config.get("fan_in_fan_out"):
+        raise ValueError(f"{adapter} cannot be composed in low-rank form (modules_to_save, DoRA or fan_in_fan_out)")
+
+    weights_path = os.path.join(path, "adapter_model.safetensors")
+    if os.path.exists(weights_path):
+        state = load_file(weights_path)
+    else:
+        state = torch.load(os.path.join(path, "adapter_model.bin"), map_location="cpu")
+
+    factors = {}
+    for key, a in state.items():
+        if not key.endswith(".lora_A.weight"):
+            continue
+        module = key[:-len(".lora_A.weight")]
+        b = state[f"{module}.lora_B.weight"]
+        short = module[len(module_prefix):] if module.startswith(module_prefix) else module
+        r = pattern_value(config.get("rank_pattern") or {}, short, config["r"])
+        alpha = pattern_value(config.get("alpha_pattern") or {}, short, config["lora_alpha"])
+        scaling = alpha / (r ** 0.5 if config.get("use_rslora") else r)
+        factors[module] = (a, b, scaling)
+    return factors, config
+
+
+def compose(adapters, weights, normalize=True):
+    """
+    Weighted sum of LoRA deltas as one adapter with concatenated factors.
+    `weights` may contain MergeKit layer gradients (lists).
+    Returns {module: (A, B)} with the scaling folded into B.
+    Without normalization the weights must sum to 1: a dense merge then
+    also scales the base weights, which one adapter cannot express.
+    """
+    loaded = [load_lora(a)[0] for a in adapters]
+    modules = sorted(set().union(*loaded))
+    layers = [int(m.group(1)) for m in (re.search(r"\.layers\.(\d+)\.", x) for x in modules) if m]
+    num_layers = max(layers) + 1 if layers else 1
+
+    composed = {}
+    for module in modules:
+        t = tensor_depth(module + ".weight", num_layers)
+        values = [parameter_value(w, t) for w in weights]
+        if not normalize and abs(sum(values) - 1.0) > 1e-6:
+            raise ValueError(f"Weights sum to {sum(values):g} for {module}; an unnormalized "
+                             f"linear merge only equals one adapter if they sum to 1")
+        total = sum(values) if normalize else 1.0
+        a_parts, b_parts = [], []
+        for factors, value in zip(loaded, values):
+            if module not in factors:
+                continue
+            a, b, scaling = factors[module]
+            a_parts.append(a.float())
+            b_parts.append(b.float() * (value / total * scaling))
+        composed[module] = (torch.cat(a_parts, dim=0), torch.cat(b_parts, dim=1))
+    return composed
+
+
+def write_adapter(composed, template_config, output_path):
+    """
+    Save composed factors as a PEFT adapter (scaling 1, per-module ranks).
+    """
+    os.makedirs(output_path, exist_ok=True)
+    state = {}
+    ranks = {}
+    for module, (a, b) in composed.items():
+        state[f"{module}.lora_A.weight"] = a.contiguous()
+        state[f"{module}.lora_B.weight"] = b.contiguous()
+        short = module[len(module_prefix):] if module.startswith(module_prefix) else module
+        ranks[short] = a.shape[0]
+    save_file(state, os.path.join(output_path, "adapter_model.safetensors"), metadata={"format": "pt"})
+
+    r = max(ranks.values())
+    config = dict(template_config)
+    config.update({
+        "r": r,
+        "lora_alpha": r,
+        "use_rslora": False,
+        # Modules with another rank keep scaling 1 through their own alpha
+        "rank_pattern": {m: k for m, k in ranks.items() if k != r},
+        "alpha_pattern": {m: k for m, k in ranks.items() if k != r},
+    })
+    with open(os.path.join(output_path, "adapter_config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def copy_tokenizer(base_model, output_path):
+    """
+    Put the tokenizer of the base model next to the adapter: robbie.eval
+    loads AutoTokenizer from the model directory it evaluates.
+    """
+    if os.path.isdir(base_model):
+        found = [name for name in tokenizer_files if os.path.exists(os.path.join(base_model, name))]
+        for name in found:
+            shutil.copy(os.path.join(base_model, name), os.path.join(output_path, name))
+        if found:
+            return
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(base_model, token=os.environ.get("HUGGING_FACE_HUB_TOKEN"))
+    tokenizer.save_pretrained(output_path)
+
+
+def merge_config(config, output_path, base_model=None):
+    """
+    Build the LoRA combination described by a MergeKit linear config.
+    The tokenizer comes from base_model (default: the adapters' base model).
+    """
+    config = load_config(config)
+    global_params = config.get("parameters", {})
+    normalize = config.get("normalize", global_params.get("normalize", True))
+    adapters = [adapter_for_model(m["model"]) for m in config["models"]]
+    weights = [(m.get("parameters") or {}).get("weight", global_params.get("weight")) for m in config["models"]]
+    composed = compose(adapters, weights, normalize)
+    _, template = load_lora(adapters[0])
+    write_adapter(composed, template, output_path)
+    copy_tokenizer(base_model or template["base_model_name_or_path"], output_path)
+    with open(os.path.join(output_path, "mergekit_config.yml"), "w") as f:
+        yaml.safe_dump(config, f)
+
+
+def check_against(adapter_path, base_path, merged_path):
+    """
+    Max abs difference between base + composed delta and a full-weight merge.
+    """
+    composed, _ = load_lora(adapter_path)
+    base, merged = ShardedCheckpoint(base_path), ShardedCheckpoint(merged_path)
+    max_diff = 0.0
+    for name in merged.keys():
+        expected = merged.get(name).float()
+        weight = base.get(name).float()
+        module = module_prefix + name[:-len(".weight")]
+        if module in composed:
+            a, b, scaling = composed[module]
+            weight = weight + (b.float() @ a.float()) * scaling
+        max_diff = max(max_diff, (weight - expected).abs().max().item())
+    return max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="MergeKit YAML config (merge_method: linear) over phi3_* models")
+    parser.add_argument("output_path", help="Where to write the combined adapter")
+    parser.add_argument("--check-against", default=None, help="Full-weight merge to compare the combination with")
+    parser.add_argument("--base", default=None, help="Base model directory (tokenizer source, required for --check-against)")
+    parser.add_argument("--tolerance", type=float, default=1e-5, help="Allowed max abs difference")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    merge_config(args.config, args.output_path, args.base)
+    print(f"[INFO] Combined adapter written to {args.output_path} in {time.time() - start_time:.1f}s.")
+
+    if args.check_against:
+        if args.base is None:
+            raise SystemExit("[ERROR] --check-against needs --base")
+        diff = check_against(args.output_path, args.base, args.check_against)
+        if diff > args.tolerance:
+            raise SystemExit(f"[ERROR] Max abs difference {diff:.3e} exceeds {args.tolerance:.1e}")
+        print(f"[INFO] Combination matches {args.check_against} (max abs difference {diff:.3e})")
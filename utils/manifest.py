@@ -0,0 +1,82 @@
+"""""
+This module enables resumable sweeps through a persistent run manifest.
+
+The manifest is an append-only JSONL journal with one line per state
+change of a tag (merged, evaluated, failed + stage) and its timings.
+Replaying the journal on start-up tells the drivers which tags are
+already finished, so a crashed or pre-empted sweep only retries the
+unfinished and failed ones.
+"""""
+
+import json
+import os
+import threading
+import time
+
+# States written to the journal
+merged = "merged"
+evaluated = "evaluated"
+failed = "failed"
+
+# State reached after a successful stage
+stage_states = {
+    "merge": merged,
+    "eval": evaluated,
+}
+
+
+class RunManifest:
+    """
+    Append-only journal of tag states. With resume=False earlier entries
+    are kept in the file but ignored, so every tag runs again.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.states = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._replay()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _replay(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of a crashed run may be cut off
+                    continue
+                self.states[entry["tag"]] = entry
+
+    def record(self, tag, state, **info):
+        """
+        Append one state change, flushed to disk before returning.
+        """
+        entry = {"tag": tag, "state": state, "time": time.time(), **info}
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.states[tag] = entry
+
+    def record_stage(self, tag, stage, elapsed, ok=True, **info):
+        if ok:
+            self.record(tag, stage_states.get(stage, stage), stage=stage, elapsed=round(elapsed, 3), **info)
+        else:
+            self.record(tag, failed, stage=stage, elapsed=round(elapsed, 3), **info)
+
+    def state(self, tag):
+        entry = self.states.get(tag)
+        return entry["state"] if entry else None
+
+    def is_done(self, tag):
+        return self.state(tag) == evaluated
+
+    def summary(self):
+        counts = {}
+        for entry in self.states.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        return counts
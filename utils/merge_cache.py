@@ -0,0 +1,289 @@
+"""""
+This module enables a content-addressed cache of merged models.
+
+A merged model is stored under the hash of its canonical YAML config
+plus fingerprints of all input models. Drivers look the hash up before
+calling mergekit-yaml, so re-running a sweep (or evaluating the same
+merge on another dataset) reuses the merged model instead of merging again.
+The cache keeps its total size below a disk budget by evicting the
+least recently used entries that are not in use.
+"""""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+
+from sweep import device_command, device_env
+
+index_name = "index.json"
+lock_name = "index.lock"
+
+
+def canonical_config(config):
+    """
+    Canonical YAML text of a merge config (sorted keys, fixed style).
+    """
+    import yaml
+    return yaml.safe_dump(config, sort_keys=True, default_flow_style=False)
+
+
+def model_fingerprint(model, model_root=None):
+    """
+    Fingerprint of an input model:
+    - local directory -> hash over file names, sizes and modification times
+    - anything else (e.g. a Hugging Face id) -> the id itself
+    """
+    path = model if model_root is None else os.path.join(model_root, model)
+    if not os.path.isdir(path):
+        return f"id:{model}"
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            st = os.stat(full)
+            h.update(f"{os.path.relpath(full, path)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return f"dir:{h.hexdigest()}"
+
+
+def config_models(config):
+    models = [m["model"] for m in config.get("models", [])]
+    if "base_model" in config:
+        models.append(config["base_model"])
+    return models
+
+
+def merge_engine(cmd):
+    """
+    Identity of the program that builds the merge: the executable
+    (mergekit-yaml) or, for `python script.py ...`, the script name
+    (linear_merge.py builds a full checkpoint, lora_merge.py an adapter).
+    """
+    program = os.path.basename(cmd[0])
+    if program.startswith("python") and len(cmd) > 1:
+        return os.path.basename(cmd[1])
+    return program
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            full = os.path.join(root, name)
+            if not os.path.islink(full):
+                total += os.path.getsize(full)
+    return total
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def pin_entry(entry, delta):
+    """
+    Change the pin count of this process on an index entry.
+    """
+    pins = entry.setdefault("pins", {})
+    pid = str(os.getpid())
+    pins[pid] = pins.get(pid, 0) + delta
+    if pins[pid] <= 0:
+        del pins[pid]
+    if not pins:
+        del entry["pins"]
+
+
+def is_pinned(entry):
+    """
+    True if a running process still uses the entry (stale pins are dropped).
+    """
+    pins = entry.get("pins", {})
+    for pid in list(pins):
+        if not pid_alive(int(pid)):
+            del pins[pid]
+    if not pins:
+        entry.pop("pins", None)
+    return bool(pins)
+
+
+class MergeCache:
+    """
+    Merged models keyed by config + input fingerprints, with LRU eviction.
+    The index is shared between processes through a file lock. Entries
+    currently evaluated are pinned in the index (a count per process id),
+    so no driver evicts a merge another driver still uses; pins of
+    processes that no longer run are dropped.
+    """
+
+    def __init__(self, cache_dir, budget_gb):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.budget = int(budget_gb * 1024 ** 3)
+        self.links = {}
+        self._lock = threading.Lock()
+        self._building = {}
+        self._fingerprints = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @contextmanager
+    def _index(self):
+        """
+        Read-modify-write access to the index under an exclusive lock.
+        """
+        with self._lock, open(os.path.join(self.cache_dir, lock_name), "w") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            path = os.path.join(self.cache_dir, index_name)
+            index = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    index = json.load(f)
+            yield index
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, path)
+
+    def _fingerprint(self, model, model_root):
+        key = (model, model_root)
+        if key not in self._fingerprints:
+            self._fingerprints[key] = model_fingerprint(model, model_root)
+        return self._fingerprints[key]
+
+    def key(self, config, merge_options=(), model_root=None):
+        h = hashlib.sha256()
+        h.update(canonical_config(config).encode())
+        for model in config_models(config):
+            h.update(f"{model}={self._fingerprint(model, model_root)}\n".encode())
+        h.update(" ".join(merge_options).encode())
+        return h.hexdigest()[:32]
+
+    def step_key(self, step, config):
+        """
+        Key of the merge a step builds: the engine and its flags change
+        the result, paths and the device do not.
+        """
+        merge_options = [merge_engine(step.cmd)] + [a for a in step.cmd if a.startswith("--") and a != "--cuda"]
+        return self.key(config, merge_options, model_root=step.cwd)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key, pin=False):
+        """
+        Path of a cached merge (marks it as recently used, and pins it
+        for this process if asked), or None.
+        """
+        with self._index() as index:
+            if key in index and os.path.isdir(self.entry_path(key)):
+                index[key]["last_used"] = time.time()
+                if pin:
+                    pin_entry(index[key], 1)
+                return self.entry_path(key)
+            index.pop(key, None)
+        return None
+
+    def commit(self, key, config, pin=False):
+        """
+        Register a freshly built entry and evict old ones if over budget.
+        """
+        with self._index() as index:
+            pins = index.get(key, {}).get("pins")
+            index[key] = {
+                "size": dir_size(self.entry_path(key)),
+                "last_used": time.time(),
+                "config": config,
+            }
+            if pins:
+                index[key]["pins"] = pins
+            if pin:
+                pin_entry(index[key], 1)
+            self._evict(index)
+
+    def _evict(self, index):
+        total = sum(e["size"] for e in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.budget:
+                break
+            if is_pinned(index[key]):
+                continue
+            total -= index[key]["size"]
+            del index[key]
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            print(f"[INFO] Evicted cached merge {key}")
+
+    def unpin(self, key):
+        with self._index() as index:
+            if key in index:
+                pin_entry(index[key], -1)
+            self._evict(index)
+
+    def release(self, output_path):
+        """
+        Drop the link to a cached merge and let eviction reclaim it.
+        """
+        key = self.links.pop(output_path, None)
+        if os.path.islink(output_path):
+            os.unlink(output_path)
+        if key is None:
+            return
+        self.unpin(key)
+
+    def _build_lock(self, key):
+        with self._lock:
+            return self._building.setdefault(key, threading.Lock())
+
+    def wrap(self, step, config, output_path):
+        """
+        Turn a mergekit step into a cached merge: on a hit the merge is
+        skipped; on a miss mergekit writes into the cache. Either way
+        output_path becomes a symlink to the cached model.
+        """
+        key = self.step_key(step, config)
+
+        def run(step, device):
+            with self._build_lock(key):
+                cached = self.lookup(key, pin=True)
+                if cached is None:
+                    tmp_path = f"{self.entry_path(key)}.tmp{os.getpid()}"
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    cmd = [tmp_path if a == output_path else a for a in device_command(step.cmd, device)]
+                    try:
+                        with open(step.log_path, "w") as log_f:
+                            subprocess.run(
+                                cmd,
+                                cwd=step.cwd,
+                                stdout=log_f, stderr=subprocess.STDOUT,
+                                check=True,
+                                env=device_env(device, step.env),
+                            )
+                    except Exception:
+                        shutil.rmtree(tmp_path, ignore_errors=True)
+                        raise
+                    if os.path.isdir(self.entry_path(key)):
+                        # Another process built the same merge meanwhile
+                        shutil.rmtree(tmp_path, ignore_errors=True)
+                    else:
+                        os.replace(tmp_path, self.entry_path(key))
+                    self.commit(key, config, pin=True)
+                    cached = self.entry_path(key)
+                else:
+                    with open(step.log_path, "w") as log_f:
+                        log_f.write(f"[cache] hit {key} -> {cached}\n")
+
+            if os.path.lexists(output_path):
+                subprocess.run(["rm", "-rf", output_path])
+            os.symlink(cached, output_path)
+            self.links[output_path] = key
+
+        return replace(step, func=run)
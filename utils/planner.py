@@ -0,0 +1,274 @@
+"""""
+This module enables planning a sweep before it runs: merge configs are
+brought into a canonical form, equivalent ones are collapsed, and the
+wall-clock cost of the remaining merges is estimated from the timings in
+earlier run manifests.
+
+Canonical form (only rewrites that give the same merged model):
+- parameters a merge method does not read are dropped (e.g. lambda for
+  linear, density for task_arithmetic, base_model for linear)
+- a layer gradient with one repeated value becomes that value
+- linear merges normalise by default (mergekit: normalize=True), so their
+  weights are replaced by the weights divided by their sum, and normalize
+  is dropped: [0.3, 0.3], [0.5, 0.5] and [0.7, 0.7] are the same merge
+- models (with their parameters) are sorted for methods whose result
+  does not depend on their order (no random drops per model)
+
+Each distinct merge runs once, under the tag of its first config. After
+the run, every other tag of the group gets links to its result files and
+an `evaluated` manifest entry with alias_of=<tag that ran>.
+
+Usage:
+    python planner.py configs/*.yml --manifest logs/manifest_grid_search.jsonl --devices 4
+"""""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+
+from manifest import evaluated
+from warehouse import parse_tag
+
+# Per-model parameters each merge method reads
+method_model_params = {
+    "linear": ["weight"],
+    "task_arithmetic": ["weight"],
+    "ties": ["weight", "density"],
+    "dare_linear": ["weight", "density"],
+    "dare_ties": ["weight", "density"],
+    "della": ["weight", "density", "epsilon"],
+    "della_linear": ["weight", "density", "epsilon"],
+    "breadcrumbs": ["weight", "density", "gamma"],
+    "breadcrumbs_ties": ["weight", "density", "gamma"],
+    "sce": ["weight"],
+}
+
+# Top-level tuning parameters each merge method reads (other keys are kept)
+method_global_params = {
+    "linear": ["normalize"],
+    "task_arithmetic": ["lambda", "normalize", "rescale", "int8_mask"],
+    "ties": ["lambda", "normalize", "rescale", "int8_mask"],
+    "dare_linear": ["lambda", "normalize", "rescale", "int8_mask"],
+    "dare_ties": ["lambda", "normalize", "rescale", "int8_mask"],
+    "della": ["lambda", "normalize", "rescale", "int8_mask"],
+    "della_linear": ["lambda", "normalize", "rescale", "int8_mask"],
+    "breadcrumbs": ["lambda", "normalize", "rescale", "int8_mask"],
+    "breadcrumbs_ties": ["lambda", "normalize", "rescale", "int8_mask"],
+    "sce": ["select_top_k", "select_topk", "int8_mask"],
+}
+tuning_params = {name for names in method_global_params.values() for name in names} | {"density", "epsilon", "gamma"}
+
+# Methods that do not use base_model
+base_free_methods = {"linear"}
+
+# Methods whose result does not depend on the order of the models
+commutative_methods = {"linear", "task_arithmetic", "ties"}
+
+
+def collapse_gradient(value):
+    if isinstance(value, list) and value and all(v == value[0] for v in value):
+        return value[0]
+    return value
+
+
+def normalized_weights(weights):
+    """
+    Weights divided by their sum (element-wise for layer gradients of equal
+    length); None if they cannot be normalised like mergekit does.
+    """
+    if all(isinstance(w, (int, float)) for w in weights):
+        total = sum(weights)
+        return [round(w / total, 12) for w in weights] if total else None
+    if all(isinstance(w, list) for w in weights) and len({len(w) for w in weights}) == 1:
+        totals = [sum(column) for column in zip(*weights)]
+        if not all(totals):
+            return None
+        return [[round(v / t, 12) for v, t in zip(w, totals)] for w in weights]
+    return None
+
+
+def canonical_merge(config):
+    """
+    Canonical form of a merge config (a new dict, the input is unchanged).
+    """
+    method = config.get("merge_method")
+    model_keys = method_model_params.get(method)
+    global_keys = method_global_params.get(method)
+    canonical = {}
+    for key, value in config.items():
+        if key == "models":
+            continue
+        if key == "base_model" and method in base_free_methods:
+            continue
+        if global_keys is not None and key in tuning_params and key not in global_keys:
+            continue
+        canonical[key] = value
+
+    models = []
+    for entry in config.get("models", []):
+        parameters = {
+            k: collapse_gradient(v)
+            for k, v in (entry.get("parameters") or {}).items()
+            if model_keys is None or k in model_keys
+        }
+        models.append({**{k: v for k, v in entry.items() if k != "parameters"}, "parameters": parameters})
+
+    if method == "linear":
+        normalize = canonical.pop("normalize", True)
+        weights = [m["parameters"].get("weight") for m in models]
+        normalized = normalized_weights(weights) if normalize and None not in weights else None
+        if normalized is not None:
+            for model, weight in zip(models, normalized):
+                model["parameters"]["weight"] = weight
+        else:
+            canonical["normalize"] = normalize
+
+    if method in commutative_methods:
+        models.sort(key=lambda m: json.dumps(m, sort_keys=True))
+    canonical["models"] = models
+    return canonical
+
+
+def merge_key(config):
+    text = json.dumps(canonical_merge(config), sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+
+def stage_timings(manifest_paths):
+    """
+    Elapsed seconds of successful stages in run manifests,
+    as {(method, stage): [seconds, ...]}.
+    """
+    timings = {}
+    for path in manifest_paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "elapsed" not in entry or entry.get("state") == "failed" or entry.get("alias_of"):
+                    continue
+                method = parse_tag(entry["tag"])["method"]
+                timings.setdefault((method, entry["stage"]), []).append(entry["elapsed"])
+    return timings
+
+
+class Plan:
+    """
+    Candidates (dicts with at least "tag" and "config") grouped by their
+    canonical merge. `primaries` run; `aliases[tag]` share their result.
+    """
+
+    def __init__(self, candidates):
+        self.groups = {}
+        for candidate in candidates:
+            self.groups.setdefault(merge_key(candidate["config"]), []).append(candidate)
+        self.primaries = [group[0] for group in self.groups.values()]
+        self.aliases = {group[0]["tag"]: group[1:] for group in self.groups.values()}
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups.values())
+
+    def duplicates(self):
+        return len(self) - len(self.primaries)
+
+    def estimate(self, manifest_paths, devices=1, stages=("merge", "eval"), manifest=None):
+        """
+        Estimated wall-clock seconds of the primaries that are not done
+        yet, from the median stage timings per method (or of all methods),
+        and the number of timings used. (None, 0) without any timings.
+        """
+        timings = stage_timings(manifest_paths)
+        if not timings:
+            return None, 0
+        overall = {
+            stage: statistics.median([s for (_, st), values in timings.items() if st == stage for s in values] or [0])
+            for stage in stages
+        }
+        total = 0.0
+        for candidate in self.primaries:
+            if manifest is not None and manifest.is_done(candidate["tag"]):
+                continue
+            method = candidate["config"].get("merge_method")
+            for stage in stages:
+                values = timings.get((method, stage))
+                total += statistics.median(values) if values else overall[stage]
+        return total / max(1, devices), sum(len(v) for v in timings.values())
+
+    def summary(self, manifest_paths=(), devices=1, manifest=None):
+        seconds, n_timings = self.estimate(manifest_paths, devices, manifest=manifest)
+        text = (f"[INFO] Plan: {len(self)} configurations -> {len(self.primaries)} distinct merges "
+                f"({self.duplicates()} duplicates)")
+        if seconds is None:
+            return text + ", no timings in the manifests for a cost estimate"
+        hours, rest = divmod(int(seconds), 3600)
+        mins, secs = divmod(rest, 60)
+        return text + f", estimated {hours}h {mins}m {secs}s on {devices} device(s) (from {n_timings} timed stages)"
+
+    def fan_out(self, manifest, results_dir):
+        """
+        Give every alias of an evaluated primary its results and manifest entry.
+        """
+        count = 0
+        for primary, aliases in self.aliases.items():
+            if not aliases or not manifest.is_done(primary):
+                continue
+            for alias in aliases:
+                if manifest.is_done(alias["tag"]):
+                    continue
+                link_results(results_dir, primary, alias["tag"])
+                manifest.record(alias["tag"], evaluated, alias_of=primary)
+                count += 1
+        if count:
+            print(f"[INFO] Fanned out results to {count} equivalent tags.")
+        return count
+
+
+def link_results(results_dir, tag, alias):
+    """
+    Mirror every result file of `tag` (a path component or file stem equal
+    to the tag) under the alias, as symlinks.
+    """
+    if not os.path.isdir(results_dir):
+        return 0
+    count = 0
+    for dirpath, _, filenames in os.walk(results_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            parts = os.path.relpath(path, results_dir).split(os.sep)
+            stem, ext = os.path.splitext(parts[-1])
+            if tag not in parts[:-1] and stem != tag:
+                continue
+            target_parts = [alias if p == tag else p for p in parts[:-1]] + [(alias if stem == tag else stem) + ext]
+            target = os.path.join(results_dir, *target_parts)
+            if os.path.lexists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.symlink(os.path.relpath(path, os.path.dirname(target)), target)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import yaml
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", nargs="+", help="Merge configs (YAML), the file name is the tag")
+    parser.add_argument("--manifest", nargs="*", default=[], help="Run manifests with stage timings")
+    parser.add_argument("--devices", type=int, default=1, help="Number of device slots")
+    args = parser.parse_args()
+
+    candidates = []
+    for path in args.configs:
+        with open(path, "r") as f:
+            candidates.append({"tag": os.path.splitext(os.path.basename(path))[0], "config": yaml.safe_load(f)})
+    plan = Plan(candidates)
+    print(plan.summary(args.manifest, args.devices))
+    for primary, aliases in plan.aliases.items():
+        if aliases:
+            print(f"{primary}: {', '.join(a['tag'] for a in aliases)}")
@@ -4,7 +4,24 @@ This script saves 11 combinations consisting of:
 - the Phi3 model as a base model
 
 This is the first step towards bias combination with MergeKit.
+
+With --batch the base model is loaded once per worker instead of once per
+adapter. Each adapter delta (scaling * B @ A, computed like PEFT's
+merge_and_unload) is added tensor by tensor while the checkpoint is
+streamed to sharded safetensors; the resident base weights are never
+modified, so nothing has to be reverted between adapters.
+
+Usage:
+    python save_models.py
+    python save_models.py --batch --workers 2 --device cuda:6 cuda:7 --dtype bfloat16
+    python save_models.py --batch --device cpu
 """""
+import argparse
+import multiprocessing
+import os
+import time
+
+import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel
 
@@ -39,9 +56,10 @@ bias_to_subreddit = {
 with open("../hugging_access_token.txt", "r") as file:
     access_token = file.read().strip()
 
+model_id = "unsloth/Phi-3-mini-4k-instruct"
+lora_id = "HU-Berlin-ML-Internal/opiniongpt-phi3-{adapter}"
+
 def save_models():
-    model_id = "unsloth/Phi-3-mini-4k-instruct"
-    lora_id = "HU-Berlin-ML-Internal/opiniongpt-phi3-{adapter}"
     device = "cuda:7"
 
     for adapter in adapters:
@@ -69,6 +87,107 @@ def save_models():
         merged_model.save_pretrained(save_path)
         print(f"Saved model for adapter: {adapter}")
 
+
+@torch.no_grad()
+def iter_with_delta(state, factors, device):
+    """
+    Yield (name, tensor) of base + adapter delta. Untouched tensors are the
+    resident ones; touched tensors are new, one at a time.
+    """
+    from lora_merge import module_prefix
+
+    deltas = {}
+    for module, (a, b, scaling) in factors.items():
+        name = module[len(module_prefix):] if module.startswith(module_prefix) else module
+        deltas[f"{name}.weight"] = (a, b, scaling)
+    missing = set(deltas) - set(state)
+    if missing:
+        raise ValueError(f"Adapter targets unknown weights, e.g. {sorted(missing)[0]}")
+
+    seen = set()
+    for name, weight in state.items():
+        # Tied weights are stored once, like save_pretrained does
+        if weight.data_ptr() in seen:
+            continue
+        seen.add(weight.data_ptr())
+        if name not in deltas:
+            yield name, weight
+            continue
+        a, b, scaling = deltas[name]
+        # Same operations as PEFT's get_delta_weight (upcast for half precision)
+        delta = (b.to(device, torch.float32) @ a.to(device, torch.float32)) * scaling
+        yield name, weight + delta.to(weight.dtype)
+
+
+def export_adapters(adapter_names, device, dtype, max_shard_size):
+    """
+    Batch export: one base model load for all given adapters.
+    """
+    from linear_merge import write_sharded
+    from lora_merge import load_lora
+
+    os.environ.setdefault("HUGGING_FACE_HUB_TOKEN", access_token)
+    start_time = time.time()
+    base = AutoModelForCausalLM.from_pretrained(model_id, token=access_token, torch_dtype=dtype).to(device)
+    base.config.torch_dtype = dtype
+    state = base.state_dict()
+    print(f"[INFO] Loaded base model on {device} in {time.time() - start_time:.1f}s.")
+
+    for adapter in adapter_names:
+        start_time = time.time()
+        factors, _ = load_lora(lora_id.format(adapter=adapter))
+        save_path = f"phi3_{adapter}"
+        write_sharded(
+            ((name, tensor.cpu()) for name, tensor in iter_with_delta(state, factors, device)),
+            save_path,
+            max_shard_size,
+        )
+        base.config.save_pretrained(save_path)
+        if base.generation_config is not None:
+            base.generation_config.save_pretrained(save_path)
+        print(f"[INFO] Saved model for adapter {adapter} on {device} in {time.time() - start_time:.1f}s.")
+
+
+def save_models_batch(devices, workers, dtype, max_shard_size):
+    """
+    Split the adapters over worker processes (round-robin over the devices).
+    """
+    workers = max(1, min(workers, len(adapters)))
+    if workers == 1:
+        export_adapters(adapters, devices[0], dtype, max_shard_size)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = []
+    for i in range(workers):
+        process = ctx.Process(
+            target=export_adapters,
+            args=(adapters[i::workers], devices[i % len(devices)], dtype, max_shard_size),
+        )
+        process.start()
+        processes.append(process)
+    failed = 0
+    for process in processes:
+        process.join()
+        failed += process.exitcode != 0
+    if failed:
+        raise SystemExit(f"[ERROR] {failed} export worker(s) failed, see the output above.")
+
+
 if __name__ == "__main__":
-    save_models()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", action="store_true", help="Load the base model once and stream every adapter merge to disk")
+    parser.add_argument("--workers", type=int, default=1, help="Number of export processes (--batch only)")
+    parser.add_argument("--device", nargs="+", default=["cuda:7"], help="Devices for the workers, e.g. cpu or cuda:6 cuda:7 (--batch only)")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"], default="float32", help="Dtype of the saved weights (--batch only)")
+    parser.add_argument("--max-shard-size-gb", type=float, default=5, help="Maximum size of one safetensors shard (--batch only)")
+    args = parser.parse_args()
+
+    if args.batch:
+        from linear_merge import dtypes
+        start_time = time.time()
+        save_models_batch(args.device, args.workers, dtypes[args.dtype], int(args.max_shard_size_gb * 1024 ** 3))
+        print(f"[INFO] Exported {len(adapters)} models in {(time.time() - start_time) / 60:.1f} min.")
+    else:
+        save_models()
     print("Done saving model + adapter configurations.")
@@ -0,0 +1,462 @@
+"""""
+This module enables adaptive hyperparameter search over merge
+configurations: successive halving and a model-based (TPE) optimiser.
+
+Successive halving: all configurations are first evaluated on a small
+stratified slice of the prompts; only the best 1/eta of them move on to
+the next rung, which uses eta times more prompts, until the last rung
+evaluates the survivors on the full dataset. The slices are nested (every
+slice is a prefix of one stratified order), so a larger rung only adds
+prompts.
+
+TPE (tree-structured Parzen estimator): after a few random points, the
+evaluated points are split into the best quantile and the rest, and the
+next point maximises the density ratio l(x) / g(x) of both groups, one
+dimension at a time. Parameters are conditional on the merge method.
+Points proposed for parallel evaluation count as observed with the worst
+score so far (constant liar), so a batch spreads out. The state is a JSON
+file, and a restarted search continues where it stopped.
+
+Scores are read from the robbie result files of each tag. A metric is
+either a numeric column (mean) or column=value (rate of that value, e.g.
+regard=negative).
+
+Usage (check on recorded grid search results, slices are simulated):
+    python search.py replay --results-dir ResponsibleNLP/result_grid_search --metric regard=negative --goal min
+"""""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+
+from warehouse import find_tag, flatten, iter_records, result_suffixes
+
+
+def stratified_order(strata, seed=42):
+    """
+    Order of the rows such that every prefix holds each stratum in
+    proportion to its size: rows are shuffled within their stratum and
+    interleaved by their relative position.
+    """
+    rng = random.Random(seed)
+    groups = {}
+    for i, stratum in enumerate(strata):
+        groups.setdefault(stratum, []).append(i)
+    keyed = []
+    for stratum in sorted(groups, key=str):
+        rows = groups[stratum]
+        rng.shuffle(rows)
+        keyed.extend(((j + 0.5) / len(rows), rng.random(), i) for j, i in enumerate(rows))
+    return [i for _, _, i in sorted(keyed)]
+
+
+def prefix_size(n, fraction):
+    return n if fraction >= 1 else max(1, math.ceil(n * fraction))
+
+
+def slice_rows(rows, fraction, strata_columns, seed=42, start_fraction=0):
+    """
+    Nested stratified slice of a list of dict rows (original order kept).
+    With start_fraction > 0 only the rows between the slices of
+    start_fraction and fraction are kept (disjoint chunks).
+    """
+    strata = [tuple(row.get(c) for c in strata_columns) for row in rows]
+    start = prefix_size(len(rows), start_fraction) if start_fraction > 0 else 0
+    keep = sorted(stratified_order(strata, seed)[start:prefix_size(len(rows), fraction)])
+    return [rows[i] for i in keep]
+
+
+def slice_dataset(dataset_dir, output_dir, fraction, strata_columns=("axis",), seed=42, start_fraction=0):
+    """
+    Copy of dataset_dir where every CSV/JSONL file is reduced to a nested
+    stratified slice (or the chunk after start_fraction); other files are
+    linked. Returns output_dir.
+    """
+    for dirpath, _, filenames in os.walk(dataset_dir):
+        target_dir = os.path.join(output_dir, os.path.relpath(dirpath, dataset_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(target_dir, filename)
+            if os.path.lexists(target):
+                os.remove(target)
+            if filename.endswith(".csv"):
+                with open(source, "r", encoding="utf-8", newline="") as f:
+                    reader = csv.DictReader(f)
+                    fieldnames, rows = reader.fieldnames, list(reader)
+                with open(target, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.DictWriter(f, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerows(slice_rows(rows, fraction, strata_columns, seed, start_fraction))
+            elif filename.endswith(".jsonl"):
+                with open(source, "r", encoding="utf-8") as f:
+                    rows = [json.loads(line) for line in f if line.strip()]
+                with open(target, "w", encoding="utf-8") as f:
+                    for row in slice_rows(rows, fraction, strata_columns, seed, start_fraction):
+                        f.write(json.dumps(row) + "\n")
+            else:
+                try:
+                    os.symlink(os.path.abspath(source), target)
+                except OSError:
+                    shutil.copy2(source, target)
+    return output_dir
+
+
+def rung_fractions(min_fraction, eta):
+    """
+    Dataset fraction of every rung, e.g. (1/9, 3) -> [1/9, 1/3, 1].
+    """
+    fractions = []
+    fraction = min_fraction
+    while fraction < 1 - 1e-9:
+        fractions.append(fraction)
+        fraction *= eta
+    return fractions + [1.0]
+
+
+def metric_value(record, metric):
+    """
+    Value of a metric for one flat record, None if it does not apply.
+    """
+    if "=" in metric:
+        column, value = metric.split("=", 1)
+        if record.get(column) is None:
+            return None
+        return 1.0 if str(record[column]) == value else 0.0
+    value = record.get(metric)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def tag_records(results_dir, known_tags=None):
+    """
+    Flat result records per tag below results_dir.
+    """
+    records = {}
+    for dirpath, _, filenames in os.walk(results_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith(result_suffixes):
+                continue
+            path = os.path.join(dirpath, filename)
+            tag = find_tag(os.path.relpath(path, results_dir), known_tags)
+            if tag is not None:
+                records.setdefault(tag, []).extend(flatten(r) for r in iter_records(path))
+    return records
+
+
+def score(records, metric):
+    values = [v for v in (metric_value(r, metric) for r in records) if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def tag_scores(results_dir, tags, metric):
+    records = tag_records(results_dir, set(tags))
+    return {tag: score(records.get(tag, []), metric) for tag in tags}
+
+
+class SuccessiveHalving:
+    """
+    Bookkeeping of a successive-halving search. `survivors` are the
+    candidates of the current rung; promote(scores) keeps the best
+    ceil(n / eta) of them. Candidates without a score (failed) are dropped.
+    """
+
+    def __init__(self, candidates, min_fraction=1 / 9, eta=3, goal="min"):
+        if goal not in ("min", "max"):
+            raise ValueError(f"Unsupported goal '{goal}', expected 'min' or 'max'")
+        self.candidates = list(candidates)
+        self.fractions = rung_fractions(min_fraction, eta)
+        self.eta = eta
+        self.goal = goal
+        self.survivors = list(self.candidates)
+        self.rung = 0
+        self.history = []
+
+    def done(self):
+        return self.rung >= len(self.fractions) or not self.survivors
+
+    @property
+    def fraction(self):
+        return self.fractions[self.rung]
+
+    def ranked(self, scores):
+        scored = [(scores[c], c) for c in self.survivors if scores.get(c) is not None]
+        # Stable: ties keep the candidate order
+        return sorted(scored, key=lambda item: item[0], reverse=self.goal == "max")
+
+    def promote(self, scores):
+        ranked = self.ranked(scores)
+        last = self.rung == len(self.fractions) - 1
+        n_keep = len(ranked) if last else max(1, math.ceil(len(ranked) / self.eta))
+        self.history.append({
+            "rung": self.rung,
+            "fraction": self.fraction,
+            "evaluated": len(self.survivors),
+            "scores": {c: scores.get(c) for c in self.survivors},
+        })
+        self.survivors = [c for _, c in ranked[:n_keep]]
+        self.rung += 1
+        return self.survivors
+
+    def best(self):
+        return self.survivors[0] if self.survivors else None
+
+    def cost(self):
+        """
+        Evaluated prompts relative to a full grid (all candidates on all prompts).
+        """
+        used = sum(rung["evaluated"] * rung["fraction"] for rung in self.history)
+        return used / len(self.candidates) if self.candidates else 0.0
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "fractions": self.fractions,
+                "eta": self.eta,
+                "goal": self.goal,
+                "best": self.best(),
+                "cost": self.cost(),
+                "history": self.history,
+            }, f, indent=2)
+
+
+def point_key(point):
+    return json.dumps(point, sort_keys=True)
+
+
+class TPESearch:
+    """
+    TPE over a conditional search space.
+    space: name -> list of choices, or {"low": a, "high": b} (optionally
+    "round": digits) for a float range.
+    conditions: value of the root dimension -> names of its active
+    parameters; dimensions that appear in no condition are always active.
+    """
+
+    def __init__(self, space, root, conditions, goal="min", n_startup=10, n_candidates=24,
+                 gamma=0.25, seed=42, state_path=None):
+        if goal not in ("min", "max"):
+            raise ValueError(f"Unsupported goal '{goal}', expected 'min' or 'max'")
+        self.space = space
+        self.root = root
+        self.conditions = conditions
+        self.goal = goal
+        self.n_startup = n_startup
+        self.n_candidates = n_candidates
+        self.gamma = gamma
+        self.seed = seed
+        self.state_path = state_path
+        self.observations = []
+        self.pending = []
+        conditional = {name for names in conditions.values() for name in names}
+        self.shared = [name for name in space if name != root and name not in conditional]
+        if state_path and os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            self.observations = state["observations"]
+            self.pending = state["pending"]
+            print(f"[INFO] Resuming TPE search with {len(self.observations)} observations "
+                  f"and {len(self.pending)} pending points from {state_path}.")
+
+    def save(self):
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"goal": self.goal, "observations": self.observations, "pending": self.pending}, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def active(self, root_value):
+        return [self.root] + self.shared + list(self.conditions.get(root_value, []))
+
+    def completed(self):
+        return len(self.observations)
+
+    def best(self):
+        scored = [o for o in self.observations if o["score"] is not None]
+        if not scored:
+            return None
+        pick = min if self.goal == "min" else max
+        return pick(scored, key=lambda o: o["score"])
+
+    def _sample_prior(self, name, rng):
+        spec = self.space[name]
+        if isinstance(spec, dict):
+            value = rng.uniform(spec["low"], spec["high"])
+            return round(value, spec["round"]) if "round" in spec else value
+        return spec[rng.randrange(len(spec))]
+
+    def _split(self):
+        """
+        Good and bad points; pending points get the worst score (constant liar).
+        """
+        scored = [(o["score"], o["point"]) for o in self.observations if o["score"] is not None]
+        if scored:
+            liar = max(s for s, _ in scored) if self.goal == "min" else min(s for s, _ in scored)
+            scored += [(liar, point) for point in self.pending]
+        ranked = [p for _, p in sorted(scored, key=lambda item: item[0], reverse=self.goal == "max")]
+        n_good = max(1, math.ceil(self.gamma * len(ranked)))
+        return ranked[:n_good], ranked[n_good:]
+
+    def _categorical(self, choices, values):
+        # Counts with one prior observation per choice
+        keys = [point_key(c) for c in choices]
+        counts = {k: 1.0 for k in keys}
+        for value in values:
+            if point_key(value) in counts:
+                counts[point_key(value)] += 1
+        total = sum(counts.values())
+        return [counts[k] / total for k in keys]
+
+    def _parzen(self, spec, values):
+        """
+        Gaussian kernels on the values plus a uniform prior component.
+        Returns (centres, sigma, weights); centre None is the prior.
+        """
+        width = spec["high"] - spec["low"]
+        sigma = width / max(1.0, math.sqrt(len(values)))
+        centres = [None] + list(values)
+        return centres, sigma, [1.0 / len(centres)] * len(centres)
+
+    def _density(self, spec, model, x):
+        centres, sigma, weights = model
+        width = spec["high"] - spec["low"]
+        density = 0.0
+        for centre, weight in zip(centres, weights):
+            if centre is None:
+                density += weight / width
+            else:
+                density += weight * math.exp(-0.5 * ((x - centre) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+        return density
+
+    def _propose_dimension(self, name, good, bad, rng):
+        spec = self.space[name]
+        good_values = [p[name] for p in good if name in p]
+        bad_values = [p[name] for p in bad if name in p]
+        if isinstance(spec, dict):
+            l_model, g_model = self._parzen(spec, good_values), self._parzen(spec, bad_values)
+            candidates = []
+            for _ in range(self.n_candidates):
+                centre = rng.choice(l_model[0])
+                x = rng.uniform(spec["low"], spec["high"]) if centre is None else rng.gauss(centre, l_model[1])
+                x = min(spec["high"], max(spec["low"], x))
+                candidates.append(round(x, spec["round"]) if "round" in spec else x)
+            return max(candidates, key=lambda x: self._density(spec, l_model, x) / max(self._density(spec, g_model, x), 1e-12))
+        l_probs, g_probs = self._categorical(spec, good_values), self._categorical(spec, bad_values)
+        candidates = rng.choices(range(len(spec)), weights=l_probs, k=self.n_candidates)
+        return spec[max(candidates, key=lambda i: l_probs[i] / g_probs[i])]
+
+    def _unseen_grid_point(self, seen, rng):
+        """
+        A random point that is neither evaluated nor pending, drawn from the
+        enumerated space (lists only), or None if every point is taken.
+        """
+        if any(isinstance(self.space[name], dict) for name in self.space):
+            return None
+        points = []
+        for root_value in self.space[self.root]:
+            names = self.active(root_value)[1:]
+            for values in itertools.product(*(self.space[name] for name in names)):
+                point = {self.root: root_value, **dict(zip(names, values))}
+                if point_key(point) not in seen:
+                    points.append(point)
+        return rng.choice(points) if points else None
+
+    def propose(self):
+        """
+        Next point to evaluate, never one that is evaluated or pending; it
+        stays pending until observe(). None if no such point is left (e.g.
+        every point of a discrete space has been proposed).
+        """
+        rng = random.Random(f"{self.seed}-{len(self.observations)}-{len(self.pending)}")
+        seen = {point_key(o["point"]) for o in self.observations} | {point_key(p) for p in self.pending}
+        model_based = len(self.observations) + len(self.pending) >= self.n_startup and self.best() is not None
+        for attempt in range(100):
+            # Fall back to random points if the model keeps proposing seen ones
+            if model_based and attempt < 50:
+                good, bad = self._split()
+                point = {self.root: self._propose_dimension(self.root, good, bad, rng)}
+                for name in self.active(point[self.root])[1:]:
+                    # Conditional parameters are modelled on the points of the same method
+                    same = [p for p in good if p.get(self.root) == point[self.root]] if name not in self.shared else good
+                    other = [p for p in bad if p.get(self.root) == point[self.root]] if name not in self.shared else bad
+                    point[name] = self._propose_dimension(name, same, other, rng)
+            else:
+                point = {self.root: self._sample_prior(self.root, rng)}
+                for name in self.active(point[self.root])[1:]:
+                    point[name] = self._sample_prior(name, rng)
+            if point_key(point) not in seen:
+                break
+        else:
+            # Redraws kept hitting taken points: pick from the rest directly
+            point = self._unseen_grid_point(seen, rng)
+            if point is None:
+                return None
+        self.pending.append(point)
+        self.save()
+        return point
+
+    def observe(self, point, score):
+        """
+        Record the score of a proposed point (None for a failed evaluation).
+        """
+        key = point_key(point)
+        self.pending = [p for p in self.pending if point_key(p) != key]
+        self.observations.append({"point": point, "score": score})
+        self.save()
+
+
+def replay(records, metric, goal="min", min_fraction=1 / 9, eta=3, strata_columns=("axis",), seed=42):
+    """
+    Successive halving on recorded full results: a rung scores every tag
+    on the same nested stratified prefix of its records. Returns the
+    halving and the best tag of the full grid.
+    """
+    tags = sorted(records)
+    full = {tag: score(records[tag], metric) for tag in tags}
+    halving = SuccessiveHalving(tags, min_fraction, eta, goal)
+    orders = {}
+    while not halving.done():
+        scores = {}
+        for tag in halving.survivors:
+            rows = records[tag]
+            if len(rows) not in orders:
+                strata = [tuple(row.get(c) for c in strata_columns) for row in rows]
+                orders[len(rows)] = stratified_order(strata, seed)
+            prefix = orders[len(rows)][:prefix_size(len(rows), halving.fraction)]
+            scores[tag] = score([rows[i] for i in prefix], metric)
+        halving.promote(scores)
+    scored = [(full[t], t) for t in tags if full[t] is not None]
+    grid_best = sorted(scored, key=lambda item: item[0], reverse=goal == "max")[0][1] if scored else None
+    return halving, grid_best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser("replay", help="Simulate successive halving on recorded results")
+    replay_parser.add_argument("--results-dir", required=True, help="Result directory of a full grid search")
+    replay_parser.add_argument("--metric", required=True, help="Numeric column or column=value")
+    replay_parser.add_argument("--goal", choices=["min", "max"], default="min", help="Minimise or maximise the metric")
+    replay_parser.add_argument("--eta", type=float, default=3, help="Reduction factor per rung")
+    replay_parser.add_argument("--min-fraction", type=float, default=1 / 9, help="Dataset fraction of the first rung")
+    replay_parser.add_argument("--strata", nargs="+", default=["axis"], help="Columns to stratify the slices by")
+    args = parser.parse_args()
+
+    records = tag_records(args.results_dir)
+    if not records:
+        raise SystemExit(f"[ERROR] No result files with tags found in {args.results_dir}")
+    halving, grid_best = replay(records, args.metric, args.goal, args.min_fraction, args.eta, args.strata)
+    for rung in halving.history:
+        print(f"[INFO] Rung {rung['rung']}: {rung['evaluated']} configurations on {rung['fraction']:.1%} of the prompts")
+    print(f"Best (successive halving): {halving.best()}")
+    print(f"Best (full grid):          {grid_best}")
+    print(f"Prompt evaluations: {halving.cost():.1%} of the full grid")
+    if halving.best() != grid_best:
+        raise SystemExit("[ERROR] Successive halving and the full grid disagree")
@@ -0,0 +1,308 @@
+"""""
+This module enables sequential evaluation with confidence-interval
+stopping instead of scoring every model on every prompt.
+
+The prompts are put in one stratified random order (by a group column,
+e.g. the HolisticBiasR axis) and split into disjoint chunks of growing
+size (e.g. 5%, 5%, 10%, 20%, ... of the dataset). An evaluation step runs
+robbie.eval chunk by chunk. After every chunk the per-group estimates of
+the metric are updated with confidence intervals: Wilson score intervals
+for rates (column=value, e.g. regard=negative) and mean +- z standard
+errors for numeric columns (e.g. a toxicity score). The evaluation stops
+once
+- precision: the interval of the overall estimate and of every group with
+  at least min_group_size prompts is at most +-precision wide, or
+- separation: the overall interval no longer overlaps the interval of a
+  reference model that was evaluated on the full dataset.
+
+Checking the intervals after every chunk is a repeated test: with the
+plain 95% z, the chance that some look stops on a misleading interval is
+higher than 5%. The intervals therefore use a Bonferroni-corrected z for
+the planned number of looks (one per chunk), so the stopping rule keeps
+the requested confidence overall.
+
+All models see the same chunks in the same order. The chunks live next
+to the dataset (<dataset_dir>_seq/chunkN) and the results of every chunk
+in <results_dir>_seq/chunkN; <results_dir>_seq/<tag>.json records how many
+prompts were needed, why the evaluation stopped, and the final estimates.
+"""""
+
+import csv
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from dataclasses import replace
+from statistics import NormalDist
+
+from search import metric_value, slice_dataset, tag_records
+from sweep import run_step
+
+
+def wilson_interval(successes, n, z=1.96):
+    """
+    Estimate and Wilson score interval of a rate.
+    """
+    if n == 0:
+        return None, 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return p, max(0.0, centre - half), min(1.0, centre + half)
+
+
+def mean_interval(total, total_squares, n, z=1.96):
+    """
+    Estimate and normal interval (mean +- z standard errors) of a numeric
+    metric from its running sum and sum of squares.
+    """
+    if n == 0:
+        return None, -math.inf, math.inf
+    mean = total / n
+    if n < 2:
+        return mean, -math.inf, math.inf
+    variance = max(0.0, (total_squares - n * mean * mean) / (n - 1))
+    half = z * math.sqrt(variance / n)
+    return mean, mean - half, mean + half
+
+
+def look_z(confidence, looks):
+    """
+    z of a two-sided interval at `confidence`, Bonferroni-corrected for
+    `looks` repeated checks.
+    """
+    return NormalDist().inv_cdf(1 - (1 - confidence) / (2 * max(1, looks)))
+
+
+def finite(value):
+    return value if value is None or math.isfinite(value) else None
+
+
+def chunk_fractions(initial=0.05, growth=2):
+    """
+    Cumulative dataset fraction after every chunk, e.g. 0.05 -> [0.05, 0.1, 0.2, 0.4, 0.8, 1].
+    """
+    fractions = [initial]
+    while fractions[-1] < 1 - 1e-9:
+        fractions.append(min(1.0, fractions[-1] * growth))
+    return fractions
+
+
+def dataset_group_sizes(dataset_dir, column):
+    """
+    Rows per value of `column` over all CSV/JSONL files of a dataset
+    (rows without the column are counted under None).
+    """
+    sizes = {}
+    for dirpath, _, filenames in os.walk(dataset_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(".csv"):
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    rows = list(csv.DictReader(f))
+            elif filename.endswith(".jsonl"):
+                with open(path, "r", encoding="utf-8") as f:
+                    rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                continue
+            for row in rows:
+                group = str(row[column]) if column and column in row else None
+                sizes[group] = sizes.get(group, 0) + 1
+    return sizes
+
+
+class GroupEstimates:
+    """
+    Running sums of a metric overall and per group (key None).
+    Rates (column=value) get Wilson intervals, numeric columns mean +- z
+    standard errors.
+    """
+
+    def __init__(self, metric, group_column=None, z=1.96):
+        self.metric = metric
+        self.group_column = group_column
+        self.z = z
+        self.is_rate = "=" in metric
+        self.sums = {}
+        self.squares = {}
+        self.counts = {}
+
+    @property
+    def n(self):
+        return self.counts.get(None, 0)
+
+    def update(self, records):
+        for record in records:
+            value = metric_value(record, self.metric)
+            if value is None:
+                continue
+            keys = [None]
+            if self.group_column and record.get(self.group_column) is not None:
+                keys.append(str(record[self.group_column]))
+            for key in keys:
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.sums[key] = self.sums.get(key, 0.0) + value
+                self.squares[key] = self.squares.get(key, 0.0) + value * value
+
+    def groups(self):
+        return sorted(k for k in self.counts if k is not None)
+
+    def interval(self, group=None):
+        total, n = self.sums.get(group, 0.0), self.counts.get(group, 0)
+        if self.is_rate:
+            return wilson_interval(total, n, self.z)
+        return mean_interval(total, self.squares.get(group, 0.0), n, self.z)
+
+    def report(self):
+        def entry(group=None):
+            estimate, low, high = self.interval(group)
+            return {"n": self.counts.get(group, 0), "estimate": estimate, "low": finite(low), "high": finite(high)}
+
+        return {
+            "overall": entry(),
+            "groups": {g: entry(g) for g in self.groups()},
+        }
+
+
+class SequentialEval:
+    """
+    Wraps robbie.eval steps so that they evaluate chunk by chunk and stop
+    early (see module docstring). `precision` is a half-width in units of
+    the metric, `confidence` holds over all looks. `service` (EvalService)
+    runs the chunks in long-lived workers.
+    """
+
+    def __init__(self, metric, group_column="axis", precision=0.02, reference=None,
+                 initial_fraction=0.05, growth=2, min_group_size=100, confidence=0.95, seed=42, service=None):
+        self.metric = metric
+        self.group_column = group_column
+        self.precision = precision
+        self.initial_fraction = initial_fraction
+        self.growth = growth
+        self.min_group_size = min_group_size
+        self.confidence = confidence
+        # One look per chunk
+        self.z = look_z(confidence, len(chunk_fractions(initial_fraction, growth)))
+        self.seed = seed
+        self.service = service
+        self.reference = None
+        self._lock = threading.Lock()
+        if reference is not None:
+            # (results dir, tag) of a model evaluated on the full dataset
+            reference_dir, reference_tag = reference
+            records = tag_records(reference_dir, {reference_tag}).get(reference_tag, [])
+            if not records:
+                raise ValueError(f"No results of reference '{reference_tag}' in {reference_dir}")
+            # Evaluated once on the full dataset: no correction for repeated looks
+            estimates = GroupEstimates(metric, z=look_z(confidence, 1))
+            estimates.update(records)
+            self.reference = estimates.interval()
+            print(f"[INFO] Reference {reference_tag}: {self.reference[0]:.4f} "
+                  f"[{self.reference[1]:.4f}, {self.reference[2]:.4f}]")
+
+    def prepare_chunks(self, dataset_dir):
+        """
+        Disjoint stratified chunks of the dataset (built once, shared by
+        all jobs and processes). Returns the chunk directories.
+        """
+        fractions = chunk_fractions(self.initial_fraction, self.growth)
+        chunk_root = f"{dataset_dir.rstrip(os.sep)}_seq"
+        chunk_dirs = []
+        with self._lock:
+            for k, fraction in enumerate(fractions):
+                chunk_dir = os.path.join(chunk_root, f"chunk{k}")
+                chunk_dirs.append(chunk_dir)
+                if os.path.isdir(chunk_dir):
+                    continue
+                start = fractions[k - 1] if k else 0
+                tmp_dir = f"{chunk_dir}.tmp{os.getpid()}"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                slice_dataset(dataset_dir, tmp_dir, fraction, [self.group_column], self.seed, start)
+                try:
+                    os.rename(tmp_dir, chunk_dir)
+                except OSError:
+                    # Another process built the same chunk meanwhile
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        return chunk_dirs
+
+    def stop_reason(self, estimates, required_groups):
+        _, low, high = estimates.interval()
+        if self.reference is not None and (high < self.reference[1] or low > self.reference[2]):
+            return "separation"
+        if (high - low) / 2 > self.precision:
+            return None
+        for group in required_groups:
+            _, low, high = estimates.interval(group)
+            if estimates.counts.get(group, 0) == 0 or (high - low) / 2 > self.precision:
+                return None
+        return "precision"
+
+    def wrap(self, step):
+        """
+        Run a robbie.eval step chunk by chunk with early stopping.
+        """
+        cmd = list(step.cmd)
+        dataset_index = cmd.index("--dataset-dir") + 1
+        results_index = cmd.index("--result-dir") + 1
+        tag = os.path.basename(cmd[cmd.index("--model-id") + 1].rstrip("/"))
+        cwd = step.cwd or "."
+
+        def run(step, device):
+            dataset_dir, results_dir = cmd[dataset_index], cmd[results_index]
+            chunk_dirs = self.prepare_chunks(os.path.join(cwd, dataset_dir))
+            sizes = dataset_group_sizes(os.path.join(cwd, dataset_dir), self.group_column)
+            required = [g for g, size in sizes.items() if g is not None and size >= self.min_group_size]
+            total = sum(sizes.values()) or None
+            estimates = GroupEstimates(self.metric, self.group_column, self.z)
+            reason, used, start_time = "exhausted", 0, time.time()
+
+            for k, chunk_dir in enumerate(chunk_dirs):
+                chunk_dataset = os.path.join(f"{dataset_dir.rstrip(os.sep)}_seq", f"chunk{k}")
+                chunk_results = os.path.join(f"{results_dir.rstrip(os.sep)}_seq", f"chunk{k}")
+                os.makedirs(os.path.join(cwd, chunk_results), exist_ok=True)
+                chunk_cmd = list(cmd)
+                chunk_cmd[dataset_index], chunk_cmd[results_index] = chunk_dataset, chunk_results
+                log_path = f"{step.log_path}.chunk{k}" if step.log_path else None
+                chunk_step = replace(step, cmd=chunk_cmd, log_path=log_path, func=None)
+                if self.service is not None:
+                    chunk_step = self.service.wrap(chunk_step)
+                run_step(chunk_step, device)
+
+                records = tag_records(os.path.join(cwd, chunk_results), {tag}).get(tag, [])
+                estimates.update(records)
+                if k == 0 and required and not estimates.groups():
+                    print(f"[WARNING] Results of {tag} have no '{self.group_column}' column, "
+                          f"stopping on the overall estimate only.")
+                    required = []
+                used += sum(dataset_group_sizes(chunk_dir, self.group_column).values()) or len(records)
+                reason = self.stop_reason(estimates, required)
+                if reason is not None:
+                    break
+            reason = reason or "exhausted"
+
+            summary = {
+                "tag": tag,
+                "metric": self.metric,
+                "stopped": reason,
+                "chunks": k + 1,
+                "prompts_used": used,
+                "prompts_total": total,
+                "precision": self.precision,
+                "confidence": self.confidence,
+                "z": round(self.z, 4),
+                "interval": "wilson" if estimates.is_rate else "mean",
+                "reference": self.reference,
+                "elapsed": round(time.time() - start_time, 3),
+                **estimates.report(),
+            }
+            summary_path = os.path.join(cwd, f"{results_dir.rstrip(os.sep)}_seq", f"{tag}.json")
+            with open(summary_path, "w") as f:
+                json.dump(summary, f, indent=2)
+            share = f" of {total} ({used / total:.1%})" if total else ""
+            print(f"[INFO] {tag}: stopped after {used} prompts{share} ({reason}), "
+                  f"{self.metric} = {summary['overall']['estimate']}")
+
+        return replace(step, func=run)
@@ -0,0 +1,613 @@
+"""""
+This script enables batched serving of the Phi3 model with OpinionGPT
+adapters (see inference.py for the interactive single-prompt loop).
+
+Requests go into a queue. A batching thread takes the pending requests,
+groups them up to a batch size and a token budget (prompt tokens plus
+max_new_tokens per request) and runs one generate call per adapter group.
+With --mixed-adapters the whole batch runs in one generate call instead:
+PEFT computes the shared base layers once and adds each row's own LoRA
+delta (adapter_names=...), so mixed-bias traffic is not serialised.
+Front-ends:
+- stdin/stdout JSON lines (default)
+- a local HTTP server (POST /generate, GET /stats) with --http PORT
+
+Request: {"id": ..., "instruction": ..., "adapter": "women", "max_new_tokens": 64}
+Response: {"id": ..., "output": ..., "adapter": ..., "latency": ..., "new_tokens": ...}
+
+Every prompt starts with the "### r/{subreddit} Question:" header. Its
+past key/values are computed once per (adapter, subreddit) and kept in a
+prefix cache; generation starts from the cached state. Rows are laid out
+as [header][padding][rest of the prompt] with the padding masked out, so
+positions are the same as for an unpadded prompt. Entries of an adapter
+are dropped when the adapter is reloaded or removed.
+
+Throughput and latency percentiles are printed to stderr on exit
+(and returned by GET /stats).
+
+With --adapter-pool N the adapters are loaded on first use into a pool
+of at most N resident adapters (LRU, see AdapterPool in inference.py);
+a batch needing more adapters is run in several parts. Start-up time,
+adapter cold starts and resident memory are part of the report.
+
+--synthetic N sends N generated requests spread round-robin over the
+loaded adapters, e.g. to compare mixed-bias with single-adapter throughput.
+
+Usage:
+    python serving.py --adapters women men --device cuda:2 < requests.jsonl
+    python serving.py --adapters women men liberal --mixed-adapters --synthetic 64
+    python serving.py --http 8000 --adapters women men
+    python serving.py --model sshleifer/tiny-gpt2 --adapters --device cpu < requests.jsonl
+"""""
+
+import argparse
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from inference import (
+    AdapterPool,
+    adapter_registry,
+    adapters,
+    bias_to_subreddit,
+    header_template,
+    instruction_template,
+    load_model,
+    model_id,
+)
+
+# Same sampling as the interactive loop
+default_generation_kwargs = dict(
+    min_new_tokens=10,
+    no_repeat_ngram_size=3,
+    do_sample=True,
+    temperature=0.8,
+)
+
+# Header used when a request names no adapter (base model)
+default_subreddit = "AskALiberal"
+
+# PEFT's name for "no adapter" in mixed batches
+base_adapter_name = "__base__"
+
+
+@dataclass
+class Request:
+    instruction: str
+    adapter: str = None
+    max_new_tokens: int = 256
+    id: object = None
+    subreddit: str = None
+    arrival: float = field(default_factory=time.time)
+    input_ids: list = None
+    output: str = None
+    new_tokens: int = 0
+    error: str = None
+    latency: float = None
+    callback: object = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def prompt(self):
+        return instruction_template.format(subreddit=self.subreddit, instruction=self.instruction)
+
+    def cost(self):
+        return len(self.input_ids) + self.max_new_tokens
+
+    def response(self):
+        result = {
+            "id": self.id,
+            "adapter": self.adapter,
+            "output": self.output,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "new_tokens": self.new_tokens,
+        }
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, min(len(values), math.ceil(p / 100 * len(values))))
+    return round(values[rank - 1], 4)
+
+
+class ServingStats:
+    """
+    Latencies and generated tokens of finished requests.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.latencies = []
+        self.new_tokens = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.prefix_tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def record_batch(self, requests):
+        with self._lock:
+            self.batches += 1
+            self.batched_requests += len(requests)
+            for request in requests:
+                self.latencies.append(request.latency)
+                self.new_tokens += request.new_tokens
+
+    def report(self):
+        with self._lock:
+            elapsed = max(time.time() - self.start, 1e-9)
+            return {
+                "requests": len(self.latencies),
+                "elapsed": round(elapsed, 3),
+                "requests_per_s": round(len(self.latencies) / elapsed, 3),
+                "tokens_per_s": round(self.new_tokens / elapsed, 3),
+                "mean_batch_size": round(self.batched_requests / self.batches, 2) if self.batches else 0,
+                "latency_p50": percentile(self.latencies, 50),
+                "latency_p90": percentile(self.latencies, 90),
+                "latency_p99": percentile(self.latencies, 99),
+                "prefix_tokens_saved": self.prefix_tokens_saved,
+            }
+
+
+def adapter_version(model, adapter):
+    """
+    Identity of the currently loaded adapter weights (changes on reload).
+    """
+    peft_config = getattr(model, "peft_config", None)
+    if adapter is None or peft_config is None:
+        return None
+    config = peft_config.get(adapter)
+    return id(config) if config is not None else None
+
+
+class PrefixCache:
+    """
+    Past key/values of the instruction header per (adapter, subreddit),
+    in the legacy format (tuple of (key, value) per layer, batch size 1).
+    Least recently used entries are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def evict_adapter(self, adapter):
+        for key in [k for k in self.entries if k[0] == adapter]:
+            del self.entries[key]
+        self.versions.pop(adapter, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.versions.clear()
+
+    def get(self, model, tokenizer, adapter, subreddit, mixed=False):
+        """
+        (header token ids, past key/values). The adapter must be active,
+        unless mixed=True (then it is selected per call).
+        """
+        import torch
+
+        version = adapter_version(model, adapter)
+        if self.versions.get(adapter, version) != version:
+            self.evict_adapter(adapter)
+        self.versions[adapter] = version
+
+        key = (adapter, subreddit)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        ids = tokenizer(header_template.format(subreddit=subreddit)).input_ids
+        kwargs = {"adapter_names": [adapter or base_adapter_name]} if mixed else {}
+        with torch.no_grad():
+            past = model(input_ids=torch.tensor([ids], device=model.device), use_cache=True, **kwargs).past_key_values
+        if hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        self.entries[key] = (ids, past)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return self.entries[key]
+
+
+def stack_past(pasts, width):
+    """
+    Stack per-row past key/values, zero-padded to `width` positions.
+    Returns a Cache object where transformers provides one.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    layers = []
+    for layer in zip(*pasts):
+        keys = [F.pad(k, (0, 0, 0, width - k.shape[2])) for k, _ in layer]
+        values = [F.pad(v, (0, 0, 0, width - v.shape[2])) for _, v in layer]
+        layers.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+    layers = tuple(layers)
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return layers
+    return DynamicCache.from_legacy_cache(layers)
+
+
+class BatchServer:
+    """
+    Request queue plus a background thread doing dynamic batching.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_batch_tokens=4096, max_wait=0.01,
+                 generation_kwargs=None, prefix_cache=None, mixed_adapters=False, pool=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.generation_kwargs = dict(default_generation_kwargs if generation_kwargs is None else generation_kwargs)
+        self.prefix_cache = prefix_cache
+        self.mixed_adapters = mixed_adapters
+        if mixed_adapters:
+            from peft import PeftModel
+            if not hasattr(PeftModel, "_enable_peft_forward_hooks"):
+                raise ValueError("Mixed-adapter batches need a PEFT version with adapter_names support")
+        self.pool = pool
+        if pool is not None and prefix_cache is not None:
+            pool.on_evict.append(prefix_cache.evict_adapter)
+        self.stats = ServingStats()
+        self.queue = queue.Queue()
+        self._carry = None
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        if request.subreddit is None:
+            request.subreddit = bias_to_subreddit[request.adapter] if request.adapter else default_subreddit
+        request.input_ids = self.tokenizer(request.prompt()).input_ids
+        self.queue.put(request)
+        return request
+
+    def generate(self, instruction, adapter=None, max_new_tokens=256):
+        """
+        Blocking convenience call for a single prompt.
+        """
+        request = self.submit(Request(instruction, adapter=adapter, max_new_tokens=max_new_tokens))
+        request.done.wait()
+        return request
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        """
+        Block for one request, then add pending ones until the batch size,
+        the token budget or the wait time is reached.
+        """
+        first = self._carry if self._carry is not None else self.queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        batch, tokens = [first], first.cost()
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self.queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            if tokens + request.cost() > self.max_batch_tokens:
+                self._carry = request
+                break
+            batch.append(request)
+            tokens += request.cost()
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.done.is_set():
+                        request.error = f"{type(e).__name__}: {e}"
+                        self._finish(request)
+            self.stats.record_batch(batch)
+
+    def report(self):
+        report = self.stats.report()
+        if self.pool is not None:
+            report["adapter_pool"] = self.pool.stats()
+        return report
+
+    def _chunks(self, batch):
+        """
+        Split a batch so that each part needs at most pool capacity adapters.
+        """
+        if self.pool is None:
+            return [batch]
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.adapter, []).append(request)
+        chunks, names = [[]], [set()]
+        for adapter, group in groups.items():
+            if adapter is not None and len(names[-1]) >= self.pool.capacity:
+                chunks.append([])
+                names.append(set())
+            chunks[-1].extend(group)
+            if adapter is not None:
+                names[-1].add(adapter)
+        return chunks
+
+    def _run_batch(self, batch):
+        for chunk in self._chunks(batch):
+            if self.pool is not None:
+                self.model = self.pool.acquire(r.adapter for r in chunk)
+            self._run_chunk(chunk)
+
+    def _run_chunk(self, batch):
+        # A lazily loaded model is a plain base model until the first adapter
+        if self.mixed_adapters and hasattr(self.model, "_enable_peft_forward_hooks"):
+            self._generate(batch, adapter_names=[r.adapter or base_adapter_name for r in batch])
+            return
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.adapter, []).append(request)
+        for adapter, group in groups.items():
+            if adapter is not None:
+                self.model.set_adapter(adapter)
+                self._generate(group)
+            elif hasattr(self.model, "disable_adapter"):
+                with self.model.disable_adapter():
+                    self._generate(group)
+            else:
+                self._generate(group)
+
+    def _pad(self, sequences):
+        """
+        Left-pad token lists into input_ids + attention_mask tensors.
+        """
+        import torch
+
+        width = max(len(s) for s in sequences)
+        pad = self.tokenizer.pad_token_id
+        input_ids = [[pad] * (width - len(s)) + list(s) for s in sequences]
+        attention_mask = [[0] * (width - len(s)) + [1] * len(s) for s in sequences]
+        return (torch.tensor(input_ids, device=self.model.device),
+                torch.tensor(attention_mask, device=self.model.device))
+
+    def _with_prefix(self, group, mixed=False):
+        """
+        input_ids, attention_mask and past key/values with the cached
+        headers, or None if a prompt does not start with its header tokens.
+        """
+        import torch
+
+        prefixes = [
+            self.prefix_cache.get(self.model, self.tokenizer, r.adapter, r.subreddit, mixed=mixed)
+            for r in group
+        ]
+        if any(r.input_ids[:len(ids)] != ids or len(r.input_ids) == len(ids) for r, (ids, _) in zip(group, prefixes)):
+            return None
+        pad = self.tokenizer.pad_token_id
+        prefix_width = max(len(ids) for ids, _ in prefixes)
+        rest_width = max(len(r.input_ids) - len(ids) for r, (ids, _) in zip(group, prefixes))
+        input_ids, attention_mask = [], []
+        for request, (ids, _) in zip(group, prefixes):
+            rest = request.input_ids[len(ids):]
+            gap = prefix_width - len(ids) + rest_width - len(rest)
+            input_ids.append(ids + [pad] * gap + rest)
+            attention_mask.append([1] * len(ids) + [0] * gap + [1] * len(rest))
+        with self.stats._lock:
+            self.stats.prefix_tokens_saved += sum(len(ids) for ids, _ in prefixes)
+        return (torch.tensor(input_ids, device=self.model.device),
+                torch.tensor(attention_mask, device=self.model.device),
+                stack_past([past for _, past in prefixes], prefix_width))
+
+    def _generate(self, group, adapter_names=None):
+        import torch
+
+        past_key_values = None
+        prepared = self._with_prefix(group, adapter_names is not None) if self.prefix_cache is not None else None
+        if prepared is not None:
+            input_ids, attention_mask, past_key_values = prepared
+        else:
+            input_ids, attention_mask = self._pad([r.input_ids for r in group])
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=max(r.max_new_tokens for r in group),
+                pad_token_id=self.tokenizer.pad_token_id,
+                **({"adapter_names": adapter_names} if adapter_names else {}),
+                **self.generation_kwargs,
+            )
+        for request, row in zip(group, output[:, input_ids.shape[1]:].tolist()):
+            self._complete(request, row)
+
+    def _complete(self, request, new_ids):
+        new_ids = new_ids[:request.max_new_tokens]
+        if self.tokenizer.eos_token_id in new_ids:
+            new_ids = new_ids[:new_ids.index(self.tokenizer.eos_token_id)]
+        request.new_tokens = len(new_ids)
+        request.output = self.tokenizer.decode(new_ids, skip_special_tokens=True)
+        self._finish(request)
+
+    def _finish(self, request):
+        request.latency = time.time() - request.arrival
+        request.done.set()
+        if request.callback is not None:
+            request.callback(request)
+
+
+def parse_request(data, max_new_tokens):
+    return Request(
+        instruction=data["instruction"],
+        adapter=data.get("adapter"),
+        max_new_tokens=int(data.get("max_new_tokens", max_new_tokens)),
+        id=data.get("id"),
+        subreddit=data.get("subreddit"),
+    )
+
+
+def serve_jsonl(server, infile, outfile, max_new_tokens=256):
+    """
+    One request per input line, one response per output line (in
+    completion order, matched by id).
+    """
+    lock = threading.Lock()
+    pending = []
+
+    def write(request):
+        with lock:
+            outfile.write(json.dumps(request.response()) + "\n")
+            outfile.flush()
+
+    for i, line in enumerate(infile):
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        data.setdefault("id", i)
+        request = parse_request(data, max_new_tokens)
+        request.callback = write
+        try:
+            pending.append(server.submit(request))
+        except KeyError as e:
+            request.error = f"Unknown adapter {e}"
+            write(request)
+    for request in pending:
+        request.done.wait()
+
+
+# Instructions of synthetic traffic
+synthetic_instructions = [
+    "What do you think about remote work?",
+    "How should cities deal with traffic?",
+    "What is the best way to learn a new language?",
+    "Is social media good for society?",
+]
+
+
+def serve_synthetic(server, n, adapter_names, max_new_tokens=256):
+    """
+    Submit n requests round-robin over the adapters and wait for all.
+    """
+    adapter_names = list(adapter_names) or [None]
+    pending = []
+    for i in range(n):
+        request = Request(
+            synthetic_instructions[i % len(synthetic_instructions)],
+            adapter=adapter_names[i % len(adapter_names)],
+            max_new_tokens=max_new_tokens,
+            id=i,
+        )
+        pending.append(server.submit(request))
+    for request in pending:
+        request.done.wait()
+    failed = [r for r in pending if r.error]
+    if failed:
+        print(f"[WARNING] {len(failed)} synthetic requests failed, e.g.: {failed[0].error}", file=sys.stderr)
+
+
+def serve_http(server, host, port, max_new_tokens=256):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, server.report())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                request = server.submit(parse_request(data, max_new_tokens))
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            request.done.wait()
+            self._reply(500 if request.error else 200, request.response())
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    print(f"[INFO] Serving on http://{host}:{port}", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting...", file=sys.stderr)
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=model_id, help="Base model (e.g. a tiny model for CPU tests)")
+    parser.add_argument("--adapters", nargs="*", default=adapters, help="OpinionGPT adapters to load (none = base model only)")
+    parser.add_argument("--device", default="cuda:2", help="Device, e.g. cuda:2 or cpu")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Maximum number of requests per batch")
+    parser.add_argument("--max-batch-tokens", type=int, default=4096, help="Token budget per batch (prompt + max_new_tokens)")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="How long to wait for more requests before running a batch")
+    parser.add_argument("--max-new-tokens", type=int, default=256, help="Default max_new_tokens of a request")
+    parser.add_argument("--prefix-cache-size", type=int, default=32, help="Cached instruction headers (adapter x subreddit), 0 disables the cache")
+    parser.add_argument("--adapter-pool", type=int, default=None, help="Load adapters on first use, keeping at most N resident")
+    parser.add_argument("--mixed-adapters", action="store_true", help="Run requests for different adapters in the same batch")
+    parser.add_argument("--synthetic", type=int, default=None, help="Send N synthetic requests instead of reading a front-end")
+    parser.add_argument("--http", type=int, default=None, help="Serve HTTP on this port instead of stdin/stdout JSON lines")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP host")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    pool = None
+    if args.adapter_pool:
+        model, tokenizer = load_model(args.model, [], args.device)
+        pool = AdapterPool(model, args.adapter_pool, adapter_registry(args.adapters))
+    else:
+        model, tokenizer = load_model(args.model, args.adapters, args.device)
+    model.eval()
+    print(f"[INFO] Done loading model in {time.time() - start_time:.1f}s.", file=sys.stderr)
+
+    prefix_cache = PrefixCache(args.prefix_cache_size) if args.prefix_cache_size > 0 else None
+    server = BatchServer(model, tokenizer, args.max_batch_size, args.max_batch_tokens, args.max_wait_ms / 1000,
+                         prefix_cache=prefix_cache, mixed_adapters=args.mixed_adapters, pool=pool)
+    if args.synthetic is not None:
+        serve_synthetic(server, args.synthetic, args.adapters, args.max_new_tokens)
+    elif args.http is not None:
+        serve_http(server, args.host, args.http, args.max_new_tokens)
+    else:
+        serve_jsonl(server, sys.stdin, sys.stdout, args.max_new_tokens)
+    server.close()
+    print(f"[INFO] {json.dumps(server.report())}", file=sys.stderr)
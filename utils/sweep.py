@@ -0,0 +1,340 @@
+"""""
+This module enables running merge and evaluation jobs of a sweep
+on several GPUs (or CPU worker slots) at the same time.
+
+Every device slot keeps its own queue of jobs. A slot that runs out of
+work takes the next job from the longest queue of another slot, so the
+sweep finishes as soon as the last device frees up.
+
+In pipelined mode a producer thread runs the merge steps of upcoming jobs
+on the CPU while the devices evaluate. At most `lookahead` merged models
+exist at any time; a slot is freed once a job has been cleaned up.
+"""""
+
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+
+# Human readable stage names for error messages
+stage_names = {
+    "merge": "Merge",
+    "eval": "Evaluation",
+}
+
+# Stages run by the producer thread in pipelined mode
+host_stages = {"merge"}
+
+
+@dataclass
+class Step:
+    """
+    One command of a job, e.g. a mergekit-yaml or a robbie.eval call.
+    If `func` is set, func(step, device) runs in-process instead of `cmd`.
+    """
+    stage: str
+    cmd: list
+    cwd: str = None
+    log_path: str = None
+    env: dict = None
+    func: object = None
+
+
+@dataclass
+class Job:
+    """
+    A merge+eval job: steps run in order, the job stops at the first failure.
+    Paths in `cleanup` are removed (callables are called) once the job is done.
+    """
+    tag: str
+    steps: list
+    label: str = None
+    cleanup: list = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.label is None:
+            self.label = self.tag
+
+
+def parse_devices(values):
+    """
+    Turn --gpu-id values into a list of device slots:
+    - "0", "1", ... -> one slot on that GPU
+    - "0,1"         -> one slot per listed GPU
+    - "cpu"         -> one CPU worker slot (repeat for more slots)
+    """
+    devices = []
+    for value in values:
+        for device in str(value).split(","):
+            device = device.strip()
+            if not device:
+                continue
+            if device != "cpu" and not device.isdigit():
+                raise ValueError(f"Unsupported device '{device}', expected a GPU id or 'cpu'")
+            devices.append(device)
+    if not devices:
+        raise ValueError("At least one device is required")
+    return devices
+
+
+def mergekit_command(config_path, output_path, cuda=True):
+    """
+    Build the mergekit-yaml call shared by all drivers.
+    """
+    cmd = [
+        "mergekit-yaml",
+        config_path,
+        output_path,
+        "--lazy-unpickle",
+        "--allow-crimes",
+        "--random-seed", "42",
+        "--safe-serialization",
+        "--write-model-card",
+        "--trust-remote-code",
+    ]
+    if cuda:
+        cmd.append("--cuda")
+    return cmd
+
+
+def native_merge_command(config_path, output_path):
+    """
+    Drop-in for mergekit_command using the streaming linear merge engine.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "linear_merge.py")
+    return [sys.executable, script, config_path, output_path]
+
+
+def lora_merge_command(config_path, output_path):
+    """
+    Build a linear combination as one low-rank adapter instead of a full checkpoint.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lora_merge.py")
+    return [sys.executable, script, config_path, output_path]
+
+
+def lora_composable(config):
+    """
+    Whether a merge config can be built with lora_merge_command: a
+    normalized linear merge (see lora_merge.compose).
+    """
+    if config.get("merge_method") != "linear":
+        return False
+    return config.get("normalize", config.get("parameters", {}).get("normalize", True))
+
+
+def device_env(device, extra=None):
+    """
+    Environment for a subprocess pinned to one device slot.
+    """
+    env = os.environ.copy()
+    env["CUDA_VISIBLE_DEVICES"] = "" if device == "cpu" else device
+    if extra:
+        env.update(extra)
+    return env
+
+
+def device_command(cmd, device):
+    """
+    Command adapted to the device slot it runs on. Drivers build their
+    commands for a GPU; on a CPU slot mergekit loses --cuda and
+    robbie.eval gets --device cpu.
+    """
+    if device != "cpu":
+        return list(cmd)
+    cmd = [a for a in cmd if a != "--cuda"]
+    return ["cpu" if i and cmd[i - 1] == "--device" else a for i, a in enumerate(cmd)]
+
+
+def run_step(step, device):
+    """
+    Run one step on a device, writing its output to the step log.
+    Raises subprocess.CalledProcessError on failure.
+    """
+    if step.func is not None:
+        step.func(step, device)
+        return
+    cmd = device_command(step.cmd, device)
+    env = device_env(device, step.env)
+    if step.log_path is None:
+        subprocess.run(cmd, cwd=step.cwd, env=env, check=True)
+        return
+    with open(step.log_path, "w") as log_f:
+        subprocess.run(
+            cmd,
+            cwd=step.cwd,
+            stdout=log_f, stderr=subprocess.STDOUT,
+            check=True,
+            env=env,
+        )
+
+
+def remove_paths(paths):
+    for path in paths:
+        if callable(path):
+            path()
+            continue
+        try:
+            if os.path.lexists(path):
+                subprocess.run(["rm", "-rf", path])
+        except Exception:
+            print(f"[WARNING] Could not delete {path}")
+
+
+class DeviceScheduler:
+    """
+    Distribute jobs over device slots and run them until all queues are empty.
+    With lookahead > 0, merges run ahead of the evaluations (pipelined mode).
+    With a manifest, finished tags are skipped and every stage is journaled.
+    """
+
+    def __init__(self, devices, lookahead=0, manifest=None):
+        self.devices = list(devices)
+        self.lookahead = lookahead
+        self.manifest = manifest
+        self.queues = [deque() for _ in self.devices]
+        self.failures = []
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        if self.manifest is not None and self.manifest.is_done(job.tag):
+            self.skipped += 1
+            return
+        with self._lock:
+            shortest = min(range(len(self.queues)), key=lambda i: len(self.queues[i]))
+            self.queues[shortest].append(job)
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues)
+
+    def _next_job(self, slot=None):
+        with self._lock:
+            if slot is not None and self.queues[slot]:
+                return self.queues[slot].popleft()
+            # Own queue is empty: take work from the busiest slot
+            longest = max(range(len(self.queues)), key=lambda i: len(self.queues[i]))
+            if self.queues[longest]:
+                if slot is None:
+                    return self.queues[longest].popleft()
+                return self.queues[longest].pop()
+        return None
+
+    def _report(self, message, exc=False):
+        with self._lock:
+            print(message)
+            if exc:
+                traceback.print_exc()
+
+    def _run_steps(self, job, steps, device):
+        """
+        Run steps in order, returns False at the first failing step.
+        """
+        for step in steps:
+            step_start = time.time()
+            try:
+                run_step(step, device)
+            except Exception:
+                with self._lock:
+                    self.failures.append((job.tag, step.stage))
+                name = stage_names.get(step.stage, step.stage)
+                self._report(f"[ERROR] {name} failed for: {job.label}", exc=True)
+                if self.manifest is not None:
+                    self.manifest.record_stage(job.tag, step.stage, time.time() - step_start, ok=False, device=device)
+                return False
+            if self.manifest is not None:
+                self.manifest.record_stage(job.tag, step.stage, time.time() - step_start, device=device)
+        return True
+
+    def _finish(self, job, device, start_time):
+        elapsed = time.time() - start_time
+        mins, secs = divmod(elapsed, 60)
+        where = "CPU" if device == "cpu" else f"GPU {device}"
+        self._report(f"[INFO] Finished {job.label} on {where} in {int(mins)}m {int(secs)}s.")
+
+    def run_job(self, job, device):
+        """
+        Run all steps of one job on a device. Returns True on success.
+        """
+        start_time = time.time()
+        try:
+            if not self._run_steps(job, job.steps, device):
+                return False
+        finally:
+            # Cleanup merged model to save space
+            remove_paths(job.cleanup)
+        self._finish(job, device, start_time)
+        return True
+
+    def _worker(self, slot):
+        device = self.devices[slot]
+        while True:
+            job = self._next_job(slot)
+            if job is None:
+                return
+            self.run_job(job, device)
+
+    def _producer(self, ready, free_slots):
+        """
+        Merge upcoming jobs on the CPU, never more than `lookahead` ahead.
+        """
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            free_slots.acquire()
+            start_time = time.time()
+            host_steps = [s for s in job.steps if s.stage in host_stages]
+            if self._run_steps(job, host_steps, "cpu"):
+                ready.put((job, start_time))
+            else:
+                remove_paths(job.cleanup)
+                free_slots.release()
+        for _ in self.devices:
+            ready.put(None)
+
+    def _consumer(self, slot, ready, free_slots):
+        device = self.devices[slot]
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            job, start_time = item
+            device_steps = [s for s in job.steps if s.stage not in host_stages]
+            try:
+                ok = self._run_steps(job, device_steps, device)
+            finally:
+                remove_paths(job.cleanup)
+                free_slots.release()
+            if ok:
+                self._finish(job, device, start_time)
+
+    def run(self):
+        """
+        Run all submitted jobs and return the list of (tag, stage) failures.
+        """
+        if self.skipped:
+            print(f"[INFO] Skipping {self.skipped} tags already evaluated according to the manifest.")
+        if self.lookahead > 0:
+            ready = queue.Queue()
+            free_slots = threading.Semaphore(self.lookahead)
+            threads = [threading.Thread(target=self._producer, args=(ready, free_slots), daemon=True)]
+            threads += [
+                threading.Thread(target=self._consumer, args=(slot, ready, free_slots), daemon=True)
+                for slot in range(len(self.devices))
+            ]
+        else:
+            threads = [
+                threading.Thread(target=self._worker, args=(slot,), daemon=True)
+                for slot in range(len(self.devices))
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.failures
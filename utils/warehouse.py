@@ -0,0 +1,360 @@
+"""""
+This module enables a columnar warehouse of robbie evaluation outputs.
+
+Result files (JSONL, JSON or CSV) below the result directories of the
+drivers are streamed into one Parquet dataset, partitioned (hive style) by
+dataset, method, combination and weight:
+
+    <warehouse>/dataset=holisticbiasr/method=linear/combination=men-american/weight=05-05/part-<id>.parquet
+
+The partition values come from the tag of the evaluated model, which is
+part of the result path (the drivers pass merged_.../<tag> as --model-id).
+Nested fields are flattened to dotted columns, numbers become float64.
+
+Ingest is incremental: a state file records size and mtime of every source
+file, so a re-run only reads new or changed files (and replaces their
+parts). Group-by queries go through pyarrow.dataset, which only reads the
+partitions and columns they need.
+
+Usage:
+    python warehouse.py ingest --warehouse results_wh --dataset holisticbiasr --results-dir ResponsibleNLP/result_combined_4
+    python warehouse.py query --warehouse results_wh --group-by method combination --metric <score column> --where dataset=holisticbiasr
+"""""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+
+# Merge methods used by the drivers, longest first for prefix matching
+merge_methods = sorted([
+    "linear", "task_arithmetic", "ties", "dare_linear", "dare_ties", "della",
+    "della_linear", "breadcrumbs", "breadcrumbs_ties", "sce",
+], key=len, reverse=True)
+
+# Parameter names as they appear in tags (select_top_k contains underscores)
+param_names = ["select_top_k", "normalize", "weight", "lambda", "density", "gamma", "epsilon"]
+model_prefix = "phi3"
+
+partition_keys = ["dataset", "method", "combination", "weight"]
+state_name = "_ingested.json"
+result_suffixes = (".jsonl", ".json", ".csv")
+
+
+def parse_tag(tag):
+    """
+    Method, models and raw parameter values of a driver tag, e.g.
+    linear_phi3_men_phi3_american_w05-05 or
+    ties_phi3_liberal_phi3_men_weight[03, 03]_lambda1_density05.
+    Tags without a merge method (base evaluations) get method "base".
+    Parameter values keep the tag encoding (the decimal point is dropped).
+    """
+    method = next((m for m in merge_methods if tag.startswith(m + "_")), None)
+    rest = tag[len(method) + 1:] if method else tag
+    if method is None:
+        return {"method": "base", "models": [tag], "params": {}}
+
+    models, params = [], {}
+    tokens = rest.replace("select_top_k", "select-top-k").split("_")
+    for token in tokens:
+        key = next((p for p in param_names if token.startswith(p.replace("_", "-"))), None)
+        if key is not None:
+            params[key] = token[len(key):]
+        elif re.fullmatch(r"w[0-9.\-]+", token):
+            params["weight"] = token[1:]
+        elif token == model_prefix or not models:
+            models.append(token)
+        else:
+            models[-1] += "_" + token
+    return {"method": method, "models": models, "params": params}
+
+
+def short_name(model):
+    return model[len(model_prefix) + 1:] if model.startswith(model_prefix + "_") else model
+
+
+def partition_values(dataset, tag):
+    parsed = parse_tag(tag)
+    weight = parsed["params"].get("weight", "none")
+    weight = "-".join(re.findall(r"[0-9.]+", weight)) or "none"
+    return {
+        "dataset": dataset,
+        "method": parsed["method"],
+        "combination": "-".join(short_name(m) for m in parsed["models"]),
+        "weight": weight,
+    }
+
+
+def find_tag(path, known_tags=None):
+    """
+    Tag of a result file: the deepest path component (or file stem) that
+    is a known tag or starts with a merge method or the model prefix.
+    """
+    parts = path.replace("\\", "/").split("/")
+    parts[-1] = os.path.splitext(parts[-1])[0]
+    for part in reversed(parts):
+        if known_tags is not None and part in known_tags:
+            return part
+        if any(part.startswith(m + "_" + model_prefix) for m in merge_methods):
+            return part
+        if part.startswith(model_prefix + "_"):
+            return part
+    return None
+
+
+def flatten(record, prefix=""):
+    """
+    Nested dicts become dotted keys, lists become JSON strings.
+    """
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (list, tuple)):
+            flat[name] = json.dumps(value)
+        else:
+            flat[name] = value
+    return flat
+
+
+def iter_records(path):
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record if isinstance(record, dict) else {"value": record}
+    elif path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for record in (data if isinstance(data, list) else [data]):
+            yield record if isinstance(record, dict) else {"value": record}
+    elif path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield {k: number_or_text(v) for k, v in row.items()}
+
+
+def number_or_text(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def column_type(values):
+    import pyarrow as pa
+
+    seen = [v for v in values if v is not None]
+    if seen and all(isinstance(v, bool) for v in seen):
+        return pa.bool_()
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in seen):
+        return pa.float64()
+    return pa.string()
+
+
+def coerce(value, arrow_type):
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if arrow_type == pa.float64():
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    if arrow_type == pa.bool_():
+        return value if isinstance(value, bool) else None
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def rows_to_table(rows, schema=None):
+    """
+    Arrow table of flat rows. The first batch of a file fixes the schema;
+    later batches are coerced to it (new keys are dropped).
+    """
+    import pyarrow as pa
+
+    if schema is None:
+        keys = list(dict.fromkeys(k for row in rows for k in row))
+        schema = pa.schema([(k, column_type([row.get(k) for row in rows])) for k in keys])
+    columns = [
+        pa.array([coerce(row.get(field.name), field.type) for row in rows], type=field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class Warehouse:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.state_path = os.path.join(root, state_name)
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        tmp_path = f"{self.state_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def part_path(self, partition, source):
+        part_dir = os.path.join(self.root, *(f"{k}={partition[k]}" for k in partition_keys))
+        part_id = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(part_dir, f"part-{part_id}.parquet")
+
+    def ingest_file(self, path, dataset, tag, batch_size=50000):
+        """
+        Streams one result file into its partition; returns the row count.
+        """
+        import pyarrow.parquet as pq
+
+        partition = partition_values(dataset, tag)
+        part_path = self.part_path(partition, path)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        tmp_path = f"{part_path}.tmp{os.getpid()}"
+        writer, schema, rows, count = None, None, [], 0
+
+        def flush():
+            nonlocal writer, schema
+            table = rows_to_table(rows, schema)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+            writer.write_table(table)
+
+        for record in iter_records(path):
+            row = flatten(record)
+            row.update(tag=tag, source=os.path.basename(path))
+            rows.append(row)
+            count += 1
+            if len(rows) >= batch_size:
+                flush()
+                rows = []
+        if rows:
+            flush()
+        if writer is None:
+            return 0, None
+        writer.close()
+        os.replace(tmp_path, part_path)
+        return count, part_path
+
+    def ingest(self, results_dirs, dataset, known_tags=None):
+        """
+        Ingests new or changed result files below results_dirs.
+        """
+        new_files = skipped = rows = 0
+        start_time = time.time()
+        for results_dir in results_dirs:
+            for dirpath, _, filenames in os.walk(results_dir):
+                for filename in sorted(filenames):
+                    if not filename.endswith(result_suffixes):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    key = os.path.abspath(path)
+                    entry = self.state.get(key)
+                    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                        skipped += 1
+                        continue
+                    tag = find_tag(os.path.relpath(path, results_dir), known_tags)
+                    if tag is None:
+                        print(f"[WARNING] No tag found in {path}, skipping.")
+                        continue
+                    # A changed file replaces its earlier part
+                    if entry and entry.get("part") and os.path.exists(entry["part"]):
+                        os.remove(entry["part"])
+                    count, part_path = self.ingest_file(path, dataset, tag)
+                    self.state[key] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "tag": tag,
+                        "rows": count,
+                        "part": part_path,
+                    }
+                    new_files += 1
+                    rows += count
+                    # Keep the state current, an interrupted ingest resumes
+                    if new_files % 100 == 0:
+                        self.save_state()
+        self.save_state()
+        print(f"[INFO] Ingested {new_files} files ({rows} rows), {skipped} unchanged files skipped "
+              f"in {time.time() - start_time:.1f}s.")
+        return new_files
+
+    def dataset(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        parts = [e["part"] for e in self.state.values() if e.get("part") and os.path.exists(e["part"])]
+        if not parts:
+            raise ValueError(f"Warehouse {self.root} is empty")
+        # Result files may have different columns, read with the union of their schemas
+        partition_schema = pa.schema([(k, pa.string()) for k in partition_keys])
+        schema = pa.unify_schemas([ds.dataset(p, format="parquet").schema for p in parts] + [partition_schema])
+        partitioning = ds.partitioning(partition_schema, flavor="hive")
+        return ds.dataset(parts, schema=schema, format="parquet", partitioning=partitioning,
+                          partition_base_dir=self.root)
+
+    def query(self, group_by, metrics, where=None):
+        """
+        Mean, standard deviation and count of each metric per group.
+        where: {column: value} equality filters (pushed down to the scan).
+        """
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+
+        expression = None
+        for column, value in (where or {}).items():
+            condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+        table = self.dataset().to_table(columns=list(group_by) + list(metrics), filter=expression)
+        aggregations = [(m, a) for m in metrics for a in ("mean", "stddev", "count")]
+        result = table.group_by(list(group_by)).aggregate(aggregations)
+        return result.sort_by([(g, "ascending") for g in group_by])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Ingest new or changed result files")
+    ingest_parser.add_argument("--warehouse", required=True, help="Warehouse directory")
+    ingest_parser.add_argument("--dataset", required=True, help="Dataset partition, e.g. holisticbiasr or advpromptset")
+    ingest_parser.add_argument("--results-dir", nargs="+", required=True, help="Result directories of the drivers")
+    ingest_parser.add_argument("--manifest", nargs="*", default=[], help="Run manifests whose tags are matched exactly")
+
+    query_parser = subparsers.add_parser("query", help="Group-by aggregation over the warehouse")
+    query_parser.add_argument("--warehouse", required=True, help="Warehouse directory")
+    query_parser.add_argument("--group-by", nargs="+", default=["method", "combination", "weight"], help="Group columns")
+    query_parser.add_argument("--metric", nargs="+", required=True, help="Numeric columns to aggregate")
+    query_parser.add_argument("--where", nargs="*", default=[], help="column=value filters")
+    query_parser.add_argument("--output", default=None, help="Write the result as CSV")
+    args = parser.parse_args()
+
+    warehouse = Warehouse(args.warehouse)
+    if args.command == "ingest":
+        known_tags = None
+        if args.manifest:
+            from manifest import RunManifest
+
+            known_tags = set()
+            for manifest_path in args.manifest:
+                known_tags.update(RunManifest(manifest_path).states)
+        warehouse.ingest(args.results_dir, args.dataset, known_tags)
+    else:
+        where = dict(condition.split("=", 1) for condition in args.where)
+        start_time = time.time()
+        result = warehouse.query(args.group_by, args.metric, where)
+        print(f"[INFO] {result.num_rows} groups in {time.time() - start_time:.2f}s")
+        if args.output:
+            import pyarrow.csv as pacsv
+
+            pacsv.write_csv(result, args.output)
+        else:
+            for row in result.to_pylist():
+                print("  ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in row.items()))